@@ -1,5 +1,18 @@
 
-from .evdump import evdump as evdump
-from .rec import rec_digits as rec_digits
+# The command line tools are only imported when they are accessed, so that
+# importing a single module of the package does not load all of them.
+_commands = dict(
+    evdump="evdump", rec_digits="rec", raw2pedestal="pedestal",
+    rawsynth="synthetic", rawbench="benchmark")
+
+def __getattr__(name):
+    if name in _commands:
+        import importlib
+        module = importlib.import_module("." + _commands[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_commands))
 # from .trdfeeparser import TrdFeeParser
 # from .trdfeeparser import check_dword, logflt
@@ -0,0 +1,141 @@
+
+import numpy as np
+
+from . import geometry
+
+
+class DigitsAccumulator:
+    """Digits sink that collects the digits of an event in a dense array
+
+    The array is indexed either by [det, padrow, padcol, tb] (layout "pad")
+    or by [det, rob, mcm, channel, tb] (layout "mcm"). It is allocated once,
+    when the first digits arrive, and reused for all events. Only the MCMs
+    that received data are cleared between events.
+
+    At the end of every event, i.e. when TrdFeeParser.next_event() is
+    called, the callback is called with the event number and the
+    accumulator itself. The callback can access the whole array as `data`,
+    or views for single detectors with detector(). The contents are only
+    valid until the callback returns.
+
+    The accumulator can be used directly as the store_digits sink of the
+    parser, or as a batch sink behind a DigitsBatcher, e.g. in a DigitsTee
+    or after a ZeroSuppression stage.
+
+    Arguments:
+      callback  : function(event, accumulator) called at the end of events
+      ntimebins : number of time bins in the array
+      layout    : "pad" or "mcm"
+      detectors : detector numbers to be stored (default: all)"""
+
+    def __init__(self, callback=None, ntimebins=30, layout="pad", detectors=None):
+        if layout not in ("pad", "mcm"):
+            raise ValueError(f"Invalid layout '{layout}'")
+
+        self.callback = callback
+        self.ntimebins = ntimebins
+        self.layout = layout
+        self.data = None
+
+        # map detector numbers to the first index of the array
+        if detectors is None:
+            detectors = range(geometry.ndet)
+        self._detectors = np.array(detectors, dtype=int)
+        self._slot = np.full(geometry.ndet, -1, dtype=int)
+        self._slot[self._detectors] = np.arange(len(self._detectors))
+
+        # MCMs with data in the current event
+        self._touched = np.zeros(
+            (len(self._detectors), geometry.nrob, geometry.nmcm), dtype=bool)
+        self._event = None
+
+    def _allocate(self):
+        if self.layout == "pad":
+            shape = (geometry.get_nrow(0), geometry.ncol)
+        else:
+            shape = (geometry.nrob, geometry.nmcm, geometry.nadc)
+
+        shape = (len(self._detectors),) + shape + (self.ntimebins,)
+        self.data = np.zeros(shape, dtype=np.uint16)
+
+    def __call__(self, ev, det, rob, mcm, ch, digits):
+        slot = self._slot[det]
+        if slot < 0:
+            return
+
+        if self.data is None:
+            self._allocate()
+
+        self._event = ev
+        self._touched[slot, rob, mcm] = True
+        n = min(len(digits), self.ntimebins)
+
+        if self.layout == "mcm":
+            self.data[slot, rob, mcm, ch, :n] = digits[:n]
+            return
+
+        idx = (geometry.get_stack(det), rob % 2, rob, mcm, ch)
+        padcol = geometry.padcol_table[idx]
+        if padcol >= 0:
+            self.data[slot, geometry.padrow_table[idx], padcol, :n] = digits[:n]
+
+    def process_batch(self, batch):
+        slot = self._slot[batch['det']]
+        if self.layout == "pad":
+            sel = (slot >= 0) & (batch['padcol'] >= 0)
+        else:
+            sel = slot >= 0
+
+        batch, slot = batch[sel], slot[sel]
+        if len(batch) == 0:
+            return
+
+        if self.data is None:
+            self._allocate()
+
+        self._event = batch['event'][-1]
+        self._touched[slot, batch['rob'], batch['mcm']] = True
+        n = min(batch['adc'].shape[1], self.ntimebins)
+
+        if self.layout == "mcm":
+            self.data[slot, batch['rob'], batch['mcm'], batch['channel'], :n] = batch['adc'][:, :n]
+        else:
+            self.data[slot, batch['padrow'], batch['padcol'], :n] = batch['adc'][:, :n]
+
+    def detectors(self):
+        """Return the detector numbers with data in the current event"""
+        return self._detectors[self._touched.any(axis=(1, 2))]
+
+    def detector(self, det):
+        """Return a view of the array for one detector"""
+        return self.data[self._slot[det]]
+
+    def end_event(self, event):
+        if self.callback is not None and self._touched.any():
+            self.callback(event, self)
+        self.clear()
+
+    def clear(self):
+        """Reset the ADC values of all MCMs that received data"""
+
+        slot, rob, mcm = np.nonzero(self._touched)
+        if len(slot) == 0:
+            return
+
+        if self.layout == "mcm":
+            self.data[slot, rob, mcm] = 0
+
+        else:
+            idx = (geometry.get_stack(self._detectors[slot]), rob % 2, rob, mcm)
+            padrow = geometry.padrow_table[idx]
+            padcol = geometry.padcol_table[idx]
+            slot = np.broadcast_to(slot[:, None], padcol.shape)
+            valid = padcol >= 0
+            self.data[slot[valid], padrow[valid], padcol[valid]] = 0
+
+        self._touched[:] = False
+
+    def close(self):
+        """Hand out the last event, if it was not terminated by next_event()"""
+        if self._touched.any():
+            self.end_event(self._event)
@@ -3,6 +3,8 @@ import numpy # probably overkill - replace with struct.unpack?
 import logging
 import struct
 
+from . import dumpwriter
+
 class BaseParser:
     """Parser base class
     
@@ -48,9 +50,18 @@ class DumpParser(BaseParser):
 
 
 class BaseHeader:
+    """Base class for headers decoded with a BitStruct
+
+    The raw data is retained, and the fields are only decoded when they are
+    accessed. Descriptions for the hexdump are built by hexdump_desc(),
+    which is only called when the header is dumped."""
+
+    __slots__ = ("_addr", "_data", "_values")
+
     header_size = 0
     _hexdump_fmt = ('\033[1;37;40m', '\033[0;37;100m')
     _hexdump_desc = ("")
+    _hexdump_kind = "HDR"
 
     def __init__(self, data, addr):
         if not isinstance(data, bytes) or len(data) != self.header_size:
@@ -59,11 +70,8 @@ class BaseHeader:
 
         self._addr = addr
         self._data = data
-        # print(self.keys())
-        # print(self.unpack(data))
-        for k, v in zip(self.keys(), self.unpack(data)):
-            setattr(self,k,v)
-        
+        self._values = None
+
     @classmethod
     def read(cls, stream):
         addr = stream.tell()
@@ -73,24 +81,16 @@ class BaseHeader:
         # header.hexdump()
         return header
 
-    def hexdump(self, logger):
-        for i, words in enumerate(struct.iter_unpack("<L", self._data)):
-
-            if len(self._hexdump_desc) == 1:
-                desc = self._hexdump_desc
-            else:
-                desc = self._hexdump_desc[i]
-
-            if len(self._hexdump_fmt) == 1:
-                fmt = self._hexdump_fmt[0]
-            elif len(self._hexdump_fmt) == 2:
-                fmt = self._hexdump_fmt[0] if i==0 else (self._hexdump_fmt[1])
-            else:
-                fmt = self._hexdump_fmt[i]
+    def hexdump(self):
+        dumpwriter.get_writer().header(self)
 
-            # self.dump_dword(addr+4*i, words[0], txt)
-            logger.info(fmt+desc, extra=dict(hexaddr=self._addr+4*i, hexdata=words[0]))
+    def hexdump_desc(self):
+        """Return the format strings to describe each dword of the header"""
+        return self._hexdump_desc
 
+    def asdict(self):
+        """Return the decoded fields as a dict"""
+        return dict(zip(self.keys(), self.unpack(self._data)))
 
     def unpack(self, data):
         pass
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Benchmarks for the readers, parsers and digits sinks
+
+Every benchmark processes sample data and reports the throughput in MB/s
+and events/s. The sample files are generated with the synthetic data
+generator if they are not found in the data directory, so benchmarks can
+run on generated or on checked-in data. Results are stored as JSON, and
+can be compared against a baseline to catch performance regressions."""
+
+import click
+import fnmatch
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .accumulator import DigitsAccumulator
+from .clusters import ClusterFinder
+from .digits import DigitsBatcher
+from .digitsfile import DigitsFileWriter
+from .factory import make_reader
+from .histogram import AdcHistogram
+from .pedestal import PedestalCalculator
+from .rawlogging import ColorFormatter
+from .rec import digits_csv_file
+from .synthetic import SyntheticEvents, make_writer, parse_size, start_time
+from .tfreader import RawDataHeader
+from .tracklets import TrackletBatcher
+from .trdfeeparser import TrdFeeParser
+from .zerosuppression import ZeroSuppression
+
+logger = logging.getLogger(__name__)
+
+
+# Sample files and the settings of the generator to produce them
+samples = {
+    "zs.bin": dict(hcids=[0], zs=True, occupancy=0.05),
+    "nozs.bin": dict(hcids=[0], zs=False, occupancy=0.05),
+    "zs.o32": dict(hcids=[0], zs=True, occupancy=0.05, tracklet_format="run2"),
+    "zs.tf": dict(hcids=range(15), zs=True, occupancy=0.05),
+}
+
+
+class SampleData:
+    """Access to the sample data, which is generated on demand
+
+    Arguments:
+      directory : location of the sample files
+      size      : size of generated files in bytes
+      scratch   : directory for output files (default: directory)"""
+
+    def __init__(self, directory, size=1 << 20, scratch=None):
+        self.directory = directory
+        self.size = size
+        self.scratch = directory if scratch is None else scratch
+        self._cache = dict()
+
+    def path(self, name):
+        """Return the path of a sample file, generate it if necessary"""
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            logger.info(f"Generating {self.size} bytes of sample data: {path}")
+            generator = SyntheticEvents(seed=1, **samples[name])
+            with make_writer(path) as writer:
+                event = 0
+                while writer.tell() < self.size:
+                    links, _ = generator.generate(event)
+                    writer.write_event(links, timestamp=start_time + 1e-3*event)
+                    event += 1
+        return path
+
+    def events(self, zs=True, ntb=30):
+        """Return (links, truth) of synthetic events in memory
+
+        The events are generated once for every setting, and contain
+        about `size` bytes."""
+
+        key = (zs, ntb)
+        if key not in self._cache:
+            generator = SyntheticEvents(hcids=range(15), zs=zs, ntb=ntb,
+                                        occupancy=0.05, seed=1)
+            events, nbytes = list(), 0
+            while nbytes < self.size:
+                links, truth = generator.generate(len(events))
+                events.append((links, truth))
+                nbytes += sum(4*len(x) for x in links)
+            self._cache[key] = events
+        return self._cache[key]
+
+    def digits(self):
+        """Return the digits of the ZS events as argument tuples for the
+        store_digits callback, one list per event"""
+
+        if "digits" not in self._cache:
+            self._cache["digits"] = [
+                [(int(d['event']), int(d['det']), int(d['rob']), int(d['mcm']),
+                  int(d['channel']), d['adc']) for d in truth['digits']]
+                for links, truth in self.events(zs=True)]
+        return self._cache["digits"]
+
+    def rdh_pages(self, n=50000):
+        """Return the raw data of n RDHs, without payload"""
+
+        if "rdh" not in self._cache:
+            self._cache["rdh"] = b"".join(RawDataHeader.pack(
+                version=6, hdrsize=64, offset=0x2000, datasize=0x2000,
+                pagecnt=i & 0xFFFF, orbit=i) for i in range(n))
+        return self._cache["rdh"]
+
+
+class EventCounter(TrackletBatcher):
+    """Tracklet sink that counts the events, and drops the tracklets"""
+
+    def __init__(self):
+        super().__init__()
+        self.nevents = 0
+
+    def end_event(self, event):
+        self.nevents += 1
+
+
+# ------------------------------------------------------------------------
+# Benchmarks
+#
+# Every benchmark is a function that takes the SampleData and returns the
+# number of bytes and events it processed. The decorator registers it.
+
+benchmarks = dict()
+
+class benchmark:
+    """Decorator to register a benchmark function under a name"""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def __call__(self, func):
+        func.description = self.description
+        benchmarks[self.name] = func
+        return func
+
+
+def run_reader(filename, **kwargs):
+    counter = EventCounter()
+    reader = make_reader(filename)
+    reader.add_trd_parser(store_tracklets=counter, **kwargs)
+    reader.process()
+    return os.path.getsize(filename), counter.nevents
+
+@benchmark("minidaq-zs", "MiniDaqReader, ZS data, digits mode")
+def bench_minidaq_zs(data):
+    return run_reader(data.path("zs.bin"), store_digits=DigitsBatcher())
+
+@benchmark("minidaq-nozs", "MiniDaqReader, non-ZS data, digits mode")
+def bench_minidaq_nozs(data):
+    return run_reader(data.path("nozs.bin"), store_digits=DigitsBatcher())
+
+@benchmark("minidaq-tracklets", "MiniDaqReader, ZS data, tracklet mode")
+def bench_minidaq_tracklets(data):
+    return run_reader(data.path("zs.bin"), mode="tracklets")
+
+@benchmark("o32-zs", "o32reader, ZS data, digits mode")
+def bench_o32_zs(data):
+    return run_reader(data.path("zs.o32"), store_digits=DigitsBatcher(),
+                      tracklet_format="run2")
+
+@benchmark("tf-zs", "TimeFrameReader and TrdCruParser, ZS data, digits mode")
+def bench_tf_zs(data):
+    return run_reader(data.path("zs.tf"), store_digits=DigitsBatcher())
+
+
+def run_feeparser(events, **kwargs):
+    """Parse links from memory, without any reader"""
+    counter = EventCounter()
+    parser = TrdFeeParser(store_tracklets=counter, **kwargs)
+
+    nbytes = 0
+    for links, _ in events:
+        for link in links:
+            stream = io.BytesIO(link.tobytes())
+            parser.parse(stream, 4*len(link))
+            nbytes += 4*len(link)
+        parser.next_event()
+    return nbytes, counter.nevents
+
+@benchmark("fee-zs", "TrdFeeParser, ZS data, digits mode")
+def bench_fee_zs(data):
+    return run_feeparser(data.events(zs=True), store_digits=DigitsBatcher())
+
+@benchmark("fee-nozs", "TrdFeeParser, non-ZS data, digits mode")
+def bench_fee_nozs(data):
+    return run_feeparser(data.events(zs=False), store_digits=DigitsBatcher())
+
+@benchmark("fee-tracklets", "TrdFeeParser, ZS data, tracklet mode")
+def bench_fee_tracklets(data):
+    return run_feeparser(data.events(zs=True), mode="tracklets")
+
+
+@benchmark("rdh-header", "RawDataHeader objects, access to two fields")
+def bench_rdh_header(data):
+    raw = data.rdh_pages()
+    for addr in range(0, len(raw), RawDataHeader.header_size):
+        hdr = RawDataHeader(raw[addr:addr+RawDataHeader.header_size], addr)
+        hdr.datasize, hdr.orbit
+    return len(raw), len(raw) // RawDataHeader.header_size
+
+@benchmark("rdh-array", "RawDataHeader.unpack_array, bulk decoding")
+def bench_rdh_array(data):
+    raw = data.rdh_pages()
+    hdrs = RawDataHeader.unpack_array(raw)
+    return len(raw), len(hdrs)
+
+
+def run_sink(data, sink):
+    """Pass the digits of the sample events to a sink, like the parser"""
+
+    events = data.digits()
+    for event, digits in enumerate(events):
+        for args in digits:
+            sink(*args)
+        if hasattr(sink, "end_event"):
+            sink.end_event(event)
+    sink.close()
+
+    nbytes = sum(truth['digits'].nbytes for links, truth in data.events(zs=True))
+    return nbytes, len(events)
+
+@benchmark("sink-csv", "digits sink: CSV file")
+def bench_sink_csv(data):
+    return run_sink(data, digits_csv_file(os.path.join(data.scratch, "digits.csv")))
+
+@benchmark("sink-native", "digits sink: native digits file")
+def bench_sink_native(data):
+    return run_sink(data, DigitsFileWriter(os.path.join(data.scratch, "digits.trdd")))
+
+@benchmark("sink-pedestal", "digits sink: pedestal calculation")
+def bench_sink_pedestal(data):
+    return run_sink(data, PedestalCalculator())
+
+@benchmark("sink-histogram", "digits sink: ADC histograms")
+def bench_sink_histogram(data):
+    return run_sink(data, AdcHistogram(ndet=8))
+
+@benchmark("sink-zs", "digits sink: zero suppression")
+def bench_sink_zs(data):
+    return run_sink(data, ZeroSuppression(DigitsBatcher()))
+
+@benchmark("sink-accumulator", "digits sink: dense event arrays")
+def bench_sink_accumulator(data):
+    return run_sink(data, DigitsAccumulator())
+
+@benchmark("sink-clusters", "digits sink: dense event arrays and cluster finder")
+def bench_sink_clusters(data):
+    return run_sink(data, DigitsAccumulator(ClusterFinder(lambda ev, cl: None)))
+
+
+# ------------------------------------------------------------------------
+# Running and comparing
+
+def run(names, data, repeat=3):
+    """Run benchmarks, and return the best result of `repeat` runs each"""
+
+    results = dict()
+    for name in names:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            nbytes, nevents = benchmarks[name](data)
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best[0]:
+                best = (seconds, nbytes, nevents)
+
+        seconds, nbytes, nevents = best
+        results[name] = dict(
+            seconds=seconds, bytes=nbytes, events=nevents,
+            mbps=nbytes / seconds / 1e6, evps=nevents / seconds)
+        logger.info(f"{name:20s} {results[name]['mbps']:8.2f} MB/s "
+                    f"{results[name]['evps']:10.1f} events/s")
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results with a baseline
+
+    Returns a list of (name, baseline MB/s, current MB/s, ratio, status)
+    for all benchmarks in both. The status is "REGRESSION" if the
+    throughput dropped by more than the tolerance (as a fraction), and
+    "improved" if it increased by more than the tolerance."""
+
+    rows = list()
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        ratio = res['mbps'] / baseline[name]['mbps']
+        if ratio < 1 - tolerance:
+            status = "REGRESSION"
+        elif ratio > 1 + tolerance:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, baseline[name]['mbps'], res['mbps'], ratio, status))
+    return rows
+
+
+@click.command()
+@click.argument('patterns', nargs=-1)
+@click.option('-d', '--data', 'datadir', default=None, help="Directory with sample data (default: temporary)")
+@click.option('-S', '--size', default="1M", help="Size of generated sample data, e.g. 64M")
+@click.option('-r', '--repeat', default=3, help="Number of runs, the fastest one is reported")
+@click.option('-O', '--output', default=None, help="Write results to JSON file")
+@click.option('-b', '--baseline', default=None, help="Compare with results in JSON file")
+@click.option('-t', '--tolerance', default=0.1, help="Allowed slowdown w.r.t. the baseline, as a fraction")
+@click.option('-l', '--list', 'list_only', is_flag=True, help="List the benchmarks and exit")
+@click.option('-o', '--loglevel', default=logging.INFO)
+def rawbench(patterns, datadir, size, repeat, output, baseline, tolerance, list_only, loglevel):
+    """Run benchmarks for readers, parsers and digits sinks.
+
+    PATTERNS select benchmarks by name, e.g. "minidaq-*" (default: all).
+    The exit code is 1 if a benchmark is slower than the baseline by more
+    than the tolerance."""
+
+    ch = logging.StreamHandler()
+    ch.setFormatter(ColorFormatter())
+    logging.basicConfig(level=loglevel, handlers=[ch])
+
+    # Run silently
+    logging.getLogger("raw").setLevel(logging.ERROR)
+    logging.getLogger("rawlog").setLevel(logging.ERROR)
+    logging.getLogger("rawdata").setLevel(logging.ERROR)
+    logger.setLevel(loglevel)
+
+    names = [n for n in benchmarks
+             if not patterns or any(fnmatch.fnmatch(n, p) for p in patterns)]
+
+    if list_only:
+        for name in names:
+            click.echo(f"{name:20s} {benchmarks[name].description}")
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = SampleData(datadir or tmpdir, parse_size(size), scratch=tmpdir)
+        results = run(names, data, repeat)
+
+    report = dict(
+        meta=dict(
+            time=datetime.now().isoformat(timespec="seconds"),
+            python=platform.python_version(), numpy=np.__version__,
+            platform=platform.platform(), size=data.size, repeat=repeat),
+        results=results)
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            reference = json.load(f)['results']
+
+        rows = compare(results, reference, tolerance)
+        click.echo(f"{'benchmark':20s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+        for name, ref, cur, ratio, status in rows:
+            click.echo(f"{name:20s} {ref:10.2f} {cur:10.2f} {ratio:7.2f}  {status}")
+
+        if any(r[4] == "REGRESSION" for r in rows):
+            sys.exit(1)
@@ -4,6 +4,7 @@ from collections import namedtuple, Counter, OrderedDict
 import itertools
 import struct
 import logging
+import numpy as np
 
 class BitStructWord:
     """A bit struct that can be represented as a single 8, 16 or 32 bit word"""
@@ -45,6 +46,29 @@ class BitStructWord:
     #     for p, v in zip(self._partinfo, self.unpack(word)):
 
 
+class LazyField:
+    """Descriptor for a field of a BitStruct header
+
+    The fields of a header are only unpacked from the retained raw data when
+    one of them is accessed for the first time. The values are cached in the
+    _values slot of the header (see BaseHeader)."""
+
+    __slots__ = ("name", "index")
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        values = obj._values
+        if values is None:
+            values = obj._values = obj.unpack(obj._data)
+        return values[self.index]
+
+
 def auto_hexdump_str(fieldinfo):
     
     # print(bitgroups(fieldinfo,32))
@@ -78,9 +102,21 @@ def bitgroups(fieldinfo, bitwidth=32):
 
 
 class BitStruct:
-    "A struct with fields that can be less than a byte wide"
+    """A struct with fields that can be less than a byte wide
+
+    Besides unpacking a single struct with unpack(), a BitStruct can decode
+    many structs at once with unpack_array(). The result is a numpy
+    structured array with one column per field, described by `dtype`.
+    The inverse of unpack() is pack(), which builds the raw data from
+    field values.
+
+    Used as a class decorator, it adds a LazyField descriptor for every
+    field. Header classes derived from BaseHeader should declare their own
+    __slots__, so that instances only keep the raw data and the decoded
+    values, without a __dict__."""
 
     _fmtchar_map = {8: "B", 16: "H", 32: "L", 64: "Q"}
+    _dtype_map = {"B": "<u1", "H": "<u2", "L": "<u4", "Q": "<u8"}
 
     def __init__(self, **fieldinfo):
 
@@ -88,10 +124,15 @@ class BitStruct:
         self._fmtdecoder = list()
         self._keys = list()
 
+        # for the bulk decoding: where to find each field in the raw words
+        # as (name, word index, shift, mask) - shift is None for full words
+        self._extract = list()
+
         bitstruct = None
         for name, size in fieldinfo.items():
             if bitstruct is None and size in self._fmtchar_map:
                 # we can use a simple struct.unpack() to extract this field
+                self._extract.append((name, len(self._fmt)-1, None, None))
                 self._fmt += self._fmtchar_map[size]
                 self._fmtdecoder.append(lambda x: [x])
                 self._keys.append(name)
@@ -109,23 +150,38 @@ class BitStruct:
 
                 # if we can parse the fields up to here, let's do it
                 if bitstruct.parseable:
+                    for k, e in zip(bitstruct.keys, bitstruct._extractinfo):
+                        self._extract.append((k, len(self._fmt)-1, e.shift, e.mask))
                     self._fmt += bitstruct.fmtchar
                     self._fmtdecoder.append(bitstruct.unpack)
                     bitstruct = None
 
         self._fmthexdesc = auto_hexdump_str(fieldinfo)
 
+        # numpy dtypes for the raw words and the decoded fields
+        self._rawdtype = np.dtype([
+            (f"w{i}", self._dtype_map[c]) for i, c in enumerate(self._fmt[1:])])
+        self.dtype = np.dtype([
+            (k, "<u1" if v <= 8 else "<u2" if v <= 16 else "<u4" if v <= 32 else "<u8")
+            for k, v in fieldinfo.items()])
+
 
     def __call__(self, klass):
         """Decorator to teach classes to parse a BitStruct"""
 
         klass.unpack = self.unpack
+        klass.pack = self.pack
+        klass.unpack_array = self.unpack_array
         klass.keys = self.keys
+        klass.dtype = self.dtype
         klass.header_size = struct.calcsize(self._fmt)
 
-        try:
-            klass._hexdump_desc
-        except AttributeError:
+        for i, name in enumerate(self._keys):
+            setattr(klass, name, LazyField(name, i))
+
+        # only keep descriptions defined by the class itself, not the
+        # placeholder inherited from BaseHeader
+        if "_hexdump_desc" not in vars(klass):
             klass._hexdump_desc = self._fmthexdesc
 
         return klass
@@ -136,6 +192,56 @@ class BitStruct:
             for decode, value 
             in zip(self._fmtdecoder, struct.unpack(self._fmt, data))) )
 
+    def pack(self, **values):
+        """Build the raw data of a struct from field values
+
+        This is the inverse of unpack(). Fields that are not given are set
+        to zero."""
+
+        words = [0] * (len(self._fmt)-1)
+        for name, word, shift, mask in self._extract:
+            value = values.pop(name, 0)
+            if shift is None:
+                words[word] = value
+            elif value & ~mask:
+                raise ValueError(f"Value {value} does not fit into field '{name}'")
+            else:
+                words[word] |= value << shift
+
+        if values:
+            raise TypeError(f"Unknown fields: {', '.join(values)}")
+
+        return struct.pack(self._fmt, *words)
+
+    def unpack_array(self, data, offsets=None, count=-1):
+        """Decode many structs at once into a numpy structured array
+
+        Arguments:
+          data    : bytes-like object, e.g. a memory-mapped file
+          offsets : byte offsets of the structs in data. If not given, the
+                    structs are expected back to back from the start of data.
+          count   : number of consecutive structs to decode (default: all)"""
+
+        size = self._rawdtype.itemsize
+        if offsets is None:
+            if count < 0:
+                count = len(data) // size
+            raw = np.frombuffer(data, dtype=self._rawdtype, count=count)
+        else:
+            buf = np.frombuffer(data, dtype=np.uint8)
+            idx = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(size)
+            raw = buf[idx].view(self._rawdtype).ravel()
+
+        result = np.empty(len(raw), dtype=self.dtype)
+        for name, word, shift, mask in self._extract:
+            col = raw[f"w{word}"]
+            if shift is None:
+                result[name] = col
+            else:
+                result[name] = (col >> shift) & mask
+
+        return result
+
     def keys(self):
         return self._keys
 
@@ -0,0 +1,73 @@
+
+import numpy as np
+
+
+cluster_dtype = np.dtype([
+    ('event', '<u4'), ('det', '<u2'), ('padrow', 'u1'), ('padcol', 'u1'),
+    ('tb', 'u1'), ('pos', '<f4'), ('charge', '<f4')])
+
+
+def find_clusters(adc, threshold=10, pedestal=10, event=0, det=0):
+    """Find clusters in the ADC values of one detector
+
+    A cluster is a local maximum along the pad columns in one pad row and
+    time bin, with a pedestal-subtracted signal above `threshold`. The
+    charge is the sum of the signals on the three pads, and the position
+    (in units of pads) is the centre of gravity of these three pads.
+    Maxima with a charge <= 0, e.g. next to pads below the pedestal, have
+    no meaningful position and are not clusters.
+
+    Arguments:
+      adc : array [padrow, padcol, tb] of ADC values, e.g. from
+            DigitsAccumulator.detector()"""
+
+    signal = adc.astype(np.float32) - pedestal
+    left, centre, right = signal[:, :-2], signal[:, 1:-1], signal[:, 2:]
+
+    total = left + centre + right
+
+    peak = (centre > threshold) & (centre > left) & (centre >= right)
+    row, col, tb = np.nonzero(peak & (total > 0))
+
+    l = left[row, col, tb]
+    r = right[row, col, tb]
+    charge = total[row, col, tb]
+
+    clusters = np.zeros(len(row), dtype=cluster_dtype)
+    clusters['event'] = event
+    clusters['det'] = det
+    clusters['padrow'] = row
+    clusters['padcol'] = col + 1
+    clusters['tb'] = tb
+    clusters['pos'] = col + 1 + (r - l) / charge
+    clusters['charge'] = charge
+    return clusters
+
+
+class ClusterFinder:
+    """Find clusters in all detectors at the end of every event
+
+    Instances are used as the callback of a DigitsAccumulator with layout
+    "pad". The clusters of every event are passed as one structured array
+    to `callback(event, clusters)`."""
+
+    def __init__(self, callback, threshold=10, pedestal=10):
+        self.callback = callback
+        self.threshold = threshold
+        self.pedestal = pedestal
+
+    def __call__(self, event, accumulator):
+        if accumulator.layout != "pad":
+            raise ValueError("Cluster finding requires the pad layout")
+
+        clusters = [
+            find_clusters(accumulator.detector(det), self.threshold,
+                          self.pedestal, event=event, det=det)
+            for det in accumulator.detectors()]
+
+        if len(clusters) == 0:
+            clusters = np.zeros(0, dtype=cluster_dtype)
+        else:
+            clusters = np.concatenate(clusters)
+
+        self.callback(event, clusters)
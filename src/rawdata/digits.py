@@ -0,0 +1,105 @@
+
+import numpy as np
+
+from .geometry import map_digits
+
+
+def digits_dtype(ntimebins=30):
+    """Structured dtype for one digit, i.e. the ADC values of one channel
+
+    `ntb` is the number of time bins that were read out for the channel.
+    The ADC values of time bins >= ntb are zero."""
+    return np.dtype([
+        ('event', '<u4'), ('det', '<u2'),
+        ('rob', 'u1'), ('mcm', 'u1'), ('channel', 'u1'),
+        ('padrow', 'i1'), ('padcol', '<i2'), ('ntb', 'u1'),
+        ('adc', '<u2', (ntimebins,))])
+
+
+class DigitsBatcher:
+    """Base class for digits sinks that work on batches of digits
+
+    The TrdFeeParser hands over the ADC values of one channel at a time via
+    the store_digits callback. This class collects these digits in a
+    preallocated structured array, adds the pad row and column for the
+    whole batch and passes them on to process_batch(), which has to be
+    implemented by derived classes.
+
+    The batch passed to process_batch() is a view of the internal buffer,
+    which will be overwritten with the next batch. Sinks that want to keep
+    the data have to copy it.
+
+    Channels with fewer than `ntimebins` time bins are padded with zeros,
+    channels with more time bins raise a ValueError."""
+
+    def __init__(self, ntimebins=30, batchsize=4096):
+        self.ntimebins = ntimebins
+        self.dtype = digits_dtype(ntimebins)
+        self._buffer = np.zeros(batchsize, dtype=self.dtype)
+        self._nbuf = 0
+
+        # views of the columns, to avoid field lookups for every digit
+        self._event = self._buffer['event']
+        self._det = self._buffer['det']
+        self._rob = self._buffer['rob']
+        self._mcm = self._buffer['mcm']
+        self._channel = self._buffer['channel']
+        self._ntb = self._buffer['ntb']
+        self._adc = self._buffer['adc']
+
+    def __call__(self, ev, det, rob, mcm, ch, digits):
+        i = self._nbuf
+        self._event[i] = ev
+        self._det[i] = det
+        self._rob[i] = rob
+        self._mcm[i] = mcm
+        self._channel[i] = ch
+
+        n = len(digits)
+        if n > self.ntimebins:
+            raise ValueError(
+                f"{n} time bins in det {det} rob {rob} mcm {mcm} ch {ch} do not "
+                f"fit into the {self.ntimebins} time bins of {type(self).__name__}")
+        self._ntb[i] = n
+        self._adc[i, :n] = digits
+        self._adc[i, n:] = 0
+
+        self._nbuf += 1
+        if self._nbuf == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        """Pass all buffered digits on to process_batch()"""
+        if self._nbuf > 0:
+            self.process_batch(map_digits(self._buffer[:self._nbuf]))
+            self._nbuf = 0
+
+    def process_batch(self, batch):
+        """Virtual function to process a structured array of digits"""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class DigitsTee(DigitsBatcher):
+    """Digits sink that passes the same batches on to several batch sinks"""
+
+    def __init__(self, *sinks, batchsize=4096):
+        super().__init__(ntimebins=sinks[0].ntimebins, batchsize=batchsize)
+        self.sinks = sinks
+
+    def process_batch(self, batch):
+        for sink in self.sinks:
+            sink.process_batch(batch)
+
+    def end_event(self, event):
+        self.flush()
+        for sink in self.sinks:
+            if hasattr(sink, "end_event"):
+                sink.end_event(event)
+
+    def close(self):
+        super().close()
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,161 @@
+
+import struct
+import numpy as np
+
+from .digits import DigitsBatcher, digits_dtype
+
+
+class DigitsFileFormat:
+    """Native binary file format for TRD digits
+
+    The file consists of three parts:
+      header  : fixed-size header, described by the struct `header`
+      records : contiguous array of digits with dtype digits_dtype(ntb)
+      index   : array of `index_dtype`, one entry for each run of records
+                that belong to the same event and detector
+
+    The header is written last, when the writer is closed. All numbers are
+    little-endian, so the records can be mapped directly with np.memmap."""
+
+    magic = b"TRDDIGIT"
+    version = 2  # version 1 had no ntb field
+
+    # magic, version, ntimebins, record size, nrecords, index offset, nindex
+    header = struct.Struct("<8sLLLxxxxQQQ")
+    header_size = 64
+
+    index_dtype = np.dtype([
+        ('event', '<u4'), ('det', '<u4'), ('first', '<u8'), ('count', '<u8')])
+
+
+class DigitsFileWriter(DigitsBatcher, DigitsFileFormat):
+    """Digits sink that writes the native binary digits format"""
+
+    def __init__(self, filename="digits.trdd", ntimebins=30, batchsize=4096):
+        super().__init__(ntimebins=ntimebins, batchsize=batchsize)
+        self.outfile = open(filename, "wb")
+        self.outfile.write(b"\0" * self.header_size)
+        self.nrecords = 0
+        self.index = list()  # list of [event, det, first, count]
+
+    def process_batch(self, batch):
+
+        # find the start of runs with the same event and detector
+        key = batch['event'].astype(np.uint64) << 16 | batch['det']
+        start = np.flatnonzero(np.diff(key, prepend=~key[0]))
+        count = np.diff(start, append=len(batch))
+
+        for i, n in zip(start, count):
+            ev, det = int(batch['event'][i]), int(batch['det'][i])
+            last = self.index[-1] if self.index else None
+            if last is not None and last[0] == ev and last[1] == det:
+                last[3] += int(n)
+            else:
+                self.index.append([ev, det, self.nrecords+int(i), int(n)])
+
+        self.outfile.write(batch.tobytes())
+        self.nrecords += len(batch)
+
+    def close(self):
+        if self.outfile.closed:
+            return
+        self.flush()
+
+        index = np.array([tuple(x) for x in self.index], dtype=self.index_dtype)
+        index_offset = self.outfile.tell()
+        self.outfile.write(index.tobytes())
+
+        self.outfile.seek(0)
+        self.outfile.write(self.header.pack(
+            self.magic, self.version, self.ntimebins, self.dtype.itemsize,
+            self.nrecords, index_offset, len(index)))
+        self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DigitsFileReader(DigitsFileFormat):
+    """Reader for the native binary digits format
+
+    The records are mapped into memory with np.memmap, and all methods that
+    select digits return views of this map whenever the selected records
+    are contiguous in the file. Opening a file therefore only reads the
+    header and the index, and only the pages that are actually accessed are
+    loaded later."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as f:
+            hdr = f.read(self.header.size)
+
+        if len(hdr) != self.header.size:
+            raise ValueError(f"{filename}: file too short for digits header")
+
+        (magic, version, self.ntimebins, recsize, self.nrecords,
+         index_offset, nindex) = self.header.unpack(hdr)
+
+        if magic != self.magic:
+            raise ValueError(f"{filename}: not a digits file (magic={magic})")
+
+        if version not in (1, self.version):
+            raise ValueError(f"{filename}: unsupported version {version}")
+
+        self.dtype = digits_dtype(self.ntimebins)
+        if version == 1:
+            self.dtype = np.dtype([(name, self.dtype[name])
+                                   for name in self.dtype.names if name != 'ntb'])
+        if recsize != self.dtype.itemsize:
+            raise ValueError(f"{filename}: invalid record size {recsize}")
+
+        self.records = self._map(self.dtype, self.header_size, self.nrecords)
+        self.index = self._map(self.index_dtype, index_offset, nindex)
+
+    def _map(self, dtype, offset, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r',
+                         offset=offset, shape=(count,))
+
+    def __len__(self):
+        return self.nrecords
+
+    def events(self):
+        """Return the event numbers in the file, in order of appearance"""
+        ev = self.index['event']
+        _, first = np.unique(ev, return_index=True)
+        return ev[np.sort(first)]
+
+    def range(self, start, stop):
+        """Return the records with indices start..stop-1"""
+        return self.records[start:stop]
+
+    def event(self, event):
+        """Return all records of one event"""
+        return self._select(self.index['event'] == event)
+
+    def detector(self, det, event=None):
+        """Return all records of one detector, optionally in one event"""
+        sel = self.index['det'] == det
+        if event is not None:
+            sel &= self.index['event'] == event
+        return self._select(sel)
+
+    def _select(self, sel):
+        runs = self.index[sel]
+        if len(runs) == 0:
+            return self.records[0:0]
+
+        first = runs['first'].astype(np.int64)
+        stop = first + runs['count'].astype(np.int64)
+
+        # contiguous records -> view into the memory map
+        if np.all(first[1:] == stop[:-1]):
+            return self.records[first[0]:stop[-1]]
+
+        # otherwise we have to copy the runs into a new array
+        return np.concatenate([self.records[a:b] for a, b in zip(first, stop)])
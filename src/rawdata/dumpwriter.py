@@ -0,0 +1,375 @@
+
+import json
+import logging
+import numpy as np
+import struct
+import sys
+from collections import Counter
+
+from .rawlogging import ColorFormatter, TermColorFilter, verbosity_levels
+
+
+# Colours and logger groups of the dword types in the hexdump
+dword_types = dict(
+    TKH=("trkl", "bold_green"), TKD=("trkl", "green"),
+    TKL=("trkl", "green"), EOT=("trkl", "green"), TRK=("trap", None),
+    HC0=("hc", "white_on_blue"), HC1=("hc", "white_on_blue"),
+    HC2=("hc", "white_on_blue"), HC3=("hc", "white_on_blue"),
+    MCM=("mcm", "bold_blue"), MSK=("mcm", "blue"),
+    ADC=("mcm", "grey"), EOD=("mcm", "bold_blue"),
+    PAD=("cru", None), RDH=("cru", None), HCRU=("cru", None),
+    MQ0=("minidaq", None), MQ1=("minidaq", None), MQ2=("minidaq", None),
+    MQ3=("minidaq", None), MQ4=("minidaq", None), SKP=(None, None),
+)
+
+
+def resolve_suppressed(names=(), quiet=0):
+    """Determine the dword types that should not be dumped
+
+    Arguments:
+      names : dword types (e.g. ADC, MSK) or groups (e.g. HC, MCM, CRU)
+      quiet : reduce the verbosity, in the same way as evdump -q"""
+
+    groups = dict()
+    for kind, (group, _) in dword_types.items():
+        if group is not None:
+            groups.setdefault(group.upper(), set()).add(kind)
+
+    suppressed = set(k for k, v in verbosity_levels.items() if 5-quiet < v)
+    for name in names:
+        if name.upper() in dword_types:
+            suppressed.add(name.upper())
+        elif name.upper() in groups:
+            suppressed |= groups[name.upper()]
+        else:
+            raise ValueError(f"Invalid dword type or group '{name}'")
+
+    return suppressed
+
+
+class BaseDumpWriter:
+    """Common functionality of dump writers
+
+    Suppressed dword types are not formatted, only the number of suppressed
+    dwords is counted. Parsers can check with enabled() if they should
+    prepare the description of a dword, or decode it at all."""
+
+    def __init__(self, suppress=()):
+        self.suppress = set(suppress)
+        self.counts = Counter()
+
+    def enabled(self, kind):
+        return kind not in self.suppress
+
+    def count(self, kind, n=1):
+        """Count n dwords that were not dumped"""
+        self.counts[kind] += n
+
+    def summary(self):
+        return "suppressed dwords: " + " ".join(
+            f"{k}({n})" for k, n in sorted(self.counts.items()))
+
+    def header(self, hdr):
+        """Dump all dwords of a header (derived from BaseHeader)"""
+
+        fields = hdr.asdict()
+        descriptions = hdr.hexdump_desc()
+        for i, words in enumerate(struct.iter_unpack("<L", hdr._data)):
+
+            if len(descriptions) == 1:
+                desc = descriptions[0]
+            else:
+                desc = descriptions[i]
+
+            if len(hdr._hexdump_fmt) == 1:
+                fmt = hdr._hexdump_fmt[0]
+            elif len(hdr._hexdump_fmt) == 2:
+                fmt = hdr._hexdump_fmt[0] if i==0 else (hdr._hexdump_fmt[1])
+            else:
+                fmt = hdr._hexdump_fmt[i]
+
+            self(hdr._hexdump_kind, hdr._addr+4*i, words[0], fmt+desc, **fields)
+
+
+class DumpWriter(BaseDumpWriter):
+    """Fast writer for hexdumps of raw data
+
+    Every line of the hexdump shows the address and the value of a dword,
+    followed by its type and a description. The line template for every
+    dword type, including the colour codes, is built once. Lines are
+    collected in a buffer that is written to the stream with a single
+    write() call when it is full, or when flush() is called.
+
+    The description is passed as a format string with the fields as
+    keyword arguments, so the formatting is left to the writer."""
+
+    reset = '\x1b[0m'
+
+    def __init__(self, stream=None, bufsize=10000, suppress=()):
+        super().__init__(suppress)
+        self.stream = sys.stdout if stream is None else stream
+        self.bufsize = bufsize
+        self._lines = list()
+        self._templates = dict()
+
+    def _template(self, kind):
+        if not self.enabled(kind):
+            self._templates[kind] = None
+            return None
+
+        _, color = dword_types.get(kind, (None, None))
+        color = TermColorFilter.text_styles.get(color, "")
+        template = ("{:012x}  {:08x}    " + color + kind.ljust(4)
+                    + " {:45s}" + self.reset + "\n")
+        self._templates[kind] = template
+        return template
+
+    # the leading underscores avoid clashes with the names of fields
+    def __call__(self, _kind, _addr, _dword, _fmt, **fields):
+        try:
+            template = self._templates[_kind]
+        except KeyError:
+            template = self._template(_kind)
+
+        if template is None:
+            self.counts[_kind] += 1
+            return
+
+        text = _fmt.format(**fields) if fields else _fmt
+        self._lines.append(template.format(_addr, _dword, text))
+        if len(self._lines) >= self.bufsize:
+            self.flush()
+
+    def message(self, text, record=None):
+        """Add a line without address and dword to the dump"""
+        self._lines.append(text + "\n")
+        if len(self._lines) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if len(self._lines) == 0:
+            return
+
+        try:
+            self.stream.write("".join(self._lines))
+            self.stream.flush()
+        except BrokenPipeError:
+            # the pager (e.g. less) has terminated -> stop quietly
+            sys.stderr.close()
+            raise SystemExit(0)
+        finally:
+            self._lines = list()
+
+
+class LoggingDumpWriter(BaseDumpWriter):
+    """Dump writer that passes the hexdump lines on to the logging module
+
+    Every dword type is logged to rawlog.hexdump.<group>.<type>. Lines are
+    only formatted if the logger is enabled for INFO messages. The colour
+    filter of a dword type is installed when its logger is first used."""
+
+    def __init__(self, suppress=()):
+        super().__init__(suppress)
+        self._loggers = dict()
+
+    def _logger(self, kind):
+        group, color = dword_types.get(kind, (None, None))
+        name = "rawlog.hexdump." + (kind if group is None else f"{group}.{kind}")
+        logger = logging.getLogger(name)
+        if color is not None and not logger.filters:
+            logger.addFilter(TermColorFilter(color))
+        self._loggers[kind] = logger
+        return logger
+
+    def __call__(self, _kind, _addr, _dword, _fmt, **fields):
+        if self.enabled(_kind):
+            text = _fmt.format(**fields) if fields else _fmt
+            self._loggers[_kind].info(text, extra=dict(hexaddr=_addr, hexdata=_dword))
+        else:
+            self.counts[_kind] += 1
+
+    def enabled(self, kind):
+        logger = self._loggers.get(kind) or self._logger(kind)
+        return kind not in self.suppress and logger.isEnabledFor(logging.INFO)
+
+    def message(self, text, record=None):
+        logging.getLogger("rawlog.hexdump").info(text)
+
+    def flush(self):
+        pass
+
+
+class RecordDumpWriter(BaseDumpWriter):
+    """Base class for dump writers that produce structured records
+
+    Instead of one line per dword, these writers produce one record (a dict)
+    per decoded entity: RDH and HCRU headers, HC headers, MCM headers and
+    ADC masks, the ADC data of a channel, tracklets and errors. The fields
+    of the records are the decoded values, renamed according to
+    `field_names`. ADC data and tracklets are received through the
+    store_digits() and store_tracklets() sinks, which have to be passed to
+    the parser. Derived classes implement write() to store the records."""
+
+    # record names for the fields of the decode patterns in trdfeeparser
+    field_names = dict(
+        RDH=dict(),
+        HCRU=dict(),
+        HC0=dict(m="major", n="minor", q="nhw", s="sm", c="stack", p="layer", i="side"),
+        HC1=dict(t="ntb", b="bc", p="ptrg", h="phase"),
+        HC2=dict(),
+        HC3=dict(s="svnver", a="svnrev"),
+        MCM=dict(r="rob", m="mcm", e="evcnt"),
+        MSK=dict(),
+        TRK=dict(),
+    )
+
+    def __init__(self, suppress=()):
+        super().__init__(suppress)
+        self.event = 0
+
+    def enabled(self, kind):
+        return kind in self.field_names and kind not in self.suppress
+
+    def __call__(self, _kind, _addr, _dword, _fmt, **fields):
+        if not self.enabled(_kind):
+            self.counts[_kind] += 1
+            return
+
+        rec = dict(type=_kind, event=self.event, addr=_addr, dword=_dword)
+        if "ctx" in fields:
+            rec["det"] = fields["ctx"].det
+
+        names = self.field_names[_kind]
+        for k, v in fields.items():
+            if k not in ("ctx", "mark", "dword"):
+                rec[names.get(k, k)] = v
+
+        self.write(rec)
+
+    def header(self, hdr):
+        if hdr._hexdump_kind not in self.suppress:
+            rec = dict(type=hdr._hexdump_kind, event=self.event, addr=hdr._addr)
+            rec.update((k, getattr(hdr, k)) for k in hdr.keys())
+            self.write(rec)
+
+    def store_digits(self, ev, det, rob, mcm, ch, digits):
+        self.write(dict(type="ADC", event=ev, det=det, rob=rob, mcm=mcm,
+                        channel=ch, ntb=len(digits), adc=np.array(digits)))
+
+    def store_tracklets(self, event, hcid, row, col, y, dy, pid):
+        self.write(dict(type="TKL", event=event, hcid=hcid, row=row,
+                        col=col, y=y, dy=dy, pid=pid))
+
+    def message(self, text, record=None):
+        # only errors are stored, other log messages are not data
+        if record is not None and record.levelno >= logging.ERROR:
+            self.write(dict(type="ERR", event=self.event,
+                            level=record.levelname, message=record.getMessage()))
+
+    def end_event(self, event):
+        self.event = event + 1
+
+    def write(self, rec):
+        pass
+
+    def flush(self):
+        pass
+
+
+class JsonlDumpWriter(RecordDumpWriter):
+    """Write records as JSON Lines, i.e. one JSON object per line"""
+
+    def __init__(self, stream=None, bufsize=10000, suppress=()):
+        super().__init__(suppress)
+        self.output = DumpWriter(stream, bufsize)
+        self.encoder = json.JSONEncoder(
+            separators=(",", ":"), default=lambda x: x.tolist())
+
+    def write(self, rec):
+        self.output.message(self.encoder.encode(rec))
+
+    def flush(self):
+        self.output.flush()
+
+
+class NpyDumpWriter(RecordDumpWriter):
+    """Write records to a NumPy .npz file
+
+    The file contains one structured array per record type, e.g. "HC0" or
+    "ADC". The records are kept in memory until flush() is called.
+
+    The fields of an array are the union of the fields of its records, and
+    fields that are missing in a record are zero. Array fields with
+    different lengths, e.g. the ADC values of links with different numbers
+    of time bins, are padded with zeros to the longest one, like in
+    DigitsBatcher. The ADC records store the number of time bins in `ntb`."""
+
+    def __init__(self, filename="evdump.npz", suppress=()):
+        super().__init__(suppress)
+        self.filename = filename
+        self.records = dict()
+
+    def write(self, rec):
+        self.records.setdefault(rec["type"], list()).append(rec)
+
+    def flush(self):
+        arrays = dict()
+        for kind, recs in self.records.items():
+            keys = dict()
+            for r in recs:
+                keys.update(dict.fromkeys(r))
+            keys.pop("type")
+
+            columns = {k: self.column(recs, k) for k in keys}
+            arrays[kind] = np.zeros(len(recs), dtype=[
+                (k, c.dtype, c.shape[1:]) for k, c in columns.items()])
+            for k, c in columns.items():
+                arrays[kind][k] = c
+
+        np.savez(self.filename, **arrays)
+
+    @staticmethod
+    def column(recs, key):
+        """Values of field `key` in all records, zero-padded to a common shape"""
+        values = [np.asarray(r[key]) for r in recs if key in r]
+        shape = tuple(np.max([v.shape for v in values], axis=0)) if values[0].ndim else ()
+        dtype = np.result_type(*values)
+
+        column = np.zeros((len(recs),) + shape, dtype=dtype)
+        values = iter(values)
+        for i, r in enumerate(recs):
+            if key in r:
+                v = next(values)
+                column[(i,) + tuple(slice(0, n) for n in v.shape)] = v
+        return column
+
+
+class DumpLogHandler(logging.Handler):
+    """Logging handler that adds log messages to the buffer of a DumpWriter
+
+    This keeps log messages in order with the hexdump lines."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+        self.setFormatter(ColorFormatter())
+
+    def emit(self, record):
+        try:
+            self.writer.message(self.format(record), record)
+        except SystemExit:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+# The writer used by parsers and readers to dump raw data
+writer = LoggingDumpWriter()
+
+def set_writer(w):
+    """Select the writer for hexdumps, before parsers are created"""
+    global writer
+    writer = w
+
+def get_writer():
+    return writer
@@ -0,0 +1,379 @@
+"""Encoder for TRD raw data - the inverse of the parsers
+
+The dwords are built from the decode patterns in trdfeeparser, so the
+encoder follows the same bit layout as the parser. encode_link() combines
+them to the data of one link (half-chamber), and the writer classes wrap
+the links of an event in the MiniDAQ, o32 or time frame format."""
+
+import numpy as np
+from datetime import datetime
+
+from .constants import eodmarker, eotmarker, magicmarker
+from .geometry import get_sector, get_stack, get_layer
+from .minidaqreader import MiniDaqHeader
+from .tfreader import DataHeader, RawDataHeader
+from .tracklets import tracklet_dtype
+from .trdfeeparser import (
+    parse_hc0, parse_hc1, parse_hc2, parse_hc3, parse_mcmhdr, parse_adcmask,
+    parse_tracklet_hc_header, parse_tracklet_mcm_header, parse_tracklet_word,
+    parse_legacy_tracklet, TrdHalfCruHeader)
+
+cru_padding = 0xEEEEEEEE
+
+
+# ------------------------------------------------------------------------
+# Single dwords
+
+def hc0(sm, stack, layer, side, major=0x20, minor=0, nhw=1):
+    return parse_hc0.decoder.encode(
+        m=major, n=minor, q=nhw, s=sm, p=layer, c=stack, i=side)
+
+def hc1(ntb=30, bc=0, ptrg=0, phase=0):
+    # phases >= 12 would be ambiguous with HC2 and HC3
+    if phase >= 12:
+        raise ValueError(f"Invalid pretrigger phase {phase}")
+    return parse_hc1.decoder.encode(t=ntb, b=bc, p=ptrg, h=phase)
+
+def hc2(**fields):
+    return parse_hc2.decoder.encode(**fields)
+
+def hc3(svnver=0, svnrev=0):
+    return parse_hc3.decoder.encode(s=svnver, a=svnrev)
+
+def mcmhdr(rob, mcm, event):
+    return parse_mcmhdr.decoder.encode(r=rob, m=mcm, e=event & 0xFFFFF)
+
+def adcmask(mask, count=None):
+    if count is None:
+        count = bin(mask).count("1")
+    return parse_adcmask.decoder.encode(c=~count & 0x1F, m=mask)
+
+def tracklet_hc_header(hcid, fmt=1):
+    det, side = divmod(hcid, 2)
+    return parse_tracklet_hc_header.decoder.encode(
+        f=fmt, s=get_sector(det), c=get_stack(det), p=get_layer(det), i=side)
+
+def tracklet_mcm_header(row, col, pids):
+    """MCM header for run 3 tracklets, unused pids have to be 0xFF"""
+    return parse_tracklet_mcm_header.__call__.decoder.encode(
+        z=row, y=col, a=pids[0], b=pids[1], c=pids[2])
+
+def tracklet_word(y, dy, pid):
+    """Run 3 tracklet word with the lower 12 bits of the pid"""
+    return parse_tracklet_word.__call__.decoder.encode(
+        y=y & 0x7FF, d=dy & 0xFF, p=pid & 0xFFF)
+
+def legacy_tracklet(row, y, dy, pid):
+    dword = parse_legacy_tracklet.decoder.encode(
+        z=row, y=y & 0x1FFF, d=dy & 0x7F, p=pid)
+    if dword == eotmarker:
+        raise ValueError("Tracklet would be read as end-of-tracklet marker")
+    return dword
+
+def adcwords(adc):
+    """ADC data words for an array of ADC values [..., channel, timebin]
+
+    Three time bins are packed into one dword, and the last dword of a
+    channel is padded with zeros. Returns an array [..., channel, dword]."""
+
+    adc = np.asarray(adc, dtype=np.uint32)
+    if adc.size and adc.max() > 0x3FF:
+        raise ValueError("ADC values must be in the range 0-1023")
+
+    nch, ntb = adc.shape[-2:]
+    padded = np.zeros(adc.shape[:-1] + (3*((ntb+2)//3),), dtype=np.uint32)
+    padded[..., :ntb] = adc
+
+    # the lowest two bits are 2 for odd and 3 for even channels
+    flag = np.where(np.arange(nch) % 2, 2, 3).astype(np.uint32)[:, None]
+
+    return (padded[..., 0::3] << 22 | padded[..., 1::3] << 12
+            | padded[..., 2::3] << 2 | flag)
+
+
+# ------------------------------------------------------------------------
+# Links
+
+def encode_tracklets(hcid, tracklets, tracklet_format="run3"):
+    """Encode the tracklets of one half-chamber, without end markers
+
+    Arguments:
+      hcid            : half-chamber ID (2*det + side)
+      tracklets       : structured array with tracklets.tracklet_dtype
+      tracklet_format : "run2" or "run3"
+
+    Run 3 tracklets of the same MCM (row and col) share an MCM header if
+    they are consecutive in the array, up to three per header."""
+
+    if tracklet_format == "run2":
+        return [legacy_tracklet(int(t['row']), int(t['y']), int(t['dy']), int(t['pid']))
+                for t in tracklets]
+
+    elif tracklet_format != "run3":
+        raise ValueError(f"Invalid tracklet format '{tracklet_format}'")
+
+    words = [tracklet_hc_header(hcid)]
+    i = 0
+    while i < len(tracklets):
+        row, col = int(tracklets['row'][i]), int(tracklets['col'][i])
+        j = i + 1
+        while (j < len(tracklets) and j < i+3 and tracklets['row'][j] == row
+               and tracklets['col'][j] == col):
+            j += 1
+
+        group = tracklets[i:j]
+        pids = [int(p) >> 12 for p in group['pid']] + [0xFF] * (3-len(group))
+        words.append(tracklet_mcm_header(row, col, pids))
+        words.extend(tracklet_word(int(t['y']), int(t['dy']), int(t['pid']))
+                     for t in group)
+        i = j
+
+    return words
+
+
+def encode_link(hcid, event=0, adc=None, mask=None, tracklets=None, ntb=30,
+                zs=True, tracklet_format="run3", nhw=1, bc=0):
+    """Encode the data of one link, i.e. of one half-chamber
+
+    Arguments:
+      hcid            : half-chamber ID (2*det + side)
+      event           : event number for the MCM headers
+      adc             : ADC values [i, mcm, channel, timebin] for the ROBs
+                        2*i + side of the half-chamber, or None to send
+                        only tracklets and headers
+      mask            : channels to send [i, mcm, channel], default: all.
+                        Without zero suppression, MCMs with any channel in
+                        the mask are sent with all 21 channels.
+      tracklets       : structured array with tracklets.tracklet_dtype
+      ntb             : number of time bins, if adc is None
+      zs              : zero-suppressed format with ADC masks
+      tracklet_format : "run2" or "run3"
+      nhw             : number of additional HC headers (HC1, HC2, HC3)
+
+    Returns the dwords of the link as an array of uint32."""
+
+    det, side = divmod(hcid, 2)
+    if adc is not None:
+        ntb = adc.shape[-1]
+
+    if tracklets is None:
+        tracklets = np.zeros(0, dtype=tracklet_dtype)
+    words = encode_tracklets(hcid, tracklets, tracklet_format)
+    words.extend([eotmarker, eotmarker])
+
+    words.append(hc0(get_sector(det), get_stack(det), get_layer(det), side,
+                     major=0x20 if zs else 0x00, nhw=nhw))
+    words.extend([hc1(ntb, bc), hc2(), hc3()][:nhw])
+    header = np.array(words, dtype=np.uint32)
+
+    if adc is None:
+        body = np.zeros(0, dtype=np.uint32)
+    else:
+        body = _encode_mcms(side, event, adc, mask, zs)
+
+    trailer = np.array([eodmarker, eodmarker], dtype=np.uint32)
+    return np.concatenate([header, body, trailer])
+
+
+def _encode_mcms(side, event, adc, mask, zs):
+    """Encode the MCM headers, ADC masks and ADC data of a half-chamber"""
+
+    nrob, nmcm, nch, ntb = adc.shape
+    if mask is None:
+        mask = np.ones((nrob, nmcm, nch), dtype=bool)
+    mask = np.asarray(mask, dtype=bool).reshape(-1, nch)
+
+    sel = np.flatnonzero(mask.any(axis=1))
+    robidx, mcm = np.divmod(sel, nmcm)
+    if zs:
+        chmask = mask[sel]
+    else:
+        chmask = np.ones((len(sel), nch), dtype=bool)
+
+    # the headers and masks of all MCMs are encoded at once
+    bits = (chmask * (1 << np.arange(nch))).sum(axis=1)
+    hdr = mcmhdr(2*robidx + side, mcm, event)
+    msk = adcmask(bits, chmask.sum(axis=1))
+    data = adcwords(adc.reshape(-1, nch, ntb)[sel])
+    nwords = data.shape[-1]
+
+    # build a table with all possible dwords of every MCM, and select the
+    # dwords that are actually sent
+    tokens = np.column_stack([
+        np.asarray(hdr, dtype=np.uint32), np.asarray(msk, dtype=np.uint32),
+        data.reshape(len(sel), -1)])
+    valid = np.column_stack([
+        np.ones(len(sel), dtype=bool), np.full(len(sel), zs),
+        np.repeat(chmask, nwords, axis=1)])
+
+    return tokens[valid]
+
+
+def padded(link, blocksize=32):
+    """Pad link data with CRU padding words to a multiple of blocksize bytes"""
+    link = np.asarray(link, dtype=np.uint32)
+    npad = -len(link) % (blocksize//4)
+    return np.concatenate([link, np.full(npad, cru_padding, dtype=np.uint32)])
+
+
+# ------------------------------------------------------------------------
+# Containers
+
+class BaseWriter:
+    """Common functionality of the raw data writers
+
+    Derived classes implement write_event(), which takes a list of links,
+    each given as an array of dwords, and a time stamp in seconds."""
+
+    mode = "wb"
+
+    def __init__(self, filename):
+        self.file = open(filename, self.mode)
+
+    def tell(self):
+        """Number of bytes written so far"""
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MiniDaqWriter(BaseWriter):
+    """Write events in the MiniDAQ format
+
+    Every event consists of an event header (equipment type 1) and one
+    subevent (equipment type 0x10) per link, with the link number as
+    equipment ID. The data size in the header is limited to 64 kB."""
+
+    def write_event(self, links, timestamp=0.0):
+        sec, nanosec = int(timestamp), int(1e9*(timestamp % 1))
+
+        payload = b"".join(
+            self.header(0x10, i, len(data), sec, nanosec) + data
+            for i, data in enumerate(_tobytes(x) for x in links))
+
+        self.file.write(self.header(1, 0, len(payload), sec, nanosec) + payload)
+
+    @staticmethod
+    def header(equipment_type, equipment_id, datasize, sec, nanosec):
+        if datasize > 0xFFFF:
+            raise ValueError(f"Data size {datasize} exceeds MiniDAQ limit")
+
+        return MiniDaqHeader.pack(
+            magic=magicmarker, equipment_type=equipment_type,
+            equipment_id=equipment_id, version=1,
+            hdrsize=MiniDaqHeader.header_size, datasize=datasize,
+            sec=sec, nanosec=nanosec)
+
+
+class O32Writer(BaseWriter):
+    """Write events in the text-based o32 format
+
+    Every link is written as a data segment, with the link number as sfp."""
+
+    _hexdigits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+    def write_event(self, links, timestamp=0.0):
+        time = datetime.fromtimestamp(timestamp)
+        lines = [
+            "# EVENT", "# format version: 1.0",
+            f"# time stamp: {time:%Y-%m-%dT%H:%M:%S.%f}",
+            f"# data blocks: {len(links)}", ""]
+        self.file.write("\n".join(lines).encode())
+
+        for i, link in enumerate(links):
+            link = np.asarray(link, dtype=np.uint32)
+            self.file.write(
+                f"## DATA SEGMENT\n## sfp: {i}\n## size: {len(link)}\n".encode())
+            self.file.write(self._hexlines(link))
+
+    def _hexlines(self, words):
+        """Format dwords as lines "0x01234567\\n" without a Python loop"""
+        shifts = np.arange(28, -1, -4, dtype=np.uint32)
+        lines = np.empty((len(words), 11), dtype=np.uint8)
+        lines[:, 0:2] = np.frombuffer(b"0x", dtype=np.uint8)
+        lines[:, 2:10] = self._hexdigits[(words[:, None] >> shifts) & 0xF]
+        lines[:, 10] = ord("\n")
+        return lines.tobytes()
+
+
+class TimeFrameWriter(BaseWriter):
+    """Write events as ALICE O2 time frames
+
+    All links are read out by one half-CRU, so there can be at most 15
+    links. The data of every event starts in a new RDH page with a half-CRU
+    header, followed by the data of the links, each padded with CRU padding
+    words to a multiple of 32 bytes. The pages of `events_per_tf` events
+    are combined in one sub-time frame with an O2 DataHeader."""
+
+    pagesize = 0x2000
+
+    def __init__(self, filename, events_per_tf=32, cru=0, endpoint=0, runno=0):
+        super().__init__(filename)
+        self.events_per_tf = events_per_tf
+        self.cru = cru
+        self.endpoint = endpoint
+        self.runno = runno
+
+        self.tfcount = 0
+        self.orbit = 0
+        self._pages = list()
+        self._nevents = 0
+
+    def write_event(self, links, timestamp=0.0):
+        if len(links) > 15:
+            raise ValueError("A half-CRU can only read out 15 links")
+
+        data = [_tobytes(padded(x)) for x in links]
+        sizes = {f"s{i:02}": len(x)//32 for i, x in enumerate(data)}
+        hcru = TrdHalfCruHeader.pack(
+            version=1, cru=self.cru, ep=self.endpoint, evtype=1, **sizes)
+        payload = hcru + b"".join(data)
+
+        maxpayload = self.pagesize - RawDataHeader.header_size
+        npages = (len(payload) + maxpayload - 1) // maxpayload
+        for i in range(npages):
+            page = payload[i*maxpayload:(i+1)*maxpayload]
+            size = RawDataHeader.header_size + len(page)
+            rdh = RawDataHeader.pack(
+                version=6, hdrsize=RawDataHeader.header_size, offset=size,
+                datasize=size, link=15, cru=self.cru, ep=self.endpoint,
+                orbit=self.orbit, trg=0x10, pagecnt=i, stop=int(i == npages-1))
+            self._pages.append(rdh + page)
+
+        self.orbit += 1
+        self._nevents += 1
+        if self._nevents % self.events_per_tf == 0:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered pages as one sub-time frame"""
+        if len(self._pages) == 0:
+            return
+
+        payload = b"".join(self._pages)
+        self.file.write(DataHeader.pack(
+            datadesc="RAWDATA", origin="TRD", subspec=2*self.cru + self.endpoint,
+            datasize=len(payload), tfcount=self.tfcount, runno=self.runno))
+        self.file.write(payload)
+
+        self.tfcount += 1
+        self._pages = list()
+
+    def tell(self):
+        return self.file.tell() + sum(len(x) for x in self._pages)
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+        super().close()
+
+
+def _tobytes(link):
+    return np.asarray(link, dtype='<u4').tobytes()
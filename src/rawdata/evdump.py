@@ -7,24 +7,74 @@ import logging
 from rawdata.base import DumpParser
 
 from .factory import make_reader
+from .parserstats import ParserStats
+from .memprofile import MemoryProfile
 # from .header import TrdboxHeader
-from .rawlogging import StdoutHandler, HexDump
+from .dumpwriter import DumpWriter, DumpLogHandler, LoggingDumpWriter
+from .dumpwriter import JsonlDumpWriter, NpyDumpWriter
+from .dumpwriter import resolve_suppressed, set_writer
+from .rawlogging import ColorFormatter, StdoutHandler, HexDump
 # from .trdfeeparser import TrdFeeParser, TrdCruParser
 
 
 @click.command()
 @click.argument('source', default='tcp://localhost:7776')
 @click.option('-o', '--loglevel', default=logging.INFO)
-@click.option('-s', '--suppress', multiple=True)
-@click.option('-q', '--quiet', count=True)
+@click.option('-s', '--suppress', multiple=True, help="Suppress dword type or group (e.g. ADC, MSK, MCM, HC, CRU)")
+@click.option('-q', '--quiet', count=True, help="Reduce verbosity, can be repeated")
 @click.option('-k', '--skip-events', default=0)
 @click.option('-t', '--tracklet-format', default="auto")
-def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format):
+@click.option('-f', '--format', 'fmt', default="text", type=click.Choice(["text", "jsonl", "npy"]), help="Hexdump, JSON Lines records or .npz file with record arrays")
+@click.option('-O', '--output', default=None, help="Output file (default: stdout, evdump.npz for npy)")
+@click.option('-P', '--progress', default=10.0, help="Seconds between progress reports, 0 to disable")
+@click.option('--parser-stats', default=None, help="Write dword counts and parsing time per type and link to this file (.json or text)")
+@click.option('--profile-memory', is_flag=True, help="Report peak and retained memory per stage with tracemalloc")
+def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format, fmt, output, progress, parser_stats,
+           profile_memory):
 
-    # Configure logging with a handler that works better with less
-    # This handler terminates the programme when a pipe into less terminates.
-    lh = StdoutHandler()
-    logging.basicConfig(level=loglevel, handlers=[lh])
+    # Suppressed dword types are resolved before the parsers are created,
+    # so the parsers can skip over data that is not dumped.
+    try:
+        suppressed = resolve_suppressed(suppress, quiet)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint="--suppress")
+
+    stream = None if output is None or fmt == "npy" else open(output, "w")
+    store_digits = None
+    store_tracklets = None
+
+    if fmt != "text":
+        # Records are written to stdout or a file, log messages go to
+        # stderr. Errors are also stored as records.
+        if fmt == "jsonl":
+            dump = JsonlDumpWriter(stream, suppress=suppressed)
+        else:
+            dump = NpyDumpWriter(output or "evdump.npz", suppress=suppressed)
+
+        lh = logging.StreamHandler()
+        lh.setFormatter(ColorFormatter())
+        rh = DumpLogHandler(dump)
+        rh.setLevel(logging.ERROR)
+        logging.basicConfig(level=loglevel, handlers=[lh, rh])
+
+        if "ADC" not in suppressed:
+            store_digits = dump.store_digits
+        if "TKL" not in suppressed:
+            store_tracklets = dump.store_tracklets
+
+    elif loglevel <= logging.INFO:
+        # The hexdump is written directly to stdout, bypassing the logging
+        # module. Log messages are passed to the same buffer to keep them in
+        # order with the hexdump. The writer terminates the programme when a
+        # pipe into less terminates.
+        dump = DumpWriter(stream, suppress=suppressed)
+        logging.basicConfig(level=loglevel, handlers=[DumpLogHandler(dump)])
+
+    else:
+        dump = LoggingDumpWriter(suppress=suppressed)
+        logging.basicConfig(level=loglevel, handlers=[StdoutHandler()])
+
+    set_writer(dump)
 
     # # This is how parts of the hexdump can be deactivated
     # logging.getLogger("rawlog.hexdump.").setLevel(logging.WARNING)
@@ -34,7 +84,22 @@ def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format):
 
 
     # We leave the rest to the reader
+    stats = ParserStats() if parser_stats is not None else None
     reader = make_reader(source)
-    reader.add_trd_parser(tracklet_format=tracklet_format)
-    reader.process(skip_events=skip_events)
+    reader.add_trd_parser(store_digits=store_digits,
+        store_tracklets=store_tracklets, tracklet_format=tracklet_format,
+        stats=stats)
+    reader.progress.interval = progress
+    if profile_memory:
+        reader.progress.memory = MemoryProfile()
 
+    try:
+        reader.process(skip_events=skip_events)
+    finally:
+        if fmt == "text" and len(dump.counts) > 0:
+            logging.info(dump.summary())
+        dump.flush()
+        if stream is not None:
+            stream.close()
+        if stats is not None:
+            stats.save(parser_stats)
@@ -0,0 +1,182 @@
+"""Events and sub-events that are common to all readers
+
+Every reader is an EventReader: events() is a generator of Event objects,
+and iterating over a reader is the same as iterating over events():
+
+    reader = make_reader("run.o32")
+    for event in reader.events(start=100, stop=200):
+        for subevent in event.subevents:
+            print(event.number, subevent.equipment_id, subevent.size)
+
+The readers only find the boundaries of events, and the headers that are
+needed for that. The sub-events are decoded when `subevents` is accessed
+for the first time. Their payloads are memoryviews into the data of the
+event, so they are not copied. Parsers that need a stream can use
+SubEvent.stream().
+
+events(start, stop) has the same meaning as itertools.islice(). Events
+before `start` are skipped with the headers only. The readers record the
+file position of every event they have seen in an EventIndex, so that
+earlier events can be reached again without scanning the file. Sources
+that can not seek (compressed files, network streams) can only be read
+forward, and iterating over them continues at the current event."""
+
+import io
+from abc import ABC, abstractmethod
+
+
+class SubEvent:
+    """Data of one equipment (e.g. an optical link) in an event
+
+    Attributes:
+      equipment_type : e.g. 0x10 for TRD data, or the O2 origin "TRD"
+      equipment_id   : identifies the equipment within its type
+      payload        : memoryview of the data, without the sub-event header
+      addr           : file position of the payload, if known"""
+
+    __slots__ = ("equipment_type", "equipment_id", "payload", "addr")
+
+    def __init__(self, equipment_type, equipment_id, payload, addr=None):
+        self.equipment_type = equipment_type
+        self.equipment_id = equipment_id
+        self.payload = memoryview(payload)
+        self.addr = addr
+
+    @property
+    def size(self):
+        return self.payload.nbytes
+
+    def stream(self):
+        """Binary stream of the payload, e.g. for TrdFeeParser.parse()"""
+        return io.BytesIO(self.payload)
+
+    def dwords(self):
+        """Payload as numpy array of 32-bit words"""
+        import numpy as np
+        return np.frombuffer(self.payload, dtype="<u4")
+
+    def __repr__(self):
+        return (f"SubEvent({self.equipment_type!r}, {self.equipment_id!r}, "
+                f"{self.size} bytes)")
+
+
+class Event:
+    """Event with lazily decoded sub-events
+
+    Attributes:
+      number    : position of the event in the source, starting at 0
+      timestamp : seconds since the epoch, None if the format has no time
+
+    `subevents` can be given as a list, or as a function that decodes the
+    list when it is accessed for the first time."""
+
+    __slots__ = ("number", "timestamp", "_subevents")
+
+    def __init__(self, number, timestamp, subevents):
+        self.number = number
+        self.timestamp = timestamp
+        self._subevents = subevents
+
+    @property
+    def subevents(self):
+        if callable(self._subevents):
+            self._subevents = self._subevents()
+        return self._subevents
+
+    @property
+    def equipments(self):
+        """(equipment_type, equipment_id) of all sub-events"""
+        return [(s.equipment_type, s.equipment_id) for s in self.subevents]
+
+    def __iter__(self):
+        return iter(self.subevents)
+
+    def __len__(self):
+        return len(self.subevents)
+
+    def __repr__(self):
+        return f"Event({self.number}, {self.timestamp!r})"
+
+
+class EventIndex:
+    """File positions of the events that were found so far
+
+    positions[n] is the position of event n. The position after the last
+    event is added when the end of the file is reached."""
+
+    def __init__(self, start=0):
+        self.positions = [start]
+
+    def add(self, number, pos):
+        """Record the position of an event, if it is the next unknown one"""
+        if number == len(self.positions):
+            self.positions.append(pos)
+
+    def nearest(self, number):
+        """(number, position) of the closest known event before `number`"""
+        n = min(number, len(self.positions)-1)
+        return n, self.positions[n]
+
+
+class EventReader(ABC):
+    """Base class for readers with an events() generator
+
+    Readers implement read_event(number), which returns the next Event or
+    None at the end of the data, and skip_event(), which moves past the
+    next event and returns False at the end of the data. Seekable readers
+    set `index` to an EventIndex and implement tell() and seek(pos) for
+    the positions in the index; others set it to None."""
+
+    index = None
+    next_number = 0  # number of the event at the current position
+
+    def __iter__(self):
+        # sources that only read forward continue at the current event
+        return self.events(0 if self.index is not None else self.next_number)
+
+    def events(self, start=0, stop=None):
+        """Generator of the events from number `start` to `stop` (excluded)"""
+        start = 0 if start is None else start
+        if start < 0 or (stop is not None and stop < 0):
+            raise ValueError("start and stop of events() must be None or "
+                             "non-negative integers")
+        return self._events(start, stop)
+
+    def _events(self, start, stop):
+        number = self.seek_event(start)
+        while stop is None or number < stop:
+            event = self.read_event(number)
+            if event is None:
+                break
+            number = self._advance(number + 1)
+            yield event
+
+    def seek_event(self, number):
+        """Move to event `number`, returns the number of the event that is
+        reached, which is smaller at the end of the data"""
+
+        if self.index is not None:
+            self.next_number, pos = self.index.nearest(number)
+            self.seek(pos)
+        elif number < self.next_number:
+            raise ValueError(f"cannot go back to event {number} in "
+                             f"{type(self).__name__}, which only reads forward")
+
+        n = self.next_number
+        while n < number and self.skip_event():
+            n = self._advance(n + 1)
+        return n
+
+    def _advance(self, number):
+        self.next_number = number
+        if self.index is not None:
+            self.index.add(number, self.tell())
+        return number
+
+    @abstractmethod
+    def read_event(self, number):
+        """Read the next event, None at the end of the data"""
+
+    @abstractmethod
+    def skip_event(self):
+        """Move past the next event, False at the end of the data"""
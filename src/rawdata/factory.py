@@ -1,28 +1,173 @@
+"""Selection of the reader for a data source
 
-from .o32reader import o32reader
-from .tfreader import TimeFrameReader, RdhStreamParser
-from .zmqreader import zmqreader
-from .minidaqreader import MiniDaqReader
+Every reader type declares a function that recognizes its data from the
+first bytes of a file, and the file name extensions it handles.
+make_reader() reads the start of the file once, and selects the first
+reader type that recognizes the data. Only if no reader type recognizes the
+data, or if the source is not a regular file, the extension decides. Files
+compressed with bzip2 are recognized, and the decompressed data is checked
+for reader types that can read compressed input.
 
+Readers from other packages can be added with register_reader(), or with
+an entry point in the group "rawdata.readers" that refers to a ReaderType.
+Entry points are only loaded if no built-in reader type recognizes the
+data.
 
-def make_reader(source):
+The readers are only imported when they are selected, to keep the startup
+time low and to avoid loading dependencies (e.g. zmq) that are not needed."""
 
-    # Instantiate the reader that will get events and subevents from the source
-    if source.endswith(".o32") or source.endswith(".o32.bz2"):
-        return o32reader(source)
+import bz2
+import logging
+import os
+import struct
+from typing import Callable, NamedTuple
+
+from .constants import magicmarker
+
+logger = logging.getLogger(__name__)
+
+# number of bytes that are read to recognize the data
+sniff_size = 256
+
+
+class ReaderType(NamedTuple):
+    """Description of a reader for make_reader()
+
+    open(source, compressed) instantiates the reader. sniff(head) checks if
+    the first bytes of a file (at most sniff_size) are in the format of the
+    reader. Only reader types with `compressed` can read bzip2 files."""
+
+    name: str
+    open: Callable
+    sniff: Callable
+    extensions: tuple = ()
+    compressed: bool = False
+
+
+def is_minidaq(head):
+    return head[:4] == struct.pack("<L", magicmarker)
 
-    # TODO: timeframe readers temporarily disabled
-    elif source.endswith(".tf") or source.endswith(".lnk"):
-        return TimeFrameReader(source)
-        # reader.log_header = lambda x: x.hexdump()
+def is_timeframe(head):
+    return head[:4] == b"O2O2"
 
-    elif source.endswith('.bin'):
-        return MiniDaqReader(source)
-        # reader.hexdump = hdump
-        # reader.parsers[0x10] = trdfeeparser
+def is_rawlink(head):
+    # RDH version 4-7 with 64 byte header size, last 64-bit word is zero
+    return (len(head) >= 64 and head[0] in (4, 5, 6, 7) and head[1] == 64
+            and head[56:64] == bytes(8))
+
+def is_o32(head):
+    return head.lstrip().startswith(b"# EVENT")
+
+
+def open_minidaq(source, compressed=False):
+    from .minidaqreader import MiniDaqReader
+    return MiniDaqReader(source)
+
+def open_timeframe(source, compressed=False):
+    from .tfreader import TimeFrameReader
+    return TimeFrameReader(source)
+
+def open_rawlink(source, compressed=False):
+    from .tfreader import RawLinkReader
+    return RawLinkReader(source)
+
+def open_o32(source, compressed=False):
+    from .o32reader import o32reader
+    return o32reader(source, compressed=compressed)
+
+
+reader_types = [
+    ReaderType("minidaq", open_minidaq, is_minidaq, (".bin",)),
+    ReaderType("timeframe", open_timeframe, is_timeframe, (".tf",)),
+    ReaderType("rawlink", open_rawlink, is_rawlink, (".lnk", ".raw")),
+    ReaderType("o32", open_o32, is_o32, (".o32", ".o32.bz2"), compressed=True),
+]
+
+_plugins_loaded = False
+
+
+def register_reader(reader_type, first=False):
+    """Add a reader type, by default after the existing ones"""
+    if first:
+        reader_types.insert(0, reader_type)
+    else:
+        reader_types.append(reader_type)
+
+
+def load_plugins():
+    """Register the reader types from entry points, only once"""
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        return
+
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group="rawdata.readers")
+    else:
+        eps = eps.get("rawdata.readers", ())
+
+    for ep in eps:
+        try:
+            register_reader(ep.load())
+        except Exception as ex:
+            logger.warning(f"Cannot load reader plugin {ep.name}: {ex}")
+
+
+def sniff(source):
+    """Determine the reader type and compression of a file from its content
+
+    Returns (reader_type, compressed), or (None, False) if the data is not
+    recognized."""
+
+    with open(source, "rb") as f:
+        head = f.read(sniff_size)
+
+    compressed = head.startswith(b"BZh")
+    if compressed:
+        # bzip2 decompresses complete blocks -> this can read more data
+        try:
+            with bz2.open(source, "rb") as f:
+                head = f.read(sniff_size)
+        except (OSError, EOFError):
+            return None, False
+
+    for plugins in (False, True):
+        if plugins:
+            load_plugins()
+        for reader_type in reader_types:
+            if compressed and not reader_type.compressed:
+                continue
+            if reader_type.sniff(head):
+                return reader_type, compressed
+
+    return None, False
+
+
+def make_reader(source):
+
+    # Instantiate the reader that will get events and subevents from the source
+    if os.path.isfile(source):
+        reader_type, compressed = sniff(source)
+        if reader_type is not None:
+            logger.debug(f"{source}: {reader_type.name} data"
+                         + (" (bzip2)" if compressed else ""))
+            return reader_type.open(source, compressed=compressed)
 
     # elif source.startswith('tcp://'):
+    #     from .zmqreader import zmqreader
     #     reader = zmqreader(source)
 
-    else:
-        raise ValueError(f"unknown source type: {source}")
+    # fall back to the file name extension
+    for reader_type in reader_types:
+        for ext in reader_type.extensions:
+            if source.endswith(ext):
+                return reader_type.open(
+                    source, compressed=source.endswith(".bz2"))
+
+    raise ValueError(f"unknown source type: {source}")
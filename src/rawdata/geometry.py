@@ -0,0 +1,84 @@
+"""Geometry of the TRD read-out electronics
+
+The pad row and column of a read-out channel only depend on the stack, the
+ROB, the MCM and the ADC channel. The mapping is therefore precomputed into
+NumPy lookup tables, which are indexed with [stack, side, rob, mcm, channel].
+The half-chamber side is redundant (side == rob%2), but it is part of the
+index to flag channels where the ROB does not match the half-chamber.
+Channels that are not connected to a pad of the chamber are mapped to -1.
+
+The mapping follows FeeParam in O2: MCMs are arranged in 4 rows and 4
+columns per ROB, and each MCM reads 18 pads plus 3 pads shared with its
+neighbours."""
+
+import numpy as np
+
+nsectors = 18
+nstacks = 5
+nlayers = 6
+ndet = nsectors * nstacks * nlayers
+
+nrob = 8      # ROBs per chamber (6 in stack 2)
+nmcm = 16     # MCMs per ROB
+nadc = 21     # ADC channels per MCM
+ncol = 144    # pad columns per chamber
+ncolmcm = 18  # pad columns per MCM
+
+
+def get_detector(sector, stack, layer):
+    return 30*sector + 6*stack + layer
+
+def get_sector(det):
+    return det // 30
+
+def get_stack(det):
+    return (det % 30) // 6
+
+def get_layer(det):
+    return det % 6
+
+def get_nrob(stack):
+    return 6 if stack == 2 else 8
+
+def get_nrow(stack):
+    return 12 if stack == 2 else 16
+
+
+def _build_tables():
+
+    stack, side, rob, mcm, ch = np.meshgrid(
+        np.arange(nstacks), np.arange(2), np.arange(nrob),
+        np.arange(nmcm), np.arange(nadc), indexing='ij')
+
+    padrow = 4*(rob//2) + mcm//4
+
+    mcmcol = mcm % 4 + 4*(rob % 2)
+    padcol = mcmcol*ncolmcm + ncolmcm + 1 - ch
+
+    valid = (rob % 2 == side) & (rob < np.where(stack == 2, 6, 8))
+    padrow = np.where(valid, padrow, -1).astype(np.int8)
+    padcol = np.where(valid & (padcol >= 0) & (padcol < ncol), padcol, -1)
+    padcol = padcol.astype(np.int16)
+
+    padrow.flags.writeable = False
+    padcol.flags.writeable = False
+    return padrow, padcol
+
+padrow_table, padcol_table = _build_tables()
+
+
+def pad_position(stack, side, rob, mcm, channel):
+    """Return pad row and column for (arrays of) read-out channels"""
+    idx = (stack, side, rob, mcm, channel)
+    return padrow_table[idx], padcol_table[idx]
+
+
+def map_digits(batch):
+    """Fill the padrow and padcol fields of a structured array of digits
+
+    The stack is derived from the detector number, the side from the ROB."""
+    rob = batch['rob']
+    idx = (get_stack(batch['det']), rob % 2, rob, batch['mcm'], batch['channel'])
+    batch['padrow'] = padrow_table[idx]
+    batch['padcol'] = padcol_table[idx]
+    return batch
@@ -0,0 +1,139 @@
+
+import logging
+import os
+import time
+import numpy as np
+
+from . import geometry
+from .digits import DigitsBatcher
+
+logger = logging.getLogger(__name__)
+
+# number of channels per detector
+nchannels = geometry.nrob * geometry.nmcm * geometry.nadc
+
+
+class AdcHistogram(DigitsBatcher):
+    """Digits sink that fills a histogram of ADC values for every channel
+
+    The histograms are kept in one uint32 array `hist` with shape
+    [channel_index, adc], with one bin for each 10-bit ADC value. The
+    channel index is (slot*8 + rob)*16*21 + mcm*21 + channel, where slot is
+    the position of the detector in `detectors`. If no detectors are given,
+    every detector found in the data gets a slot, or only the first `ndet`
+    detectors if `ndet` is given. The array is preallocated for the given
+    detectors or `ndet` detectors. Otherwise its capacity is doubled when
+    it is full, and `hist` is a view of the slots in use. Time bins that
+    were not read out (beyond the `ntb` of a digit) are not filled.
+
+    If a snapshot file name is given, the histograms are saved to this file
+    at most every `interval` seconds, and when the sink is closed. The file
+    is replaced atomically, so monitoring programmes can read it at any
+    time."""
+
+    nbins = 1024
+
+    def __init__(self, detectors=None, ndet=None, ntimebins=30, batchsize=4096,
+                 snapshot=None, interval=10.0):
+        super().__init__(ntimebins=ntimebins, batchsize=batchsize)
+
+        self.detectors = list() if detectors is None else list(detectors)
+        self.ndet = len(self.detectors) if detectors is not None else ndet
+        self._slot = np.full(geometry.ndet, -1, dtype=np.int64)
+        self._slot[np.array(self.detectors, dtype=int)] = np.arange(len(self.detectors))
+        self._dropped = set()
+
+        self._buffer = np.zeros((0, self.nbins), dtype=np.uint32)
+        self._allocate(len(self.detectors) if self.ndet is None else self.ndet)
+        self._tb = np.arange(ntimebins)
+
+        self.snapshot_file = snapshot
+        self.interval = interval
+        self._last_snapshot = time.monotonic()
+
+    def _assign_slots(self, dets):
+        for det in np.unique(dets[self._slot[dets] < 0]):
+            if self.ndet is None or len(self.detectors) < self.ndet:
+                self._slot[det] = len(self.detectors)
+                self.detectors.append(int(det))
+            elif det not in self._dropped:
+                logger.warning(f"no histogram slot for detector {det}, ignoring its data")
+                self._dropped.add(det)
+
+        # add the histograms of the new detectors
+        capacity = len(self._buffer) // nchannels
+        if len(self.detectors) > capacity:
+            self._allocate(min(max(2*capacity, len(self.detectors)), geometry.ndet))
+        self.hist = self._buffer[:len(self.detectors)*nchannels]
+
+    def _allocate(self, ndet):
+        buffer = np.zeros((ndet*nchannels, self.nbins), dtype=np.uint32)
+        buffer[:len(self._buffer)] = self._buffer
+        self._buffer = buffer
+        self._flat = buffer.reshape(-1)
+        self.hist = buffer[:len(self.detectors)*nchannels]
+
+    def process_batch(self, batch):
+        dets = batch['det'].astype(np.int64)
+        slot = self._slot[dets]
+        if np.any(slot < 0):
+            self._assign_slots(dets)
+            slot = self._slot[dets]
+
+        sel = slot >= 0
+        chan = (slot[sel]*geometry.nrob + batch['rob'][sel]) * geometry.nmcm
+        chan = (chan + batch['mcm'][sel]) * geometry.nadc + batch['channel'][sel]
+
+        idx = chan[:, None]*self.nbins + batch['adc'][sel]
+        valid = self._tb < batch['ntb'][sel][:, None]
+
+        # count the entries per bin, each bin is only updated once
+        bins, counts = np.unique(idx[valid], return_counts=True)
+        self._flat[bins] += counts.astype(np.uint32)
+
+        if (self.snapshot_file is not None
+                and time.monotonic() - self._last_snapshot >= self.interval):
+            self.snapshot()
+
+    def snapshot(self, filename=None):
+        """Save the histograms and the detector list to a .npz file"""
+        if filename is None:
+            filename = self.snapshot_file
+
+        tmpname = filename + ".tmp"
+        with open(tmpname, "wb") as f:
+            np.savez(f, detectors=np.array(self.detectors, dtype=int), hist=self.hist)
+        os.replace(tmpname, filename)
+        self._last_snapshot = time.monotonic()
+
+    def channel_summary(self):
+        """Return entries, mean and RMS of the ADC values of every channel"""
+        return summarize(self.hist, self.detectors)
+
+    def close(self):
+        super().close()
+        if self.snapshot_file is not None:
+            self.snapshot()
+
+
+def summarize(hist, detectors):
+    """Calculate entries, mean and RMS per channel from ADC histograms"""
+
+    adc = np.arange(hist.shape[1], dtype=np.float64)
+    entries = hist.sum(axis=1, dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (hist @ adc) / entries
+        rms = np.sqrt(np.maximum((hist @ adc**2) / entries - mean**2, 0))
+
+    res = np.zeros(len(detectors)*nchannels, dtype=[
+        ('det', '<u2'), ('rob', 'u1'), ('mcm', 'u1'), ('channel', 'u1'),
+        ('entries', '<u8'), ('mean', '<f4'), ('rms', '<f4')])
+
+    slot, chan = np.divmod(np.arange(len(res)), nchannels)
+    res['det'] = np.asarray(detectors, dtype=int)[slot]
+    res['rob'], chan = np.divmod(chan, geometry.nmcm*geometry.nadc)
+    res['mcm'], res['channel'] = np.divmod(chan, geometry.nadc)
+    res['entries'] = entries[:len(res)]
+    res['mean'] = mean[:len(res)]
+    res['rms'] = rms[:len(res)]
+    return res
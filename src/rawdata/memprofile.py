@@ -0,0 +1,135 @@
+"""Memory profile of the processing stages with tracemalloc
+
+A MemoryProfile is attached to the Progress object of a reader, and is
+notified when a processing stage (read, parse, sink) is entered and left.
+For every stage, it records:
+
+  - the peak: the maximum increase of the traced memory during a visit,
+    relative to the memory in use when the stage was entered
+  - the retained memory: the sum of the memory that was allocated, but
+    not freed during the visits of the stage
+
+Both include nested stages, e.g. sinks that are called by the parser.
+
+Taking a snapshot of all allocations is expensive, so the top allocation
+sites are only determined for every `every`-th visit of a stage, from
+snapshots at the start and the end of that visit. In addition, the sites
+of the memory that was retained during the whole run are determined from
+snapshots at the start and the end."""
+
+import logging
+import tracemalloc
+
+from .progress import format_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class StageMemory:
+    __slots__ = ("visits", "peak", "retained", "sites")
+
+    def __init__(self):
+        self.visits = 0
+        self.peak = 0
+        self.retained = 0
+        self.sites = dict()  # traceback -> size difference in sampled visits
+
+
+class MemoryProfile:
+    """Peak and retained memory per processing stage
+
+    Arguments:
+      every  : take snapshots for every n-th visit of a stage, 0 for never
+      ntop   : number of allocation sites in the report
+      frames : number of frames stored per allocation"""
+
+    def __init__(self, every=1000, ntop=5, frames=1):
+        self.every = every
+        self.ntop = ntop
+        self.stages = dict()
+        self._stack = list()  # [name, memory at entry, peak, snapshot]
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._start = self.snapshot()
+
+    def snapshot(self):
+        """Snapshot without the allocations of tracemalloc and this module"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)))
+
+    def _update_peak(self):
+        """Fold the peak since the last reset into the open stages"""
+        current, peak = tracemalloc.get_traced_memory()
+        for s in self._stack:
+            s[2] = max(s[2], peak)
+        self._reset_peak()
+        return current
+
+    def _reset_peak(self):
+        if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+            tracemalloc.reset_peak()
+
+    def enter(self, name):
+        current = self._update_peak()
+
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageMemory()
+        stats.visits += 1
+
+        snapshot = None
+        if self.every and stats.visits % self.every == 1 % self.every:
+            # the snapshot itself should not count as peak of outer stages
+            snapshot = self.snapshot()
+            current = tracemalloc.get_traced_memory()[0]
+            self._reset_peak()
+
+        self._stack.append([name, current, current, snapshot])
+
+    def exit(self, name):
+        current = self._update_peak()
+        name, entry, peak, snapshot = self._stack.pop()
+
+        stats = self.stages[name]
+        stats.peak = max(stats.peak, peak - entry)
+        stats.retained += current - entry
+
+        if snapshot is not None:
+            for diff in self.snapshot().compare_to(snapshot, "traceback"):
+                if diff.size_diff != 0:
+                    stats.sites[diff.traceback] = (
+                        stats.sites.get(diff.traceback, 0) + diff.size_diff)
+            self._reset_peak()
+
+    def format_sites(self, sites):
+        top = sorted(sites.items(), key=lambda x: -abs(x[1]))[:self.ntop]
+        return [f"      {format_bytes(size):>10s}  {tb[0].filename}:{tb[0].lineno}"
+                for tb, size in top]
+
+    def report(self):
+        """Multi-line report with the memory per stage and the top sites"""
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {format_bytes(current)} in use"]
+        if not hasattr(tracemalloc, "reset_peak"):
+            lines[0] += f", peak {format_bytes(peak)}"
+
+        for name, stats in self.stages.items():
+            lines.append(f"  {name:12s} {stats.visits:8d} visits  "
+                         f"peak {format_bytes(stats.peak):>10s}  "
+                         f"retained {format_bytes(stats.retained):>10s}")
+            lines.extend(self.format_sites(stats.sites))
+
+        retained = dict()
+        for diff in self.snapshot().compare_to(self._start, "traceback"):
+            retained[diff.traceback] = diff.size_diff
+        lines.append("  retained at the end of the run:")
+        lines.extend(self.format_sites(retained))
+
+        return "\n".join(lines)
+
+    def close(self):
+        logger.info(self.report())
+        tracemalloc.stop()
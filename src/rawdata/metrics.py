@@ -0,0 +1,251 @@
+"""Metrics in the Prometheus text format, served over HTTP
+
+Long-running processes can expose counters, gauges and histograms on a
+local port, where they can be scraped by the monitoring system:
+
+    registry = metrics.Registry()
+    server = metrics.serve(9100, registry)
+
+Only the standard library is used. The metrics are updated by the
+processing thread without locking, and read by the server thread when a
+scrape arrives. Values are copied before they are formatted, which is
+sufficient for plain dicts of numbers in CPython."""
+
+import bisect
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# latency buckets in seconds, from 10 us to 10 s
+default_buckets = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2,
+                   0.1, 0.3, 1.0, 3.0, 10.0)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metric:
+    """Base class for metrics with optional labels
+
+    Values are stored per tuple of label values, in the order of
+    `labelnames`."""
+
+    kind = "untyped"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+
+    def samples(self):
+        """(name, labels, value) of all samples, labels as a string"""
+        for key, value in list(self.values.items()):
+            yield self.name, format_labels(self.labelnames, key), value
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def inc(self, value=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Histogram(Metric):
+    """Histogram with cumulative buckets, plus sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=default_buckets):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        h = self.values.get(labels)
+        if h is None:
+            # counts per bucket (the last one is +Inf), sum
+            h = self.values[labels] = [0] * (len(self.buckets)+1) + [0.0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-1] += value
+
+    def samples(self):
+        for key, h in list(self.values.items()):
+            h = list(h)
+            n = 0
+            for le, count in zip(self.buckets + ("+Inf",), h[:-1]):
+                n += count
+                yield (self.name + "_bucket",
+                       format_labels(self.labelnames, key, [("le", le)]), n)
+            yield self.name + "_sum", format_labels(self.labelnames, key), h[-1]
+            yield self.name + "_count", format_labels(self.labelnames, key), n
+
+
+class Registry:
+    """Collection of metrics that are exposed together
+
+    Functions in `collectors` are called before every exposition, to
+    update metrics that are only sampled when they are scraped."""
+
+    def __init__(self):
+        self.metrics = dict()
+        self.collectors = list()
+
+    def add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric '{metric.name}'")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self.add(Counter(name, description, labelnames))
+
+    def gauge(self, name, description, labelnames=()):
+        return self.add(Gauge(name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=(), buckets=default_buckets):
+        return self.add(Histogram(name, description, labelnames, buckets))
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        for func in self.collectors:
+            func()
+        return "\n".join(m.exposition() for m in self.metrics.values()) + "\n"
+
+
+def resident_memory():
+    """Resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # not Linux: use the maximum, which is reported in kB
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ProcessingMetrics:
+    """Standard metrics of the readers and parsers
+
+    The object is attached to a Progress object, which reports processed
+    events and the duration of every processing stage. Log messages of
+    level WARNING and above are counted per logger and level by
+    MetricsLogHandler. Parse errors are counted per error type and
+    expected dword type by the parsers themselves, in the values of
+    `parse_errors`, which are passed to TrdFeeParser as `errors`. The
+    read-ahead queue of the input, the PrefetchReader passed to
+    Progress.start(), reports the chunks that are waiting for the parser
+    and the number of times the parser had to wait for a chunk."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.events = registry.counter(
+            "rawdata_events_total", "Processed events")
+        self.bytes = registry.counter(
+            "rawdata_bytes_total", "Processed input bytes")
+        self.input_size = registry.gauge(
+            "rawdata_input_size_bytes", "Size of the input, if known")
+        self.errors = registry.counter(
+            "rawdata_log_messages_total", "Warnings and errors per logger",
+            ("logger", "level"))
+        self.parse_errors = registry.counter(
+            "rawdata_parse_errors_total", "Parse errors per error and expected dword type",
+            ("error", "expected"))
+        self.queue_depth = registry.gauge(
+            "rawdata_queue_depth", "Items waiting in a queue", ("queue",))
+        self.queue_waits = registry.counter(
+            "rawdata_queue_waits_total", "Times the consumer of a queue waited for an item",
+            ("queue",))
+        self.stage_seconds = registry.histogram(
+            "rawdata_stage_seconds", "Duration of processing stages", ("stage",))
+        self.memory = registry.gauge(
+            "rawdata_resident_memory_bytes", "Resident memory of the process")
+
+        registry.collectors.append(lambda: self.memory.set(resident_memory()))
+
+    def event(self, progress, n=1):
+        self.events.inc(n)
+        pos = progress.tell()
+        if pos is not None:
+            self.bytes.values[()] = pos
+        if progress.total is not None:
+            self.input_size.set(progress.total)
+        if progress.queue is not None:
+            self.queue_depth.set(progress.queue.depth(), "prefetch")
+            self.queue_waits.values[("prefetch",)] = progress.queue.waits
+
+    def stage(self, name, seconds):
+        self.stage_seconds.observe(seconds, name)
+
+
+class MetricsLogHandler(logging.Handler):
+    """Count log messages per logger and level"""
+
+    def __init__(self, metrics, level=logging.WARNING):
+        super().__init__(level)
+        self.metrics = metrics
+
+    def emit(self, record):
+        self.metrics.errors.inc(1, record.name, record.levelname)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    registry = None
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port, registry, host="127.0.0.1"):
+    """Serve the metrics of a registry in a background thread
+
+    The server only listens on the local host by default. It runs in a
+    daemon thread and does not keep the programme alive."""
+
+    handler = type("Handler", (MetricsHandler,), dict(registry=registry))
+    server = HTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name="metrics")
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -2,11 +2,16 @@
 #
 
 import logging
+import os
 import time
 
 from .rawlogging import AddLocationFilter, HexDump
+from . import dumpwriter
 from .base import BaseHeader
 from .bitstruct import BitStruct
+from .event import Event, EventIndex, EventReader, SubEvent
+from .prefetch import open_prefetched
+from .progress import Progress
 from .trdfeeparser import make_trd_parser
 import struct
 
@@ -20,16 +25,16 @@ logger.addFilter(logflt)
     res1=8, hdrsize=8, datasize=16, # word2
     sec=32, nanosec=32) # word3, word4
 class MiniDaqHeader(BaseHeader):
+    __slots__ = ()
 
-    def __init__(self, data, addr):
+    # the time information is only decoded when it is needed
+    @property
+    def timestamp(self):
+        return float(self.sec) + float(self.nanosec)*1e-9
 
-        super().__init__(data,addr)
-
-        # parse the time information
-        if self.version in [1]:
-            # ( sec, ns ) = unpack("II",data[12:20])
-            self.timestamp = float(self.sec) + float(self.nanosec)*1e-9
-            self.time = time.ctime(self.timestamp)
+    @property
+    def time(self):
+        return time.ctime(self.timestamp)
 
     def equipment(self):
         return self.equipment_type<<8 | self.equipment_id
@@ -37,7 +42,7 @@ class MiniDaqHeader(BaseHeader):
     # hexdump formatting info
 
     def hexdump(self):
-        hexlogger = logger.getChild(f"hexdump.minidaq")
+        dump = dumpwriter.get_writer()
 
         txt = list((
             f"MiniDAQ magic word 0x{self.magic:08x}",
@@ -46,37 +51,90 @@ class MiniDaqHeader(BaseHeader):
             f"{self.time}", ""))
 
         for i, words in enumerate(struct.iter_unpack("<I", self._data)):
-            extra = dict(hexaddr=self._addr+4*i, hexdata=words[0])
-            hexlogger.getChild(f"MQ{i}").info(txt, extra=extra)
-
-class MiniDaqReader:
+            dump(f"MQ{i}", self._addr+4*i, words[0], txt[i])
+
+def decode_subevents(data, addr):
+    """Sub-events in the payload of a MiniDAQ event at file position addr"""
+    view = memoryview(data)
+    subevents = list()
+    pos = 0
+    while pos + MiniDaqHeader.header_size <= len(data):
+        start = pos + MiniDaqHeader.header_size
+        hdr = MiniDaqHeader(data[pos:start], addr+pos)
+        subevents.append(SubEvent(hdr.equipment_type, hdr.equipment_id,
+                                  view[start:start+hdr.datasize], addr+start))
+        pos = start + hdr.datasize
+    return subevents
+
+class MiniDaqReader(EventReader):
     """Reader class for MiniDAQ files 
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over events in the file. Records
+    with equipment type 1 are events, which contain the sub-events. Other
+    records at the top level are returned as events with one sub-event."""
 
     def __init__(self, filename):
-        self.file = open(filename,"rb")
-        
-        # find filesize
-        self.file.seek(0,2)
-        self.filesize =self.file.tell()
-        self.file.seek(0)
+        self.file = open_prefetched(filename)
+        self.filesize = os.path.getsize(filename)
+        self.index = EventIndex()
 
         self.parsers = dict()
         self.hexdump = lambda x: None # Default: no logging
         self.event = 0
+        self.progress = Progress()
 
     def add_trd_parser(self, **kwargs):
         self.parsers[0x10] = make_trd_parser(has_cruheader=False, **kwargs)
 
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, pos):
+        self.file.seek(pos)
+
+    def read_event(self, number):
+        addr = self.file.tell()
+        data = self.file.read(MiniDaqHeader.header_size)
+        if len(data) != MiniDaqHeader.header_size:
+            return None
+
+        hdr = MiniDaqHeader(data, addr)
+        addr += MiniDaqHeader.header_size
+        payload = self.file.read(hdr.datasize)
+        if hdr.equipment_type == 1:
+            return Event(number, hdr.timestamp,
+                         lambda: decode_subevents(payload, addr))
+        else:
+            return Event(number, hdr.timestamp, [SubEvent(
+                hdr.equipment_type, hdr.equipment_id, payload, addr)])
+
+    def skip_event(self):
+        data = self.file.read(MiniDaqHeader.header_size)
+        if len(data) != MiniDaqHeader.header_size:
+            return False
+        self.file.seek(MiniDaqHeader(data, 0).datasize, 1)
+        return True
+
     def process(self, skip_events=0):
-        """Read entire file."""
-        while self.file.tell() < self.filesize:
-            self.read()
+        """Read entire file.
+
+        Skipped events are not parsed, but the parsers still count them, to
+        keep the event numbers."""
+        for i in range(self.seek_event(skip_events)):
+            for parser in self.parsers.values():
+                parser.next_event()
+
+        self.progress.start(self.filesize, self.file.tell, self.file.raw)
+        try:
+            while self.file.tell() < self.filesize:
+                self.read()
+        finally:
+            self.progress.close()
 
     def read(self):
         addr = self.file.tell()
-        data = self.file.read(20)
+        with self.progress.stage("read"):
+            data = self.file.read(20)
         if len(data)!=20:
             logger.info(f"read {len(data)} bytes at offset {addr}")
             return
@@ -87,15 +145,20 @@ class MiniDaqReader:
 
         if hdr.equipment_type == 1:
             # eq. type 1 is a MiniDaq event, which contains subevents 
-            self.read()
+            endpos = self.file.tell() + hdr.datasize
+            while self.file.tell() < endpos:
+                self.read()
+            for parser in self.parsers.values():
+                parser.next_event()
+            self.progress.event()
         elif hdr.equipment_type in self.parsers:
             # self.parsers[hdr.equipment_type].reset()
-            self.parsers[hdr.equipment_type].parse(self.file, hdr.datasize)
+            with self.progress.stage("parse"):
+                self.parsers[hdr.equipment_type].parse(self.file, hdr.datasize)
         else:
             self.file.seek(hdr.datasize, 1)  # skip over payload
 
         self.event += 1
-        logger.warning(f"Processed {self.event} events")
 
 
 
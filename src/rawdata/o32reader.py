@@ -1,39 +1,35 @@
 
 import io
+import os
 import struct
 import re
 import subprocess
 from datetime import datetime
-from typing import NamedTuple
 import logging
 
+from .event import Event, EventIndex, EventReader, SubEvent
+from .prefetch import open_prefetched
+from .progress import Progress
 from .trdfeeparser import make_trd_parser
 
 logger = logging.getLogger("rawlog.o32")
 
-class event_t(NamedTuple):
-    timestamp: datetime
-    subevents: tuple
+def pack_dwords(lines):
+    """Binary data of hexadecimal data words, one per line"""
+    # int() accepts both str and bytes from subprocess pipes
+    return struct.pack(f"<{len(lines)}I", *[int(x, 0) for x in lines])
 
-class subevent_t(NamedTuple):
-    # timestamp: datetime
-    equipment_type: int
-    equipment_id: int
-    # payload: Iterable[int]
-    # payload: numpy.ndarray
-    payload: io.BytesIO
-    size: int
 
-
-class o32reader:
+class o32reader(EventReader):
     """Reader class for files in the .o32 format.
 
     The constructor takes a file name as input. If the if filename ends in
     '.o32' it is read as a normal text file. If it ends in '.o32.bz2' it is
     assumed to be bzip2-compressed, and it is decompressed with bzcat before
-    parsing.
+    parsing. Files with other names can be read if `compressed` is given.
 
-    The class can be used as an iterator over events in the file.
+    The class can be used as an iterator over events in the file. Compressed
+    files can only be read forward.
 
     o32 is a simple, text-based format for TRD data that was inspired by older
     formats used during the early commissioning. It contains the detector data
@@ -45,23 +41,31 @@ class o32reader:
 
 
     #Initial state variables:
-    def __init__(self,file_name):
+    def __init__(self,file_name, compressed=None):
         self.filename = file_name
         self.line_number=0
         self.linebuf = None
         self.parsers = dict()
+        self.progress = Progress()
+
+        if compressed is None:
+            if self.filename.endswith('.o32'):
+                compressed = False
+            elif self.filename.endswith('.o32.bz2'):
+                compressed = True
+            else:
+                raise ValueError(f"invalid file extension of input file {self.filename}")
+        self.compressed = compressed
 
-        if self.filename.endswith('.o32'):
-            self.infile=open(self.filename, 'r')
+        if not self.compressed:
+            self.infile=io.TextIOWrapper(open_prefetched(self.filename))
+            self.index = EventIndex(self.infile.tell())
 
-        elif self.filename.endswith('.o32.bz2'):
+        else:
             self.proc = subprocess.Popen(["bzcat", self.filename],
             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
             self.infile = self.proc.stdout
 
-        else:
-            raise ValueError(f"invalid file extension of input file {self.filename}")
-
     def add_trd_parser(self, **kwargs):
         if 'tracklet_format' not in kwargs:
             kwargs['tracklet_format'] = 'run2'
@@ -70,25 +74,80 @@ class o32reader:
     def process(self, skip_events=0):
         """This method will handle the reading process.
         
-        It is meant as a replacement for the lecacy iterator interface."""
+        It is meant as a replacement for the lecacy iterator interface.
+        Skipped events are not parsed, but the parsers still count them, to
+        keep the event numbers."""
+
+        # the position in compressed input is not known
+        if not self.compressed:
+            self.progress.start(os.path.getsize(self.filename), self.infile.tell,
+                                self.infile.buffer.raw)
+
+        read_stage = self.progress.stage("read")
+        parse_stage = self.progress.stage("parse")
+
+        try:
+            with read_stage:
+                start = self.seek_event(skip_events)
+            for i in range(start):
+                for parser in self.parsers.values():
+                    parser.next_event()
+
+            events = self.events(start)
+            while True:
+                with read_stage:
+                    event = next(events, None)
+                    if event is None:
+                        break
+                    subevents = event.subevents
+
+                for subevent in subevents:
+                    if subevent.equipment_type in self.parsers:
+                        with parse_stage:
+                            self.parsers[subevent.equipment_type].parse(
+                                subevent.stream(), subevent.size)
+
+                for parser in self.parsers.values():
+                    parser.next_event()
+
+                self.progress.event()
+        finally:
+            self.progress.close()
+
+    def tell(self):
+        return self.infile.tell()
+
+    def seek(self, pos):
+        self.linebuf = None
+        self.infile.seek(pos)
 
-        evno = -1
-        while True:
-            evno += 1
-            header = self.read_event_header()
+    def read_event(self, number):
+        header = self.read_event_header()
+        if header is None:
+            return None
 
-            for i in range(header['data blocks']):
-                subevent = self.read_subevent()
+        # the data words are only converted when the sub-events are accessed
+        blocks = list()
+        for i in range(header['data blocks']):
+            equipment_type, equipment_id, size = self.read_subevent_header()
+            blocks.append((equipment_type, equipment_id, self.read_dwords(size)))
 
-                if evno < skip_events:
-                    continue
+        def decode():
+            return [SubEvent(t, i, pack_dwords(lines)) for t, i, lines in blocks]
 
-                if subevent.equipment_type in self.parsers:
-                    self.parsers[subevent.equipment_type].parse(
-                        subevent.payload, subevent.size)
+        return Event(number, header['time stamp'].timestamp(), decode)
 
-            logger.warning(f"Processed {evno+1} events")
+    def skip_event(self):
+        header = self.read_event_header()
+        if header is None:
+            return False
 
+        for i in range(header['data blocks']):
+            size = self.read_subevent_header()[2]
+            for j in range(size):
+                self.infile.readline()
+            self.line_number += size
+        return True
 
     def read_event_header(self):
 
@@ -96,7 +155,7 @@ class o32reader:
 
         line = self.read_line()
         if not line:
-            raise StopIteration
+            return None
 
         if line != '# EVENT':
             print(line)
@@ -132,7 +191,7 @@ class o32reader:
         return hdr
 
 
-    def read_subevent(self):
+    def read_subevent_header(self):
 
         if self.read_line() != '## DATA SEGMENT':
             raise Exception('file format', 'invalid file format')
@@ -144,18 +203,18 @@ class o32reader:
         m = re.search('## *size: *(.*)', self.read_line())
         payload_size = int(m.group(1))
 
-        payload = bytes()
-        for i in range(payload_size):
-             dword = int(self.infile.readline().decode(), 0)
-             payload += struct.pack("<I",dword)
-        self.line_number += payload_size
-        
-        if 4*payload_size != len(payload):
-            logger.critical(
-                f"payload sizes do not match {4*payload_size} != {len(payload)}")
-            
-        return subevent_t(equipment_type, equipment_id, io.BytesIO(payload), len(payload))
+        return equipment_type, equipment_id, payload_size
 
+    def read_dwords(self, size):
+        """Read the lines with `size` data words, without converting them"""
+        lines = [self.infile.readline() for i in range(size)]
+        self.line_number += size
+        return lines
+
+    def read_subevent(self):
+        equipment_type, equipment_id, size = self.read_subevent_header()
+        payload = pack_dwords(self.read_dwords(size))
+        return SubEvent(equipment_type, equipment_id, payload)
 
 
     def read_line(self,logger=logger):
@@ -0,0 +1,103 @@
+"""Dword counts and parsing time per dword type, link and half-chamber
+
+A ParserStats object can be passed to TrdFeeParser (and the readers'
+add_trd_parser) with the `stats` argument. The parser then measures the
+time spent on every dword, and accounts it to the type of the handler that
+accepted the dword (HC0..3, MCM, MSK, ADC, TRK, EOT, EOD, PAD, SKP) or to
+NO-MATCH. Dwords that are skipped without decoding are counted with zero
+time. Without a ParserStats object, the parser only checks for None.
+
+Links are numbered in the order in which they appear in an event, and are
+identified by the half-chamber ID from the HC0 header (-1 if no HC0 header
+was found)."""
+
+import json
+
+
+class ParserStats:
+    """Dword counts, bytes and parsing time per dword type and link"""
+
+    def __init__(self):
+        self.events = 0
+        self.link = 0
+        self.current = dict()  # kind -> [dwords, seconds] of current link
+        self.links = dict()    # (link, hcid) -> {kind: [dwords, seconds]}
+
+    def add(self, kind, seconds, ndwords=1):
+        """Account dwords of the current link to a dword type"""
+        c = self.current.get(kind)
+        if c is None:
+            c = self.current[kind] = [0, 0.0]
+        c[0] += ndwords
+        c[1] += seconds
+
+    def end_link(self, hcid=-1):
+        """Add the counts of the current link to the totals"""
+        if not self.current:
+            return
+
+        totals = self.links.setdefault((self.link, hcid), dict())
+        for kind, (n, t) in self.current.items():
+            c = totals.setdefault(kind, [0, 0.0])
+            c[0] += n
+            c[1] += t
+
+        self.current = dict()
+        self.link += 1
+
+    def end_event(self):
+        self.events += 1
+        self.link = 0
+
+    def types(self):
+        """Totals per dword type: {kind: [dwords, seconds]}"""
+        result = dict()
+        for counts in self.links.values():
+            for kind, (n, t) in counts.items():
+                c = result.setdefault(kind, [0, 0.0])
+                c[0] += n
+                c[1] += t
+        return result
+
+    def as_dict(self):
+        """Results as a dict that can be serialized to JSON"""
+
+        def entry(n, t):
+            return dict(dwords=n, bytes=4*n, seconds=t)
+
+        return dict(
+            events=self.events,
+            types={k: entry(*v) for k, v in sorted(self.types().items())},
+            links=[dict(link=link, hcid=hcid,
+                        types={k: entry(*v) for k, v in sorted(counts.items())})
+                   for (link, hcid), counts in sorted(self.links.items())])
+
+    def table(self):
+        """Text tables with the totals per dword type and per link"""
+
+        types = self.types()
+        ttotal = sum(t for n, t in types.values()) or 1e-9
+
+        lines = [f"Parser statistics for {self.events} events",
+                 f"{'type':9s} {'dwords':>12s} {'bytes':>12s} {'time/s':>9s} {'ns/dword':>9s} {'time':>6s}"]
+        for kind, (n, t) in sorted(types.items(), key=lambda x: -x[1][1]):
+            lines.append(f"{kind:9s} {n:12d} {4*n:12d} {t:9.3f} "
+                         f"{1e9*t/max(n, 1):9.0f} {100*t/ttotal:5.1f}%")
+
+        lines.append("")
+        lines.append(f"{'link':>4s} {'hcid':>5s} {'dwords':>10s} {'time/s':>9s}  dwords per type")
+        for (link, hcid), counts in sorted(self.links.items()):
+            n = sum(c[0] for c in counts.values())
+            t = sum(c[1] for c in counts.values())
+            detail = " ".join(f"{k}={v[0]}" for k, v in sorted(counts.items()))
+            lines.append(f"{link:4d} {hcid:5d} {n:10d} {t:9.3f}  {detail}")
+
+        return "\n".join(lines)
+
+    def save(self, filename):
+        """Write the results to a JSON file (.json) or a text table"""
+        with open(filename, "w") as f:
+            if filename.endswith(".json"):
+                json.dump(self.as_dict(), f, indent=1)
+            else:
+                f.write(self.table() + "\n")
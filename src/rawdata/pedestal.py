@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import click
+import logging
+import multiprocessing
+import numpy as np
+
+from . import geometry
+from .digits import DigitsBatcher
+from .factory import make_reader
+from .rawlogging import ColorFormatter
+
+logger = logging.getLogger(__name__)
+
+# number of channels per detector
+nchannels = geometry.nrob * geometry.nmcm * geometry.nadc
+
+
+class PedestalCalculator(DigitsBatcher):
+    """Digits sink that calculates pedestal and noise of every channel
+
+    For every channel and time bin, the number of entries, the mean and the
+    sum of squared deviations from the mean are updated batch by batch with
+    Welford's algorithm, in the parallel form of Chan et al. to combine the
+    statistics of a batch with the running values. Memory is only allocated
+    for detectors that are present in the data, and does not grow with the
+    number of events. Time bins that were not read out, i.e. beyond the
+    `ntb` of a digit, are not counted.
+
+    Results from different instances, e.g. from worker processes, can be
+    combined with merge(). The running sums are saved and loaded with
+    save() and load()."""
+
+    def __init__(self, ntimebins=30, batchsize=4096):
+        super().__init__(ntimebins=ntimebins, batchsize=batchsize)
+        self.blocks = dict() # det -> [n, mean, m2]
+
+    def _block(self, det):
+        if det not in self.blocks:
+            self.blocks[det] = [
+                np.zeros((nchannels, self.ntimebins), dtype=np.int64),
+                np.zeros((nchannels, self.ntimebins)),
+                np.zeros((nchannels, self.ntimebins))]
+        return self.blocks[det]
+
+    def process_batch(self, batch):
+        tb = np.arange(self.ntimebins)
+        for det in np.unique(batch['det']):
+            digits = batch[batch['det'] == det]
+            chan = ((digits['rob'].astype(int)*geometry.nmcm + digits['mcm'])
+                    * geometry.nadc + digits['channel'])
+
+            # group the digits by channel
+            order = np.argsort(chan, kind='stable')
+            chan = chan[order]
+            adc = digits['adc'][order].astype(np.float64)
+
+            # time bins that were not read out are zero and do not count
+            valid = tb < digits['ntb'][order][:, None]
+
+            start = np.flatnonzero(np.diff(chan, prepend=-1))
+            count = np.diff(start, append=len(chan))
+
+            n = np.add.reduceat(valid.astype(np.int64), start, axis=0)
+            mean = np.add.reduceat(adc, start, axis=0) / np.maximum(n, 1)
+            dev = (adc - np.repeat(mean, count, axis=0)) * valid
+            m2 = np.add.reduceat(dev*dev, start, axis=0)
+
+            self._combine(self._block(int(det)), chan[start], n, mean, m2)
+
+    @staticmethod
+    def _combine(block, chan, n_b, mean_b, m2_b):
+        """Add statistics (n_b, mean_b, m2_b) for some channels to a block"""
+        n_a, mean_a, m2_a = block[0][chan], block[1][chan], block[2][chan]
+
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        frac = n_b / np.maximum(n, 1)
+        block[0][chan] = n
+        block[1][chan] = mean_a + delta * frac
+        block[2][chan] = m2_a + m2_b + delta*delta * n_a * frac
+
+    def merge(self, other):
+        """Add the statistics of another PedestalCalculator"""
+        if other.ntimebins != self.ntimebins:
+            raise ValueError("Cannot merge pedestals with different ntimebins")
+
+        for det, (n, mean, m2) in other.blocks.items():
+            chan = np.flatnonzero(n.any(axis=1))
+            self._combine(self._block(det), chan, n[chan], mean[chan], m2[chan])
+
+    def results(self):
+        """Return pedestal and noise of all channels with data
+
+        The result is a structured array with the number of events, the
+        pedestal mean and RMS over all time bins, and the mean and RMS for
+        every time bin. Time bins without entries have mean and RMS 0."""
+
+        ntb = self.ntimebins
+        dtype = np.dtype([
+            ('det', '<u2'), ('rob', 'u1'), ('mcm', 'u1'), ('channel', 'u1'),
+            ('nevents', '<u4'), ('mean', '<f4'), ('rms', '<f4'),
+            ('tbmean', '<f4', (ntb,)), ('tbrms', '<f4', (ntb,))])
+
+        parts = list()
+        for det in sorted(self.blocks):
+            n, mean, m2 = self.blocks[det]
+            chan = np.flatnonzero(n.any(axis=1))
+            n, mean, m2 = n[chan], mean[chan], m2[chan]
+
+            res = np.zeros(len(chan), dtype=dtype)
+            res['det'] = det
+            res['rob'], rest = np.divmod(chan, geometry.nmcm*geometry.nadc)
+            res['mcm'], res['channel'] = np.divmod(rest, geometry.nadc)
+            res['nevents'] = n.max(axis=1)
+            res['tbmean'] = mean
+            res['tbrms'] = np.sqrt(m2 / np.maximum(n, 1))
+
+            # pool the time bins, weighted with their number of entries
+            total = n.sum(axis=1)
+            pooled = (n * mean).sum(axis=1) / total
+            m2_pooled = m2.sum(axis=1) + (n * (mean - pooled[:, None])**2).sum(axis=1)
+            res['mean'] = pooled
+            res['rms'] = np.sqrt(m2_pooled / total)
+            parts.append(res)
+
+        if len(parts) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.concatenate(parts)
+
+    def save(self, filename):
+        """Save the running sums, so they can be merged later"""
+        dets = sorted(self.blocks)
+        np.savez(filename, ntimebins=self.ntimebins, dets=np.array(dets, dtype=int),
+                 n=np.array([self.blocks[d][0] for d in dets]).reshape(-1, nchannels, self.ntimebins),
+                 mean=np.array([self.blocks[d][1] for d in dets]).reshape(-1, nchannels, self.ntimebins),
+                 m2=np.array([self.blocks[d][2] for d in dets]).reshape(-1, nchannels, self.ntimebins),
+                 results=self.results())
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            calc = cls(ntimebins=int(f['ntimebins']))
+            n = f['n']
+            if n.ndim == 2:
+                # older files have one count for all time bins of a channel
+                n = np.repeat(n[:, :, None], calc.ntimebins, axis=2)
+            for i, det in enumerate(f['dets']):
+                calc.blocks[int(det)] = [n[i], f['mean'][i], f['m2'][i]]
+        return calc
+
+
+def _process_source(args):
+    """Calculate pedestals for one source (in a worker process)"""
+    source, ntimebins, skip_events, tracklet_format = args
+
+    if source.endswith(".npz"):
+        return PedestalCalculator.load(source)
+
+    logging.getLogger("rawlog").setLevel(logging.WARNING)
+
+    calc = PedestalCalculator(ntimebins=ntimebins)
+    reader = make_reader(source)
+    reader.add_trd_parser(store_digits=calc, tracklet_format=tracklet_format)
+    try:
+        reader.process(skip_events=skip_events)
+    finally:
+        calc.close()
+    return calc
+
+
+@click.command()
+@click.argument('sources', nargs=-1, required=True)
+@click.option('-o', '--output', default="pedestals.npz", help="Output file with running sums and results")
+@click.option('-c', '--csv', 'csvfile', default=None, help="Write pedestal and noise per channel to CSV file")
+@click.option('-j', '--jobs', default=1, help="Number of worker processes")
+@click.option('-n', '--ntimebins', default=30)
+@click.option('-k', '--skip-events', default=0)
+@click.option('-t', '--tracklet-format', default="auto")
+@click.option('--loglevel', default=logging.INFO)
+def raw2pedestal(sources, output, csvfile, jobs, ntimebins, skip_events, tracklet_format, loglevel):
+    """Calculate pedestal and noise for every channel in raw data files.
+
+    SOURCES can also be .npz files from earlier runs of raw2pedestal, which
+    are merged with the new data."""
+
+    ch = logging.StreamHandler()
+    ch.setFormatter(ColorFormatter())
+    logging.basicConfig(level=loglevel, handlers=[ch])
+
+    tasks = [(s, ntimebins, skip_events, tracklet_format) for s in sources]
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            partial = pool.imap_unordered(_process_source, tasks)
+            calc = PedestalCalculator(ntimebins=ntimebins)
+            for p in partial:
+                calc.merge(p)
+    else:
+        calc = PedestalCalculator(ntimebins=ntimebins)
+        for t in tasks:
+            calc.merge(_process_source(t))
+
+    calc.save(output)
+    logger.info(f"Saved pedestals for {len(calc.blocks)} detectors to {output}")
+
+    if csvfile is not None:
+        res = calc.results()
+        cols = ('det', 'rob', 'mcm', 'channel', 'nevents', 'mean', 'rms')
+        np.savetxt(csvfile, np.column_stack([res[c] for c in cols]),
+                   fmt=["%d"]*5 + ["%.3f"]*2, delimiter=",",
+                   header=",".join(cols), comments="")
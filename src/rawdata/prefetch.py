@@ -0,0 +1,220 @@
+"""Read-ahead of files in a background thread
+
+PrefetchReader reads a file in large chunks in a background thread, into a
+small ring of preallocated buffers. File reads release the GIL, so reading
+the next chunks overlaps with the parsing of the current one, which hides
+the latency of network filesystems.
+
+The readers access the data through open_prefetched(), which wraps the
+PrefetchReader in an io.BufferedReader. The parsers read single dwords, and
+the BufferedReader serves these reads without calling into Python code; it
+only calls PrefetchReader.readinto() when its buffer is empty. tell() is
+not buffered, BufferedReader.tell() calls PrefetchReader.tell() every time,
+so the parsers keep track of the position themselves. Seeks within the
+prefetched data are served from the ring; other seeks restart the
+background thread at the new position.
+
+On a local disk with the file in the page cache, reading is not the
+bottleneck, and the parsing takes as long as with a plain open().
+
+depth() is the number of chunks that were read ahead and wait for the
+parser, and `waits` counts the chunks the parser had to wait for. Both are
+exported by the metrics module."""
+
+import io
+import os
+import queue
+import threading
+
+# chunks are read at multiples of this size from the start of the file
+alignment = 4096
+
+
+class PrefetchReader(io.RawIOBase):
+    """Raw binary file that is read ahead in a background thread
+
+    Arguments:
+      filename  : file to read
+      chunksize : size of every read in bytes
+      nbuffers  : number of chunks in the ring of buffers"""
+
+    def __init__(self, filename, chunksize=4 << 20, nbuffers=4):
+        super().__init__()
+        self.name = filename
+        self._fd = os.open(filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self._size = os.fstat(self._fd).st_size
+
+        # small files do not need the full buffers
+        chunksize = max(min(chunksize, self._size), 1)
+        self.chunksize = (chunksize + alignment - 1) // alignment * alignment
+
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        for i in range(nbuffers):
+            self._free.put(bytearray(self.chunksize))
+
+        self._thread = None
+        self._chunk = None  # current buffer
+        self.waits = 0      # chunks that were not read ahead in time
+        self._start(0)
+
+    # ------------------------------------------------------------------
+    # background thread
+
+    def _start(self, pos):
+        """Start reading at pos, which does not have to be aligned"""
+        base = pos - pos % alignment
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(base, self._stop), daemon=True,
+            name="prefetch")
+
+        # the current chunk starts at base, and is empty until the first
+        # buffer arrives; _skip bytes of it are skipped
+        self._chunk = None
+        self._chunkpos = base
+        self._chunklen = 0
+        self._offset = 0
+        self._skip = pos - base
+        self._eof = False
+        self._thread.start()
+
+    def _run(self, pos, stop):
+        while not stop.is_set():
+            buf = self._free.get()
+            if stop.is_set():
+                self._free.put(buf)
+                break
+
+            try:
+                n = os.preadv(self._fd, [buf], pos) if hasattr(os, "preadv") \
+                    else self._pread(buf, pos)
+            except OSError as ex:
+                self._full.put((buf, ex))
+                break
+
+            self._full.put((buf, n))
+            pos += n
+            if n == 0:
+                break
+
+    def _pread(self, buf, pos):
+        data = os.pread(self._fd, len(buf), pos)
+        buf[:len(data)] = data
+        return len(data)
+
+    def _halt(self):
+        """Stop the background thread and recover all buffers"""
+        self._stop.set()
+        if self._chunk is not None:
+            self._free.put(self._chunk)
+            self._chunk = None
+
+        while self._thread.is_alive():
+            try:
+                self._free.put(self._full.get(timeout=0.01)[0])
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+        while not self._full.empty():
+            self._free.put(self._full.get()[0])
+
+    def _next_chunk(self):
+        """Switch to the next chunk, returns False at the end of the file"""
+        if self._eof:
+            return False
+
+        if self._chunk is not None:
+            self._free.put(self._chunk)
+            self._chunk = None
+
+        if self._full.empty():
+            self.waits += 1
+        buf, n = self._full.get()
+        if isinstance(n, Exception):
+            self._free.put(buf)
+            self._eof = True
+            raise n
+
+        self._chunkpos += self._chunklen
+        self._chunklen = n
+        self._offset = 0
+        if n == 0:
+            self._free.put(buf)
+            self._eof = True
+            return False
+
+        self._chunk = buf
+        self._view = memoryview(buf)
+        return True
+
+    def depth(self):
+        """Number of chunks that were read ahead and are not used yet"""
+        return self._full.qsize()
+
+    # ------------------------------------------------------------------
+    # RawIOBase interface
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self._fd
+
+    def readinto(self, b):
+        while self._offset + self._skip >= self._chunklen:
+            self._skip -= self._chunklen - self._offset
+            self._offset = self._chunklen
+            if not self._next_chunk():
+                return 0
+
+        self._offset += self._skip
+        self._skip = 0
+
+        n = min(len(b), self._chunklen - self._offset)
+        b[:n] = self._view[self._offset:self._offset+n]
+        self._offset += n
+        return n
+
+    def tell(self):
+        return self._chunkpos + self._offset + self._skip
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.tell()
+        elif whence == io.SEEK_END:
+            pos += self._size
+        if pos < 0:
+            raise ValueError(f"negative seek position {pos}")
+
+        # seeks within the current chunk, or forward within the data that
+        # is read ahead anyway
+        ahead = self._chunkpos + self._chunklen + self._full.qsize()*self.chunksize
+        if self._chunk is not None and self._chunkpos <= pos <= self._chunkpos + self._chunklen:
+            self._offset = pos - self._chunkpos
+            self._skip = 0
+        elif self._chunkpos + self._offset <= pos <= ahead:
+            self._skip = pos - self._chunkpos - self._offset
+        else:
+            self._halt()
+            self._start(pos)
+        return pos
+
+    def close(self):
+        if not self.closed:
+            self._halt()
+            os.close(self._fd)
+        super().close()
+
+
+def open_prefetched(filename, chunksize=4 << 20, nbuffers=4, buffer_size=io.DEFAULT_BUFFER_SIZE):
+    """Open a binary file for reading with read-ahead in a background thread"""
+    raw = PrefetchReader(filename, chunksize, nbuffers)
+    return io.BufferedReader(raw, buffer_size)
@@ -0,0 +1,183 @@
+"""Progress reports and timing of the processing stages
+
+The readers count events and the bytes they consumed in a Progress object.
+Reports with event rate, input rate and the estimated time to completion
+are logged at most every `interval` seconds, so the per-event cost is only
+a counter increment and a clock lookup.
+
+The time spent in the processing stages (read, decompress, parse, sink) is
+measured with nested `with progress.stage(name):` blocks. Time is always
+accounted to the innermost stage, e.g. digits sinks called by the parser
+do not count as parse time. A summary is logged when the reader is done.
+
+Events and stage durations are also passed on to a ProcessingMetrics
+object from the metrics module, if one is attached as `metrics`, and stage
+boundaries to a MemoryProfile from the memprofile module, if one is
+attached as `memory`."""
+
+import functools
+import logging
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def format_bytes(n):
+    """Human-readable size, e.g. 1.5 GB"""
+    for unit in ("bytes", "kB", "MB", "GB"):
+        if abs(n) < 1000 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "bytes" else f"{n:.1f} {unit}"
+        n /= 1000
+
+
+class Stage:
+    """Context manager that accounts the elapsed time to a stage"""
+
+    __slots__ = ("progress", "name")
+
+    def __init__(self, progress, name):
+        self.progress = progress
+        self.name = name
+
+    def __enter__(self):
+        self.progress._push(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.progress._pop()
+
+
+class Progress:
+    """Throttled progress reports and per-stage timing summary
+
+    Arguments:
+      interval : minimum time between reports in seconds, 0 disables them
+      total    : total number of input bytes, if known
+      position : callable that returns the number of bytes read so far
+      queue    : PrefetchReader of the input, for the metrics"""
+
+    def __init__(self, interval=10.0, total=None, position=None, queue=None):
+        self.interval = interval
+        self.events = 0
+        self.times = dict()
+        self._stages = dict()
+        self._stack = list()
+        self._starts = list()
+        self._closed = False
+        self.metrics = None
+        self.memory = None
+        self.start(total, position, queue)
+
+    def start(self, total=None, position=None, queue=None):
+        """(Re)start the clock, e.g. when the input is known"""
+        self.total = total
+        self.position = position
+        self.queue = queue
+        self.t0 = self._tmark = time.perf_counter()
+        self._next = self.t0 + self.interval
+        self._last = (self.t0, self.events, self.tell())
+
+    def tell(self):
+        return self.position() if self.position is not None else None
+
+    def stage(self, name):
+        """Context manager for a processing stage"""
+        if name not in self._stages:
+            self._stages[name] = Stage(self, name)
+            self.times[name] = 0.0
+        return self._stages[name]
+
+    def _push(self, name):
+        if self.memory is not None:
+            self.memory.enter(name)
+        now = time.perf_counter()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._tmark
+        self._stack.append(name)
+        self._starts.append(now)
+        self._tmark = now
+
+    def _pop(self):
+        now = time.perf_counter()
+        name = self._stack.pop()
+        start = self._starts.pop()
+        self.times[name] += now - self._tmark
+        self._tmark = now
+        if self.metrics is not None:
+            self.metrics.stage(name, now - start)
+        if self.memory is not None:
+            self.memory.exit(name)
+
+    def instrument(self, obj, method, name):
+        """Account the time spent in a method of obj to stage `name`
+
+        This is used for sinks, e.g. instrument(sink, "process_batch",
+        "sink"). The method is replaced on the instance only."""
+
+        func = getattr(obj, method)
+        stage = self.stage(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage:
+                return func(*args, **kwargs)
+
+        setattr(obj, method, wrapper)
+        return obj
+
+    def event(self, n=1):
+        """Count processed events, and report if it is time"""
+        self.events += n
+        if self.metrics is not None:
+            self.metrics.event(self, n)
+        if self.interval:
+            now = time.perf_counter()
+            if now >= self._next:
+                self.report(now)
+
+    def report(self, now=None):
+        """Log the rates since the last report and the remaining time"""
+        now = time.perf_counter() if now is None else now
+        pos = self.tell()
+        t, events, lastpos = self._last
+        dt = max(now - t, 1e-9)
+
+        msg = f"{self.events} events, {(self.events - events)/dt:.1f} events/s"
+        if pos is not None:
+            msg += f", {(pos - lastpos)/dt/1e6:.2f} MB/s"
+            if self.total is not None:
+                # the ETA is based on the average rate, which is more stable
+                remaining = max(self.total - pos, 0)
+                rate = pos / max(now - self.t0, 1e-9)
+                msg += f", {format_bytes(remaining)} remaining"
+                if rate > 0:
+                    msg += f", ETA {timedelta(seconds=int(remaining/rate))}"
+
+        logger.info(msg)
+        self._last = (now, self.events, pos)
+        self._next = now + self.interval
+
+    def summary(self):
+        """Multi-line summary of rates and time per stage"""
+        elapsed = max(time.perf_counter() - self.t0, 1e-9)
+        pos = self.tell()
+
+        lines = [f"Processed {self.events} events in {elapsed:.2f} s "
+                 f"({self.events/elapsed:.1f} events/s)"]
+        if pos is not None:
+            lines[0] += f", {format_bytes(pos)} ({pos/elapsed/1e6:.2f} MB/s)"
+
+        other = elapsed - sum(self.times.values())
+        for name, t in list(self.times.items()) + [("other", other)]:
+            lines.append(f"  {name:12s} {t:9.3f} s  {100*t/elapsed:5.1f}%")
+
+        return "\n".join(lines)
+
+    def close(self):
+        """Log the summary, only once"""
+        if not self._closed:
+            self._closed = True
+            logger.info(self.summary())
+            if self.memory is not None:
+                self.memory.close()
@@ -1,6 +1,7 @@
 
+import bisect
 import logging
-import struct
+import numpy as np
 import sys
 
 class StdoutHandler(logging.StreamHandler):
@@ -84,6 +85,17 @@ class TermColorFilter(logging.Filter):
         return True
 
 
+# Minimum verbosity to show each dword type in the hexdump. The default
+# verbosity is 5, and every -q of evdump reduces it by one.
+verbosity_levels = dict(
+    ADC=5,
+    MSK=4, TRK=4, TKD=4, TKL=4,
+    MCM=3, EOT=3, EOD=3, PAD=3, SKP=3,
+    HC1=2, HC2=2, HC3=2,
+    HC0=1,
+)
+
+
 class AddLocationFilter(logging.Filter):
     """
     This is a filter which injects contextual information into the log.
@@ -95,7 +107,7 @@ class AddLocationFilter(logging.Filter):
     def __init__(self, suppress=[]):
         self.addr = None
         self.dword = None
-        self.suppress = suppress
+        self.suppress = set(suppress)
 
     def set_location(self, addr, dword):
         self.addr = addr
@@ -107,8 +119,8 @@ class AddLocationFilter(logging.Filter):
       'HC2': { "prefix": '\033[0;37;104m' },
       'HC3': { "prefix": '\033[0;37;104m' },
       'MCM': { "prefix": '\033[1;34m' }, # bold blue
-      'MSK': { "prefix": '\033[30m', "suppress": False },
-      'ADC': { "prefix": '\033[90m', "suppress": False },
+      'MSK': { "prefix": '\033[30m' },
+      'ADC': { "prefix": '\033[90m' },
       'TRK': { "prefix": '\033[0;32m' },
       'EOT': { "prefix": '\033[0;34m' },
       'EOD': { "prefix": '\033[0;34m' },
@@ -116,27 +128,9 @@ class AddLocationFilter(logging.Filter):
     }
 
     def set_verbosity(self, verbosity):
-
-        if verbosity < 5:
-            self.dword_types['ADC']['suppress'] = True
-
-        if verbosity < 4:
-            self.dword_types['MSK']['suppress'] = True
-            self.dword_types['TRK']['suppress'] = True
-
-        if verbosity < 3:
-            self.dword_types['MCM']['suppress'] = True
-            self.dword_types['EOT']['suppress'] = True
-            self.dword_types['EOD']['suppress'] = True
-
-        if verbosity < 2:
-            self.dword_types['HC1']['suppress'] = True
-            self.dword_types['HC2']['suppress'] = True
-            self.dword_types['HC3']['suppress'] = True
-
-        if verbosity < 1:
-            self.dword_types['HC0']['suppress'] = True
-
+        """Suppress all dword types that need a higher verbosity"""
+        self.suppress = set(
+            k for k, v in verbosity_levels.items() if verbosity < v)
 
     def filter(self, record):
 
@@ -147,32 +141,41 @@ class AddLocationFilter(logging.Filter):
         else:
             record.where = " "*21
 
+        if rectype in self.suppress:
+            return False
 
         if rectype not in self.dword_types:
             return True
 
         opt = self.dword_types[rectype]
-
-        # if 'suppress' in opt and opt['suppress']:
-        #     return False
-
         record.msg = f"{opt['prefix']} {record.msg:45s}"
 
         return True
 
 
 class HexDump:
+    """Hexdump of binary data with 32, 64 or 128 bit words
+
+    Markers are messages that are shown before the word at a given address.
+    They are kept in lists sorted by address, which are walked with a cursor
+    while dumping. The address and data columns are formatted with numpy
+    for chunks of words at once, and every chunk is logged as one message."""
+
+    # markers for all hexdumps, sorted by address
+    _marker_addr = list()
+    _marker_msg = list()
 
-    _markers = dict()
+    _hexdigits = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+    def __init__(self, bitwidth=32, logger_name="hexdump", chunksize=4096):
+        if bitwidth not in (32, 64, 128):
+            raise ValueError(f"Invalid bitwidth {bitwidth}")
 
-    def __init__(self, bitwidth=32, logger_name="hexdump"):
         self.logger = logging.getLogger(logger_name)
-        self.fmtchar = {32: "I"}[bitwidth]
-        self.introfmt = {
-            32: "{addr:012X} {word:08X}    "
-        }[bitwidth]
-        # self.desc_fmt
-        self.bitwidth = 32
+        self.bitwidth = bitwidth
+        self.wordsize = bitwidth // 8
+        self.chunksize = chunksize
+        self.introfmt = "{addr:012X} {word:0" + str(bitwidth//4) + "X}    "
 
     def fromfile(self, stream, nbytes):
         addr = stream.tell()
@@ -181,27 +184,75 @@ class HexDump:
 
     @classmethod
     def add_marker(cls, addr, message):
-        if addr in cls._markers:
-            cls._markers[addr].append(message)
-        else:
-            cls._markers[addr] = [message]
+        i = bisect.bisect_right(cls._marker_addr, addr)
+        cls._marker_addr.insert(i, addr)
+        cls._marker_msg.insert(i, message)
+
+    @classmethod
+    def clear_markers(cls):
+        cls._marker_addr.clear()
+        cls._marker_msg.clear()
+
+    def _hex(self, values, ndigits):
+        """Format unsigned integers as arrays of ndigits hex characters"""
+        shifts = np.arange(4*(ndigits-1), -1, -4, dtype=np.uint64)
+        return self._hexdigits[(values[:, None] >> shifts) & np.uint64(0xF)]
+
+    def render(self, data, addr):
+        """Return the lines (without descriptions) for a chunk of words"""
+
+        words = np.frombuffer(data, dtype=np.uint32 if self.bitwidth == 32 else np.uint64)
+        words = words.astype(np.uint64).reshape(-1, max(1, self.bitwidth//64))
+        n = len(words)
+        addrs = np.uint64(addr) + np.arange(n, dtype=np.uint64) * np.uint64(self.wordsize)
+
+        blank = np.full((n, 1), ord(" "), dtype=np.uint8)
+        columns = [self._hex(addrs, 12), blank]
+        for i in reversed(range(words.shape[1])):  # most significant first
+            columns.append(self._hex(words[:, i], min(16, self.bitwidth//4)))
+        columns.append(np.repeat(blank, 4, axis=1))
+
+        lines = np.concatenate(columns, axis=1)
+        return lines.view(f"S{lines.shape[1]}").ravel().astype(str)
 
     def dump(self, data, addr, desc=None, fmt=tuple((""))):
-        for i,words in enumerate(struct.iter_unpack(self.fmtchar,data)):
-            if addr+4*i in self._markers:
-                for m in self._markers[addr+4*i]:
-                    self.logger.info(f"MARK: {m}")
-
-            if desc is None:
-                txt = ""
-            elif len(fmt) == 1:
-                txt = fmt[0] + desc[i]
-            elif len(fmt) == 2:
-                txt = (fmt[0] if i==0 else fmt[1]) + desc[i]
-            else:
-                txt = fmt[i] + desc[i]
 
-            self.dump_dword(addr+4*i, words[0], txt)
+        # pad incomplete words with zeros
+        if len(data) % self.wordsize:
+            data = data + b"\0" * (self.wordsize - len(data) % self.wordsize)
+        nwords = len(data) // self.wordsize
+
+        # prepare the text for each word, if there is any
+        if desc is not None:
+            if len(fmt) == 1:
+                fmt = fmt * nwords
+            elif len(fmt) == 2:
+                fmt = fmt[:1] + fmt[1:] * (nwords-1)
+            txt = [f+d for f, d in zip(fmt, desc)]
+
+        cursor = bisect.bisect_left(self._marker_addr, addr)
+        pos = 0
+        while pos < nwords:
+            end = min(nwords, pos + self.chunksize)
+
+            # show markers before the word that contains them, and stop
+            # the chunk at the next marker
+            while cursor < len(self._marker_addr):
+                mpos = (self._marker_addr[cursor] - addr) // self.wordsize
+                if mpos >= end:
+                    break
+                elif mpos > pos:
+                    end = mpos
+                    break
+                self.logger.info(f"MARK: {self._marker_msg[cursor]}")
+                cursor += 1
+
+            lines = self.render(data[pos*self.wordsize:end*self.wordsize],
+                                addr + pos*self.wordsize)
+            if desc is not None:
+                lines = [l + t for l, t in zip(lines, txt[pos:end])]
+            self.logger.info("\n".join(lines))
+            pos = end
 
     def dump_dword(self, addr, word, desc):
         text = self.introfmt.format(addr=addr, word=word) + desc
@@ -211,12 +262,8 @@ class HexDump:
 
         if len(args) == 1:
             # render all the descriptions
-            desc = list(d.format(**vars(args[0])) for d in args[0]._hexdump_desc)
-
-            # ensure we have the same width for all fields
-            maxlen = max(len(x) for x in desc)
-            for i,d in enumerate(desc):
-                desc[i] += " "*(maxlen-len(d)+3)
+            fields = args[0].asdict()
+            desc = list(d.format(**fields) for d in args[0].hexdump_desc())
 
             # check if we have a format (colors) for this object
             try:
@@ -224,6 +271,19 @@ class HexDump:
             except AttributeError:
                 fmt = tuple([""])
 
+            # descriptions are given for 32-bit dwords -> combine them for
+            # wider words
+            n = self.bitwidth // 32
+            if n > 1:
+                desc = [" ".join(desc[i:i+n]) for i in range(0, len(desc), n)]
+                if len(fmt) > 2:
+                    fmt = fmt[::n]
+
+            # ensure we have the same width for all fields
+            maxlen = max(len(x) for x in desc)
+            for i,d in enumerate(desc):
+                desc[i] += " "*(maxlen-len(d)+3)
+
             # call dump() to do the work
             self.dump(args[0]._data, args[0]._addr, desc, fmt)
         else:
@@ -2,40 +2,93 @@
 
 import click
 import logging
+import numpy as np
 
-from .header import TrdboxHeader
 # from .trdfeeparser import TrdFeeParser, logflt
 from .factory import make_reader
 from .rawlogging import ColorFormatter
+from .digits import DigitsBatcher, DigitsTee
+from .digitsfile import DigitsFileWriter
+from .histogram import AdcHistogram
+from .zerosuppression import ZeroSuppression
+from .accumulator import DigitsAccumulator
+from .clusters import ClusterFinder
+from .tracklets import TrackletBatcher
+from .parserstats import ParserStats
+from .memprofile import MemoryProfile
 # from .o32reader import o32reader
 # from .zmqreader import zmqreader
 
-class digits_csv_file:
+class digits_csv_file(DigitsBatcher):
 
     def __init__(self,filename="digits.csv", ntimebins=30):
+        super().__init__(ntimebins=ntimebins)
         self.outfile = open(filename,"w")
-        self.ntimebins = ntimebins
         self.outfile.write("ev,det,rob,mcm,channel,padrow,padcol")
         for i in range(self.ntimebins):
             self.outfile.write(f",A{i:02}")
         self.outfile.write("\n")
 
-    def __call__(self,ev,det,rob,mcm,ch,digits):
-        # TODO: calculate pad row/column from rob/mcm/channel
-        padrow = -1
-        padcol = -1
+    def process_batch(self, batch):
+        cols = [batch[k] for k in ('event', 'det', 'rob', 'mcm', 'channel', 'padrow', 'padcol')]
+        np.savetxt(self.outfile, np.column_stack(cols + [batch['adc']]),
+                   fmt="%d", delimiter=",")
 
-        # save output to file
-        self.outfile.write(f"{ev},{det},{rob},{mcm},{ch},{padrow},{padcol},")
-        self.outfile.write(",".join([str(x) for x in digits]))
-        self.outfile.write("\n")
+    def close(self):
+        super().close()
+        self.outfile.close()
+
+class tracklets_csv_file(TrackletBatcher):
+
+    def __init__(self,filename="tracklets.csv"):
+        super().__init__()
+        self.outfile = open(filename,"w")
+        self.outfile.write("ev,hcid,row,col,y,dy,pid\n")
+
+    def process_batch(self, batch):
+        np.savetxt(self.outfile, np.column_stack([batch[k] for k in batch.dtype.names]),
+                   fmt="%d", delimiter=",")
+
+    def close(self):
+        super().close()
+        self.outfile.close()
+
+class clusters_csv_file:
+
+    def __init__(self,filename="clusters.csv"):
+        self.outfile = open(filename,"w")
+        self.outfile.write("ev,det,padrow,padcol,tb,pos,charge\n")
+
+    def __call__(self, event, clusters):
+        np.savetxt(self.outfile, np.column_stack([clusters[k] for k in clusters.dtype.names]),
+                   fmt=["%d"]*5 + ["%.3f"]*2, delimiter=",")
+
+    def close(self):
+        self.outfile.close()
 
 @click.command()
 @click.argument('source', default='tcp://localhost:7776')
 @click.option('-o', '--loglevel', default=logging.INFO)
 @click.option('-k', '--skip-events', default=0)
 @click.option('-t', '--tracklet-format', default="auto")
-def rec_digits(source, loglevel, skip_events, tracklet_format):
+@click.option('-n', '--ntimebins', default=30, help="Maximum number of time bins per channel")
+@click.option('-f', '--format', 'output_format', default="csv",
+              type=click.Choice(["csv", "native", "none"]))
+@click.option('-T', '--tracklets', is_flag=True, help="Write tracklets to tracklets.csv")
+@click.option('--tracklets-only', is_flag=True, help="Write only tracklets, skip ADC data")
+@click.option('--histogram', default=None, help="Save ADC histograms per channel to this file")
+@click.option('-z', '--zero-suppress', is_flag=True, help="Subtract pedestals and drop empty channels")
+@click.option('-p', '--pedestals', default=None, help="Pedestal file from raw2pedestal")
+@click.option('--zs-threshold', default=10, help="Zero suppression threshold (ADC counts)")
+@click.option('-c', '--clusters', is_flag=True, help="Find clusters and write them to clusters.csv")
+@click.option('-P', '--progress', default=10.0, help="Seconds between progress reports, 0 to disable")
+@click.option('--parser-stats', default=None, help="Write dword counts and parsing time per type and link to this file (.json or text)")
+@click.option('--metrics-port', default=None, type=int, help="Serve Prometheus metrics on this local port")
+@click.option('--profile-memory', is_flag=True, help="Report peak and retained memory per stage with tracemalloc")
+def rec_digits(source, loglevel, skip_events, tracklet_format, ntimebins, output_format,
+               tracklets, tracklets_only, histogram, zero_suppress, pedestals,
+               zs_threshold, clusters, progress, parser_stats, metrics_port,
+               profile_memory):
 
     ch = logging.StreamHandler()
     ch.setFormatter(ColorFormatter())
@@ -45,10 +98,85 @@ def rec_digits(source, loglevel, skip_events, tracklet_format):
     # logflt.set_verbosity(0)
     logging.getLogger("rawlog").setLevel(logging.WARNING)
 
+    # Digits are written to a CSV file or the native binary format
+    digits_sinks = list()
+    if tracklets_only:
+        tracklets = True
+    elif output_format == "native":
+        digits_sinks.append(DigitsFileWriter("digits.trdd", ntimebins=ntimebins))
+    elif output_format == "csv":
+        digits_sinks.append(digits_csv_file("digits.csv", ntimebins=ntimebins))
+
+    # Histograms of ADC values are saved periodically for monitoring
+    if histogram is not None and not tracklets_only:
+        digits_sinks.append(AdcHistogram(ntimebins=ntimebins, snapshot=histogram))
+
+    # Clusters are found in dense per-event arrays
+    store_clusters = None
+    if clusters and not tracklets_only:
+        store_clusters = clusters_csv_file("clusters.csv")
+        digits_sinks.append(DigitsAccumulator(
+            ClusterFinder(store_clusters), ntimebins=ntimebins))
+
+    if len(digits_sinks) == 0:
+        store_digits = None
+    elif len(digits_sinks) == 1:
+        store_digits = digits_sinks[0]
+    else:
+        store_digits = DigitsTee(*digits_sinks)
+
+    # Optional processing stage between parser and digits sinks
+    if store_digits is not None and (zero_suppress or pedestals is not None):
+        store_digits = ZeroSuppression(store_digits, pedestals=pedestals,
+                                       threshold=zs_threshold,
+                                       sum_threshold=2*zs_threshold)
+
+    store_tracklets = tracklets_csv_file("tracklets.csv") if tracklets else None
+
+    stats = ParserStats() if parser_stats is not None else None
+
+    # Metrics for external monitoring, served from a background thread
+    processing_metrics = None
+    if metrics_port is not None:
+        from . import metrics
+        registry = metrics.Registry()
+        processing_metrics = metrics.ProcessingMetrics(registry)
+        logging.getLogger().addHandler(
+            metrics.MetricsLogHandler(processing_metrics))
+        metrics.serve(metrics_port, registry)
+    errors = (processing_metrics.parse_errors.values
+              if processing_metrics is not None else None)
+
     # Instantiate the reader that will get events and subevents from the source
     reader = make_reader(source)
-    reader.add_trd_parser(store_digits=digits_csv_file("digits.csv"), tracklet_format=tracklet_format)
-    reader.process(skip_events=skip_events)
+    reader.add_trd_parser(store_digits=store_digits,
+                          store_tracklets=store_tracklets,
+                          tracklet_format=tracklet_format,
+                          mode="tracklets" if store_digits is None else "digits",
+                          stats=stats, errors=errors)
+
+    # Time spent in the sinks is reported separately from the parsing
+    reader.progress.interval = progress
+    for store in (store_digits, store_tracklets):
+        if store is not None:
+            reader.progress.instrument(store, "process_batch", "sink")
+            if hasattr(store, "end_event"):
+                reader.progress.instrument(store, "end_event", "sink")
+
+    if profile_memory:
+        reader.progress.memory = MemoryProfile()
+
+    if processing_metrics is not None:
+        reader.progress.metrics = processing_metrics
+
+    try:
+        reader.process(skip_events=skip_events)
+    finally:
+        for store in (store_digits, store_tracklets, store_clusters):
+            if store is not None:
+                store.close()
+        if stats is not None:
+            stats.save(parser_stats)
 
     # # The actual parsing of TRD subevents is handled by the LinkParser
     # lp = LinkParser(store_digits=digits_csv_file("digits.csv"))
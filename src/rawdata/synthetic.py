@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Synthetic TRD raw data with a known ground truth
+
+SyntheticEvents generates random ADC data and tracklets for a set of
+half-chambers, and encodes them with the encoder. The ground truth is
+returned in the same structured arrays that the digits and tracklet sinks
+receive from the parser, so parser output can be compared directly."""
+
+import click
+import logging
+import numpy as np
+import os
+
+from . import geometry
+from .digits import digits_dtype
+from .digitsfile import DigitsFileWriter
+from .encoder import encode_link, MiniDaqWriter, O32Writer, TimeFrameWriter
+from .geometry import get_stack, map_digits
+from .rawlogging import ColorFormatter
+from .tracklets import tracklet_dtype
+
+logger = logging.getLogger(__name__)
+
+# fixed start time of the first event, so that files are reproducible
+start_time = 1651485600.0
+
+
+class SyntheticEvents:
+    """Random TRD events with a known ground truth
+
+    Every event contains the data of the same half-chambers. A hit is
+    placed on a channel with the probability `occupancy`, and spreads to
+    the neighbouring channels of the MCM. The ADC values are a pedestal
+    with Gaussian noise, taken from a pool of precomputed values, plus a
+    pulse for the hits. With zero suppression, the channels above
+    threshold and their neighbours are sent. Without zero suppression, all
+    MCMs are sent with all channels.
+
+    The number of tracklets per link follows a Poisson distribution with
+    mean `tracklet_rate`. With probability `corruption`, one bit is flipped
+    in a random dword of a link. The ground truth is not corrupted, but the
+    affected links are listed.
+
+    Arguments:
+      hcids           : half-chamber IDs (2*det + side), one per link
+      ntb             : number of time bins
+      zs              : zero-suppressed ADC data
+      occupancy       : fraction of channels with a hit
+      tracklet_rate   : mean number of tracklets per link
+      tracklet_format : "run2" or "run3"
+      corruption      : probability of a bit flip per link
+      seed            : seed for the random number generator"""
+
+    def __init__(self, hcids=(0,), ntb=30, zs=True, occupancy=0.01,
+                 tracklet_rate=2.0, tracklet_format="run3", corruption=0.0,
+                 pedestal=10, noise=1.2, amplitude=100, threshold=10, seed=None):
+
+        if tracklet_format not in ("run2", "run3"):
+            raise ValueError(f"Invalid tracklet format '{tracklet_format}'")
+
+        self.hcids = tuple(hcids)
+        self.ntb = ntb
+        self.zs = zs
+        self.occupancy = occupancy
+        self.tracklet_rate = tracklet_rate
+        self.tracklet_format = tracklet_format
+        self.corruption = corruption
+        self.pedestal = pedestal
+        self.noise = noise
+        self.amplitude = amplitude
+        self.threshold = threshold
+        self.rng = np.random.default_rng(seed)
+
+        # Generating the noise is the most expensive part -> prepare a pool
+        # of ADC values, and take the noise of every link from this pool
+        self._noise = np.clip(np.rint(pedestal + noise*self.rng.standard_normal(
+            1 << 22)), 0, 1023).astype(np.uint16)
+
+        # pulse shape with a maximum of 1 at time bin 6
+        t = np.arange(ntb) - 3.0
+        self.pulse = np.where(t > 0, t/3 * np.exp(1 - t/3), 0.0)
+
+    def generate(self, event):
+        """Generate the links and the ground truth for one event
+
+        Returns (links, truth), where links is a list with the dwords of
+        every link, and truth is a dict with:
+          digits    : structured array with digits_dtype(ntb)
+          tracklets : structured array with tracklet_dtype
+          corrupted : half-chamber IDs of corrupted links"""
+
+        links = list()
+        truth = dict(digits=list(), tracklets=list(), corrupted=list())
+
+        for hcid in self.hcids:
+            adc, mask = self.adc(hcid)
+            tracklets = self.tracklets(event, hcid)
+            link = encode_link(hcid, event, adc, mask, tracklets, zs=self.zs,
+                               tracklet_format=self.tracklet_format)
+
+            if self.rng.random() < self.corruption:
+                i = self.rng.integers(len(link))
+                link[i] ^= np.uint32(1 << int(self.rng.integers(32)))
+                truth['corrupted'].append(hcid)
+
+            links.append(link)
+            truth['digits'].append(self.digits(event, hcid, adc, mask))
+            truth['tracklets'].append(tracklets)
+
+        truth['digits'] = np.concatenate(truth['digits'])
+        truth['tracklets'] = np.concatenate(truth['tracklets'])
+        return links, truth
+
+    def adc(self, hcid):
+        """ADC values [i, mcm, channel, timebin] for ROBs 2*i+side, and the
+        mask of channels to send (None without zero suppression)"""
+
+        nrob = geometry.get_nrob(get_stack(hcid // 2)) // 2
+        shape = (nrob, geometry.nmcm, geometry.nadc)
+
+        # pedestal and noise from a random position in the pool
+        n = nrob * geometry.nmcm * geometry.nadc * self.ntb
+        start = self.rng.integers(len(self._noise) - n)
+        adc = self._noise[start:start+n].reshape(shape + (self.ntb,)).copy()
+
+        hits = self.rng.random(shape) < self.occupancy
+        signal = np.zeros(shape)
+        signal[hits] = self.rng.exponential(self.amplitude, hits.sum())
+        spread = signal.copy()
+        spread[..., 1:] += 0.3 * signal[..., :-1]
+        spread[..., :-1] += 0.3 * signal[..., 1:]
+
+        sel = spread > 0
+        adc[sel] = np.clip(adc[sel] + np.rint(spread[sel, None] * self.pulse), 0, 1023)
+
+        if not self.zs:
+            return adc, None
+
+        # channels above threshold, and their neighbours
+        above = np.any(adc > self.pedestal + self.threshold, axis=-1)
+        mask = above.copy()
+        mask[..., 1:] |= above[..., :-1]
+        mask[..., :-1] |= above[..., 1:]
+        return adc, mask
+
+    def digits(self, event, hcid, adc, mask):
+        """Ground truth for the digits of one link, in the order of the data"""
+
+        det, side = divmod(hcid, 2)
+        if mask is None:
+            mask = np.ones(adc.shape[:-1], dtype=bool)
+
+        robidx, mcm, channel = np.nonzero(mask)
+        digits = np.zeros(len(robidx), dtype=digits_dtype(self.ntb))
+        digits['event'] = event
+        digits['det'] = det
+        digits['rob'] = 2*robidx + side
+        digits['mcm'] = mcm
+        digits['channel'] = channel
+        digits['ntb'] = self.ntb
+        digits['adc'] = adc[mask]
+        return map_digits(digits)
+
+    def tracklets(self, event, hcid):
+        """Random tracklets of one link, in the order of the data"""
+
+        n = self.rng.poisson(self.tracklet_rate)
+        trk = np.zeros(n, dtype=tracklet_dtype)
+        trk['event'] = event
+        trk['hcid'] = hcid
+        trk['row'] = self.rng.integers(0, geometry.get_nrow(get_stack(hcid // 2)), n)
+
+        if self.tracklet_format == "run3":
+            trk['col'] = self.rng.integers(0, 4, n)
+            trk['y'] = self.rng.integers(-1024, 1024, n)
+            trk['dy'] = self.rng.integers(-128, 128, n)
+            trk['pid'] = (self.rng.integers(0, 0xFF, n) << 12
+                          | self.rng.integers(0, 0x1000, n))
+        else:
+            # y=-4096 could produce the tracklet end marker
+            trk['col'] = -1
+            trk['y'] = self.rng.integers(-4095, 4096, n)
+            trk['dy'] = self.rng.integers(-64, 64, n)
+            trk['pid'] = self.rng.integers(0, 0x100, n)
+
+        return trk[np.lexsort((trk['col'], trk['row']))]
+
+
+def make_writer(filename):
+    """Instantiate the writer for a file, based on the file name"""
+
+    if filename.endswith(".o32"):
+        return O32Writer(filename)
+    elif filename.endswith(".tf"):
+        return TimeFrameWriter(filename)
+    elif filename.endswith(".bin"):
+        return MiniDaqWriter(filename)
+    else:
+        raise ValueError(f"unknown output type: {filename}")
+
+
+def parse_size(text):
+    """Convert a size like 500M or 2G to bytes"""
+    units = dict(K=1 << 10, M=1 << 20, G=1 << 30)
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+@click.command()
+@click.argument('output')
+@click.option('-n', '--nevents', default=100, help="Number of events")
+@click.option('-S', '--size', default=None, help="Write events until the file reaches this size, e.g. 2G")
+@click.option('-l', '--links', default=1, help="Number of half-chambers per event")
+@click.option('--first-hcid', default=0, help="Half-chamber ID of the first link")
+@click.option('-b', '--ntimebins', default=30)
+@click.option('--zs/--no-zs', default=True, help="Zero-suppressed ADC data")
+@click.option('-c', '--occupancy', default=0.01, help="Fraction of channels with a hit")
+@click.option('-T', '--tracklets', 'tracklet_rate', default=2.0, help="Mean number of tracklets per link")
+@click.option('-t', '--tracklet-format', default=None,
+              type=click.Choice(["run2", "run3"]), help="Default: run2 for o32, run3 otherwise")
+@click.option('--corruption', default=0.0, help="Probability of a bit flip per link")
+@click.option('--seed', default=None, type=int)
+@click.option('--truth', default=None, help="Write the ground truth to TRUTH.trdd and TRUTH.npz")
+@click.option('-o', '--loglevel', default=logging.INFO)
+def rawsynth(output, nevents, size, links, first_hcid, ntimebins, zs, occupancy,
+             tracklet_rate, tracklet_format, corruption, seed, truth, loglevel):
+    """Write synthetic raw data with a known ground truth.
+
+    The format is selected by the extension of OUTPUT: .bin for MiniDAQ,
+    .o32 for o32 and .tf for time frames. The ground truth digits are
+    written in the native digits format, the tracklets and the list of
+    corrupted links to a NumPy .npz file."""
+
+    ch = logging.StreamHandler()
+    ch.setFormatter(ColorFormatter())
+    logging.basicConfig(level=loglevel, handlers=[ch])
+
+    if tracklet_format is None:
+        tracklet_format = "run2" if output.endswith(".o32") else "run3"
+
+    try:
+        writer = make_writer(output)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint="OUTPUT")
+
+    maxsize = parse_size(size) if size is not None else None
+
+    generator = SyntheticEvents(
+        hcids=range(first_hcid, first_hcid+links), ntb=ntimebins, zs=zs,
+        occupancy=occupancy, tracklet_rate=tracklet_rate,
+        tracklet_format=tracklet_format, corruption=corruption, seed=seed)
+
+    truth_digits = None
+    if truth is not None:
+        truth_digits = DigitsFileWriter(truth + ".trdd", ntimebins=ntimebins)
+    truth_tracklets = list()
+    truth_corrupted = list()
+
+    event = 0
+    try:
+        with writer:
+            while (event < nevents) if maxsize is None else (writer.tell() < maxsize):
+                data, evtruth = generator.generate(event)
+                writer.write_event(data, timestamp=start_time + 1e-3*event)
+
+                if truth_digits is not None and len(evtruth['digits']):
+                    truth_digits.process_batch(evtruth['digits'])
+                truth_tracklets.append(evtruth['tracklets'])
+                truth_corrupted.extend((event, hcid) for hcid in evtruth['corrupted'])
+                event += 1
+
+            logger.info(f"Wrote {event} events ({writer.tell()} bytes) to {output}")
+
+    except ValueError as ex:
+        # events that do not fit into the format, e.g. non-ZS data of
+        # several links in the 64 kB of a MiniDAQ event -> no partial files
+        os.remove(output)
+        if truth_digits is not None:
+            truth_digits.close()
+            os.remove(truth + ".trdd")
+        raise click.UsageError(
+            f"{ex} in event {event}, write fewer links (-l) or time bins "
+            f"(-b) per event, or another format")
+
+    if truth is not None:
+        truth_digits.close()
+        np.savez(truth + ".npz",
+                 tracklets=np.concatenate(truth_tracklets),
+                 corrupted=np.array(truth_corrupted, dtype=int).reshape(-1, 2))
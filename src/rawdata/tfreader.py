@@ -2,12 +2,15 @@
 #
 
 import logging
-from sqlite3 import DataError
-import numpy as np
-from struct import unpack
+import os
+from struct import pack, unpack
 
+from . import dumpwriter
 from .base import BaseParser, BaseHeader
 from .bitstruct import BitStruct
+from .event import Event, EventIndex, EventReader, SubEvent
+from .prefetch import open_prefetched
+from .progress import Progress
 # from .trdfeeparser import make_trd_parser
 
 logger = logging.getLogger(__name__)
@@ -54,6 +57,15 @@ class DataHeader:
         fields = unpack('<LLL4s', rawdata[0x50:0x60])
         self.orbit, self.tfcount, self.runno = fields[0:3]
         
+    @staticmethod
+    def pack(datadesc, origin, subspec=0, datasize=0, part=0, nparts=1,
+             orbit=0, tfcount=0, runno=0):
+        """Build the raw data of a DataHeader - the inverse of parse()"""
+        return pack('<4sLLL8s8s16s4sL8sLLQLLL4s',
+            b"O2O2", 0x60, 0, 1, b"DataHDR", b"", datadesc.encode(),
+            origin.encode(), nparts, b"NONE", subspec, part, datasize,
+            orbit, tfcount, runno, b"")
+
     def __str__(self):
         return f"{self.magic} - {self.datadesc} - {self.origin}/{self.subspec}: part #{self.part} of {self.nparts} payload={self.datasize}b"
 
@@ -92,13 +104,19 @@ class RawDataHeader(BaseHeader):
         
     https: // gitlab.cern.ch/AliceO2Group/wp6-doc/-/blob/master/rdh/RDHv6.md"""
 
+    __slots__ = ()
+    _hexdump_kind = "RDH"
+
     def __init__(self,data,addr):
         super().__init__(data,addr)
-        assert(self.zero7==0)
-        
-        self._hexdump_desc[0] = "RDHv{version} fee={fee}"
 
-        self._hexdump_fmt = ('\033[1;37;40m', '\033[0;37;100m')
+        # zero7 is the last 64-bit word - check it without decoding the RDH
+        assert(data[-8:] == b"\0"*8)
+
+    def hexdump_desc(self):
+        desc = list(self._hexdump_desc)
+        desc[0] = "RDHv{version} fee={fee}"
+        return desc
 
         # self._hexdump_desc[8:16] = ""
 
@@ -114,32 +132,115 @@ class RawDataHeader(BaseHeader):
 
 
 
-class TimeFrameReader:
+class TimeFrameReader(EventReader):
     """Reader class for ALICE O2 time frames.
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over the time frames in the file.
+    Consecutive DataHeaders with the same time frame counter form one
+    event, with one sub-event per DataHeader. Its equipment type is the
+    origin (e.g. "TRD"), and its equipment ID the sub-specification."""
 
     def __init__(self, filename):
-        self.file = open(filename,"rb")
+        self.file = open_prefetched(filename)
+        self.index = EventIndex()
         self.parsers = dict()
         # self.log_header = lambda x: x.hexdump()
         self._skipped_stf = dict()
+        self.progress = Progress()
 
     def add_trd_parser(self, **kwargs):
-        # self.parsers['TRD'] = make_trd_parser(has_cruheader=False, **kwargs)  
-        pass
+        # trdfeeparser needs the RDH from this module -> import it here
+        from .trdfeeparser import make_trd_parser
+        self.parsers['TRD'] = make_trd_parser(has_cruheader=True, **kwargs)
     
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, pos):
+        self.file.seek(pos)
+
+    def read_header(self):
+        """Read the next DataHeader, None at the end of the file"""
+        addr = self.file.tell()
+        data = self.file.read(0x60)
+        if len(data) < 0x60:
+            return None
+        return DataHeader(data, addr)
+
+    def read_timeframe(self, read_payload):
+        """Read the DataHeaders of the next time frame, and their payload
+        if read_payload is set, otherwise skip over it"""
+
+        parts = list()
+        while True:
+            hdr = self.read_header()
+            if hdr is None:
+                break
+            if parts and hdr.tfcount != parts[0][0].tfcount:
+                self.file.seek(hdr._addr)
+                break
+            if read_payload:
+                parts.append((hdr, self.file.read(hdr.datasize)))
+            else:
+                parts.append((hdr, None))
+                self.file.seek(hdr.datasize, 1)
+        return parts
+
+    def read_event(self, number):
+        parts = self.read_timeframe(True)
+        if not parts:
+            return None
+
+        # the headers are already decoded -> sub-events are cheap
+        return Event(number, None, [
+            SubEvent(hdr.origin, hdr.subspec, payload, hdr._addr + 0x60)
+            for hdr, payload in parts])
+
+    def skip_event(self):
+        return len(self.read_timeframe(False)) > 0
+
+    def skip_timeframes(self, n):
+        """Skip n time frames, and count the skipped events in the parsers
+
+        The TRD parser counts an event for every half-CRU block, which ends
+        with an RDH with the stop bit. The skipped events are counted in the
+        same way, to keep the event numbers."""
+
+        for event in self.events(0, n):
+            for subevent in event.subevents:
+                if subevent.equipment_type in self.parsers:
+                    parser = self.parsers[subevent.equipment_type]
+                    for i in range(count_stop_bits(subevent.payload)):
+                        parser.next_event()
+
     def process(self, skip_events=0):
+        """Read entire file, skipping the first `skip_events` time frames"""
+        self.progress.start(os.fstat(self.file.fileno()).st_size, self.file.tell,
+                            self.file.raw)
+        try:
+            self.skip_timeframes(skip_events)
+            self._process()
+        finally:
+            self.progress.close()
+
+    def _process(self):
         while self.file.readable():
             addr = self.file.tell()
-            data = self.file.read(0x60)
+            with self.progress.stage("read"):
+                data = self.file.read(0x60)
             if len(data)==0:
                 break
             hdr = DataHeader(data, addr)
             self.log_header(hdr)
 
             if hdr.origin in self.parsers:
-                self.parsers[hdr.origin].read(self.file, hdr.datasize)
+                # a time frame contains many events (triggers), which are
+                # counted by the parser, like in the other readers
+                parser = self.parsers[hdr.origin]
+                first = parser.event
+                with self.progress.stage("parse"):
+                    parser.read(self.file, hdr.datasize)
+                self.progress.event(parser.event - first)
 
             else:
                 self.file.seek(hdr.datasize, 1)  # skip over payload
@@ -165,26 +266,152 @@ class TimeFrameReader:
             logging.getLogger("raw.o2h").info(msg)
 
 
+def page_size(rdh):
+    """Size of the page of an RDH, up to the next RDH
+
+    The next RDH follows after `offset` bytes, or after the data if the
+    offset is not set."""
+
+    if rdh.datasize < RawDataHeader.header_size or (
+            rdh.offset != 0 and rdh.offset < rdh.datasize):
+        raise ValueError(
+            f"Invalid RDH at 0x{rdh._addr:X}: data size {rdh.datasize}, "
+            f"offset {rdh.offset}")
+    return max(rdh.offset, rdh.datasize)
+
+
+def count_stop_bits(data):
+    """Number of RDHs with the stop bit in a sequence of RDH pages"""
+    n = 0
+    pos = 0
+    while pos + RawDataHeader.header_size <= len(data):
+        rdh = RawDataHeader(bytes(data[pos:pos+RawDataHeader.header_size]), pos)
+        n += rdh.stop
+        pos += page_size(rdh)
+    return n
+
+
+class RawLinkReader(EventReader):
+    """Reader class for raw link data, i.e. a sequence of RDH pages without
+    O2 DataHeaders, as written by the CRU readout (.lnk, .raw)
+
+    An event ends with every RDH with the stop bit. As events, the class
+    yields the pages up to the stop bit, with one sub-event per page. Its
+    equipment type is "TRD", and its equipment ID the FEE ID of the RDH."""
+
+    def __init__(self, filename):
+        self.file = open_prefetched(filename)
+        self.filesize = os.fstat(self.file.fileno()).st_size
+        self.index = EventIndex()
+        self.parsers = dict()
+        self.progress = Progress()
+
+    def add_trd_parser(self, **kwargs):
+        from .trdfeeparser import make_trd_parser
+        self.parsers['TRD'] = make_trd_parser(has_cruheader=True, **kwargs)
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, pos):
+        self.file.seek(pos)
+
+    def read_pages(self, read_payload):
+        """Read the RDH pages up to the next stop bit, with their payload if
+        read_payload is set, otherwise skip over it"""
+
+        pages = list()
+        while self.file.tell() + RawDataHeader.header_size <= self.filesize:
+            rdh = RawDataHeader.read(self.file)
+            pagesize = page_size(rdh)
+            if read_payload:
+                data = self.file.read(pagesize - RawDataHeader.header_size)
+                pages.append((rdh, data))
+            else:
+                pages.append((rdh, None))
+                self.file.seek(rdh._addr + pagesize)
+            if rdh.stop:
+                break
+        return pages
+
+    def read_event(self, number):
+        pages = self.read_pages(True)
+        if not pages:
+            return None
+
+        def decode():
+            hsize = RawDataHeader.header_size
+            return [SubEvent("TRD", rdh.fee, memoryview(data)[:rdh.datasize-hsize],
+                             rdh._addr + hsize)
+                    for rdh, data in pages]
+
+        return Event(number, None, decode)
+
+    def skip_event(self):
+        return len(self.read_pages(False)) > 0
+
+    def process(self, skip_events=0):
+        self.progress.start(self.filesize, self.file.tell, self.file.raw)
+        try:
+            # the parser counts the skipped events, to keep the event numbers
+            for i in range(self.seek_event(skip_events)):
+                for parser in self.parsers.values():
+                    parser.next_event()
+
+            while self.file.tell() + RawDataHeader.header_size <= self.filesize:
+                addr = self.file.tell()
+                with self.progress.stage("read"):
+                    rdh = RawDataHeader.read(self.file)
+                pagesize = page_size(rdh)
+                self.file.seek(addr)
+
+                # RdhStreamParser reads the RDH again
+                if 'TRD' in self.parsers:
+                    with self.progress.stage("parse"):
+                        self.parsers['TRD'].read(self.file, rdh.datasize)
+
+                # the next RDH can follow after padding
+                self.file.seek(addr + pagesize)
+                if rdh.stop:
+                    self.progress.event()
+        finally:
+            self.progress.close()
+
+
 class RdhStreamParser(BaseParser):
     def __init__(self, payload_parser):
         self.parser = payload_parser
-        self.hexdump = lambda x: None # Default: no logging
+        self.dump = dumpwriter.get_writer()
+
+    def next_event(self):
+        """Count an event without data, e.g. one that was skipped"""
+        self.parser.next_event()
+
+    @property
+    def event(self):
+        return self.parser.event
 
     def read(self, stream, size):
 
         maxpos = stream.tell()+size
         while stream.tell() < maxpos:
             if size < RawDataHeader.header_size:
-                raise DataError("Insufficient data")
+                raise ValueError("Insufficient data for RDH")
 
             rdh = RawDataHeader.read(stream)
-            self.hexdump(rdh)
+            if self.dump.enabled("RDH"):
+                rdh.hexdump()
+            else:
+                self.dump.count("RDH", RawDataHeader.header_size // 4)
             payload_size = rdh.datasize - RawDataHeader.header_size
             self.parser.read(stream, payload_size)
 
 if __name__=="__main__":
-    reader = TimeFrameReader(
-        "/Users/tom/cernbox/data/noise/504419/o2_rawtf_run00504419_tf00006252.tf")
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    reader = TimeFrameReader(sys.argv[1])
+    reader.add_trd_parser()
+    reader.process()
 
 
 
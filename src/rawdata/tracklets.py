@@ -0,0 +1,158 @@
+
+import numpy as np
+
+from .constants import eotmarker
+
+
+# Structured dtype for tracklets. The position y and the deflection dy are
+# sign-extended. Run 2 tracklets have no MCM column, and col is set to -1 for
+# them. The pid of run 3 tracklets combines the 8 bits from the MCM header
+# with the 12 bits from the tracklet word.
+tracklet_dtype = np.dtype([
+    ('event', '<u4'), ('hcid', '<u2'), ('row', 'i1'), ('col', 'i1'),
+    ('y', '<i2'), ('dy', 'i1'), ('pid', '<u4')])
+
+
+def signed(value, nbits):
+    """Interpret the lowest nbits of value as a two's complement number"""
+    return (value ^ (1 << (nbits-1))) - (1 << (nbits-1))
+
+
+class TrackletBatcher:
+    """Base class for tracklet sinks that work on batches of tracklets
+
+    The TrdFeeParser hands over one tracklet at a time via the
+    store_tracklets callback. Like DigitsBatcher for digits, this class
+    collects them in a preallocated structured array and passes them on to
+    process_batch(). Arrays from extract_tracklets() can be passed to
+    process_batch() directly."""
+
+    def __init__(self, batchsize=4096):
+        self._buffer = np.zeros(batchsize, dtype=tracklet_dtype)
+        self._nbuf = 0
+
+    def __call__(self, event, hcid, row, col, y, dy, pid):
+        self._buffer[self._nbuf] = (event, hcid, row, col, y, dy, pid)
+        self._nbuf += 1
+        if self._nbuf == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        """Pass all buffered tracklets on to process_batch()"""
+        if self._nbuf > 0:
+            self.process_batch(self._buffer[:self._nbuf])
+            self._nbuf = 0
+
+    def process_batch(self, batch):
+        """Virtual function to process a structured array of tracklets"""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+def extract_tracklets(link, tracklet_format="run3", event=0, hcid=None):
+    """Decode the tracklets of one link into a structured array
+
+    The tracklet section at the start of the link data is decoded with
+    NumPy operations, without walking the dwords one by one. Decoding stops
+    at the first tracklet end marker, the remaining link data is ignored.
+
+    Arguments:
+      link            : bytes or array of uint32 with the data of one link
+      tracklet_format : "run2" or "run3"
+      event           : event number stored with the tracklets
+      hcid            : half-chamber ID, taken from the data if None"""
+
+    words = np.frombuffer(link, dtype='<u4')
+
+    eot = np.flatnonzero(words == eotmarker)
+    nwords = eot[0] if len(eot) else len(words)
+
+    if tracklet_format == "run3":
+        return _extract_run3(words[:nwords], event, hcid)
+    elif tracklet_format == "run2":
+        if hcid is None:
+            hcid = _find_run2_hcid(words, nwords)
+        return _extract_run2(words[:nwords], event, hcid)
+    else:
+        raise ValueError(f"Invalid tracklet format '{tracklet_format}'")
+
+
+def _extract_run2(words, event, hcid):
+
+    # pppp : pppp : zzzz : dddd : dddy : yyyy : yyyy : yyyy
+    trkl = np.zeros(len(words), dtype=tracklet_dtype)
+    trkl['event'] = event
+    trkl['hcid'] = hcid
+    trkl['row'] = (words >> 20) & 0xF
+    trkl['col'] = -1
+    trkl['y'] = signed((words & 0x1FFF).astype(np.int16), 13)
+    trkl['dy'] = signed(((words >> 13) & 0x7F).astype(np.int8), 7)
+    trkl['pid'] = words >> 24
+    return trkl
+
+
+def _find_run2_hcid(words, nwords):
+    """Find the half-chamber ID in the HC0 header after the tracklets"""
+
+    i = nwords
+    while i < len(words) and words[i] == eotmarker:
+        i += 1
+
+    # xmmm : mmmm : nnnn : nnnq : qqss : sssp : ppcc : ci01
+    if i >= len(words) or (words[i] & 0x3) != 0x1:
+        raise ValueError("No HC0 header found after run 2 tracklets")
+
+    hc0 = int(words[i])
+    sector, layer = (hc0 >> 9) & 0x1F, (hc0 >> 6) & 0x7
+    stack, side = (hc0 >> 3) & 0x7, (hc0 >> 2) & 0x1
+    return 60*sector + 12*stack + 2*layer + side
+
+
+def _extract_run3(words, event, hcid):
+
+    if len(words) == 0:
+        return np.zeros(0, dtype=tracklet_dtype)
+
+    # HC header: ffff : tttt : tttt : tttt : ttt1 : SSSS : SPPP : CCCI
+    if hcid is None:
+        hdr = int(words[0]) ^ 0xFFF
+        if not hdr & 0x1000:
+            raise ValueError(f"Invalid tracklet HC header 0x{words[0]:08X}")
+        hcid = (60*((hdr >> 7) & 0x1F) + 12*((hdr >> 1) & 0x7)
+                + 2*((hdr >> 4) & 0x7) + (hdr & 0x1))
+
+    words = words[1:]
+    pos = np.arange(len(words))
+
+    # MCM headers have bit 0 set, tracklet words have bit 0 cleared
+    ismcm = (words & 0x1).astype(bool)
+
+    # index of the MCM header that precedes each word
+    mcmidx = np.maximum.accumulate(np.where(ismcm, pos, -1))
+    sel = ~ismcm & (mcmidx >= 0)
+    trkidx = pos[sel]
+    hdr = words[mcmidx[sel]]
+
+    # MCM header: 1zzz : zyyc : cccc : cccb: bbbb : bbba : aaaa : aaa1
+    # The n-th tracklet after the header belongs to the n-th CPU with a
+    # valid PID (i.e. not 0xFF) in the order a, b, c.
+    hpid = np.stack([(hdr >> 1) & 0xFF, (hdr >> 9) & 0xFF, (hdr >> 17) & 0xFF], axis=1)
+    nth = trkidx - mcmidx[sel]
+    match = np.cumsum(hpid != 0xFF, axis=1) == nth[:, None]
+    valid = match.any(axis=1)
+    cpu = np.argmax(match, axis=1)
+
+    # Tracklet word: yyyy : yyyY : yyyp : pppp : pppp : pppd : dddD : ddd0
+    tw = words[trkidx] ^ 0x01000010
+
+    trkl = np.zeros(len(trkidx), dtype=tracklet_dtype)
+    trkl['event'] = event
+    trkl['hcid'] = hcid
+    trkl['row'] = (hdr >> 27) & 0xF
+    trkl['col'] = (hdr >> 25) & 0x3
+    trkl['y'] = signed(((tw >> 21) & 0x7FF).astype(np.int16), 11)
+    trkl['dy'] = signed(((tw >> 1) & 0xFF).astype(np.int16), 8)
+    trkl['pid'] = hpid[np.arange(len(cpu)), cpu] << 12 | ((tw >> 9) & 0xFFF)
+    return trkl[valid]
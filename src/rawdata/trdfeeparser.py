@@ -1,36 +1,23 @@
 import numpy as np
 from struct import unpack
+from time import perf_counter
 
 from functools import wraps
 from collections import namedtuple
 import logging
-from termcolor import colored
 
-from rawdata.tfreader import RawDataHeader
+from rawdata.tfreader import RawDataHeader, RdhStreamParser
 
-from .rawlogging import TermColorFilter
+from . import dumpwriter
 from .constants import eodmarker,eotmarker
 from .base import BaseHeader, BaseParser, DumpParser
 from .bitstruct import BitStruct
+from .geometry import get_detector
+from .tracklets import signed
 
 # logger = logging.getLogger(__name__)
 logger = logging.getLogger("rawlog.hexdump")
 
-logger.getChild("trkl.TKH").addFilter(TermColorFilter("bold_green"))
-logger.getChild("trkl.TKD").addFilter(TermColorFilter("green"))
-logger.getChild("trkl.TKL").addFilter(TermColorFilter("green"))
-logger.getChild("trkl.EOT").addFilter(TermColorFilter("green"))
-
-logger.getChild("hc.HC0").addFilter(TermColorFilter("white_on_blue"))
-logger.getChild("hc.HC1").addFilter(TermColorFilter("white_on_blue"))
-logger.getChild("hc.HC2").addFilter(TermColorFilter("white_on_blue"))
-logger.getChild("hc.HC3").addFilter(TermColorFilter("white_on_blue"))
-
-logger.getChild("mcm.MCM").addFilter(TermColorFilter("bold_blue"))
-logger.getChild("mcm.MSK").addFilter(TermColorFilter("blue"))
-logger.getChild("mcm.ADC").addFilter(TermColorFilter("grey"))
-logger.getChild("mcm.EOD").addFilter(TermColorFilter("bold_blue"))
-
 
 class decode:
 	"""Decorator decoder class for 32-bit data words from TRAPconfig
@@ -93,11 +80,33 @@ class decode:
 			assert( (dword & self.validate_mask) == self.validate_value)
 			return func(*args,self.decode(dword ^ self.invert_mask))
 
+		# give access to the pattern, e.g. to encode dwords
+		wrapper.decoder = self
 		return wrapper
 
 	def decode(self,dword):
 		return self.dtype(*[ (dword & x[1]) >> x[2] for x in self.fields ])
 
+	def encode(self, **fields):
+		"""Build a dword from the field values - the inverse of decode()
+
+		Fields that are not given are set to zero. The bits marked as '0' or
+		'1' are set accordingly, and uppercase bits are inverted. The values
+		can also be NumPy integer arrays, to encode many dwords at once."""
+
+		dword = 0
+		for name, mask, shift in self.fields:
+			value = fields.pop(name, 0)
+			overflow = (value << shift) & ~mask
+			if overflow.any() if isinstance(overflow, np.ndarray) else overflow:
+				raise ValueError(f"Value {value} does not fit into field '{name}'")
+			dword |= value << shift
+
+		if fields:
+			raise TypeError(f"Unknown fields: {', '.join(fields)}")
+
+		return (dword ^ self.invert_mask) | self.validate_value
+
 class describe:
 	"""Decorator to generate messages about dwords
 
@@ -105,7 +114,7 @@ class describe:
 	log statement in the decorated functions."""
 
 	def __init__(self, stream, fmt):
-		self.logger = logger.getChild(stream)
+		self.kind = stream.split(".")[-1]
 		self.format = fmt
 		self.marker = ('#', '#', '|', ':')
 
@@ -128,10 +137,9 @@ class describe:
 			if 'description' not in retval:
 				# if (dword & 0x3) == 2:
 				# mrk = ('#', '#', '|', ':')[dword&0x3]
-				self.logger.info(self.format.format(
+				ctx.dump(self.kind, ctx.current_linkpos, dword, self.format,
 					dword=dword, mark=self.marker[dword & 0x3],
-					**fielddata, ctx=ctx),
-					extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+					**fielddata, ctx=ctx)
 				# retval['description'] = msg
 
 			return retval
@@ -145,8 +153,12 @@ ParsingContext = namedtuple('ParsingContext', [
   'ntb', 'bc_counter', 'pre_counter', 'pre_phase', # from HC1
   'SIDE', 'HC', 'VER', 'det', ## derived from HCx
   'rob', 'mcm', ## from MCM header
-  'store_digits', ## links to helper functions/functors
+  'store_digits', 'store_tracklets', ## links to helper functions/functors
+  'tracklets', ## run 2 tracklets waiting for the HC0 header
+  'skip_adc', ## stop decoding after the HC headers (tracklet mode)
+  'decode_adc', ## decode ADC data words, or only count them
   'event', ## event number
+  'dump', ## writer for the hexdump
 ])
 
 # ------------------------------------------------------------------------
@@ -171,19 +183,17 @@ def find_eod_mcmhdr(ctx, dword):
 
 def parse_eot(ctx, dword):
 	assert(dword == eotmarker)
-	logger.getChild("trkl.EOT").info("end of tracklets", extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+	ctx.dump("EOT", ctx.current_linkpos, dword, "end of tracklets")
 	return dict(readlist=[[parse_eot, parse_cru_padding, parse_hc0]])
 
 def parse_eod(ctx, dword):
 	assert(dword == eodmarker)
-	logger.getChild("mcm.EOD").info("end of data",
-                                  extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+	ctx.dump("EOD", ctx.current_linkpos, dword, "end of data")
 	return dict(readlist=[[parse_eod, parse_cru_padding]])
 
 def parse_cru_padding(ctx, dword):
 	assert(dword == 0xEEEEEEEE)
-	logger.getChild("cru.PAD").info("padding",
-                                 extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+	ctx.dump("PAD", ctx.current_linkpos, dword, "padding")
 	return dict(readlist=[[parse_cru_padding]])
 
 # ------------------------------------------------------------------------
@@ -194,7 +204,8 @@ def parse_cru_padding(ctx, dword):
 def parse_tracklet_hc_header(ctx, dword, fields):
 	hc = f"{fields.s:02}_{fields.c}_{fields.p}{'A' if fields.i==0 else 'B'}"
 	hcid = 60*fields.s + 12*fields.c + 2*fields.p + fields.i
-	logger.getChild("trap.TRK").info("HC header {hc} (hcid {hcid})")
+	ctx.dump("TRK", ctx.current_linkpos, dword, "HC header {hc} (hcid {hcid})",
+	         hc=hc, hcid=hcid)
 	return dict(readlist=[[parse_tracklet_mcm_header(hcid), parse_eot]])
 
 
@@ -209,9 +220,9 @@ class parse_tracklet_mcm_header:
 		pid = tuple((fields.a, fields.b, fields.c))
 		mcm = f"{fields.z//4 + self.hcid%2}:{4*(fields.z%4) + fields.y:02d}"
 
-		logger.getChild("trkl.TKD").info(
-		    f"    MCM {mcm} row={fields.z} col={fields.y} pid = {pid[0]} / {pid[1]} / {pid[2]}",
-			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		ctx.dump("TKD", ctx.current_linkpos, dword,
+			"    MCM {mcm} row={z} col={y} pid = {pid[0]} / {pid[1]} / {pid[2]}",
+			mcm=mcm, z=fields.z, y=fields.y, pid=pid)
 
 		rl = list()
 		for p in pid:
@@ -234,14 +245,21 @@ class parse_tracklet_word:
 	@decode("yyyy : yyyY : yyyp : pppp : pppp : pppd : dddD : ddd0")
 	def __call__(self, ctx, dword, fields):
 		self.pid |= fields.p
-		logger.getChild("trkl.TKD").info(
-			f"        y={fields.y} dy={fields.d} pid={self.pid}",
-			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		ctx.dump("TKD", ctx.current_linkpos, dword,
+			"        y={y} dy={d} pid={pid}", y=fields.y, d=fields.d, pid=self.pid)
+
+		if ctx.store_tracklets is not None:
+			ctx.store_tracklets(ctx.event, self.hcid, self.row, self.col,
+			                    signed(fields.y, 11), signed(fields.d, 8), self.pid)
 
 @decode("pppp : pppp : zzzz : dddd : dddy : yyyy : yyyy : yyyy")
 @describe("trkl.TKL", "row={z} pos={y} slope={d} pid={p}")
 def parse_legacy_tracklet(ctx, dword, fields):
 	assert(dword != eotmarker)
+
+	# The HC ID is only known after the HC0 header -> store for now
+	ctx.tracklets.append(
+		(fields.z, signed(fields.y, 13), signed(fields.d, 7), fields.p))
 	return dict(readlist=[[parse_legacy_tracklet, parse_eot]])
 
 
@@ -260,7 +278,7 @@ def parse_hc0(ctx, dword, fields):
 	ctx.stack = fields.c  # (dword >>  3) & 0x3
 	ctx.side  = fields.i  # (dword >>  2) & 0x1
 
-	ctx.det = 18*ctx.sm + 6*ctx.stack + ctx.layer
+	ctx.det = get_detector(ctx.sm, ctx.stack, ctx.layer)
 
 	# An alternative to update the context - which one is easier to read?
 	# (ctx.major,ctx.minor,ctx.nhw,ctx.sm,ctx.layer,ctx.stack,ctx.side) = fields
@@ -277,6 +295,13 @@ def parse_hc0(ctx, dword, fields):
 	side = 'A' if fields.i==0 else 'B'
 	ctx.HC   = f"{fields.s:02}_{fields.c}_{fields.p}{side}"
 
+	# pass on run 2 tracklets, now that we know the HC ID
+	if ctx.store_tracklets is not None:
+		hcid = 2*ctx.det + ctx.side
+		for row, y, dy, pid in ctx.tracklets:
+			ctx.store_tracklets(ctx.event, hcid, row, -1, y, dy, pid)
+	ctx.tracklets = list()
+
 	readlist = list()
 	for i in range(ctx.nhw):
 		# check additional HC header in with HC1 last, because HC2 and HC3
@@ -284,7 +309,11 @@ def parse_hc0(ctx, dword, fields):
 		# this ambiguity.
 		readlist.append([parse_hc3, parse_hc2, parse_hc1])
 
-	readlist.append([parse_mcmhdr])
+	# Without MCM headers, the readlist ends after the HC headers, and the
+	# parser skips the rest of the link.
+	if not ctx.skip_adc:
+		readlist.append([parse_mcmhdr])
+
 	return dict(readlist=readlist)
 
 @decode("tttt : ttbb : bbbb : bbbb : bbbb : bbpp : pphh : hh01")
@@ -319,6 +348,9 @@ def parse_mcmhdr(ctx, dword, fields):
 	if ctx.major & 0x20:   # Zero suppression
 		return dict(readlist=[[parse_adcmask]])
 
+	elif not ctx.decode_adc:
+		return skip_adcdata(ctx, 21)
+
 	else:  # No ZS -> read 21 channels, then expect next MCM header or EOD
 		adcdata = np.zeros(ctx.ntb, dtype=np.uint16)
 		readlist = list()
@@ -331,33 +363,46 @@ def parse_mcmhdr(ctx, dword, fields):
 
 @decode("nncc : cccm : mmmm : mmmm : mmmm : mmmm : mmmm : 1100")
 def parse_adcmask(ctx, dword, fields):
-	desc = ""
-	count = 0
-	readlist = list()
+	count = bin(fields.m).count("1")
+	assert( count == (~fields.c & 0x1F) )
 
-	adcdata = np.zeros(ctx.ntb, dtype=np.uint16)
+	# only prepare the description if it will be dumped
+	if ctx.dump.enabled("MSK"):
+		desc = ""
+		for ch in range(21):
+			if ch in [9,19]:
+				desc += " "
+			desc += str(ch%10) if fields.m & (1<<ch) else "."
 
-	for ch in range(21):
-		if ch in [9,19]:
-			desc += " "
+		desc += f"  ({count} channels)"
+		ctx.dump("MSK", ctx.current_linkpos, dword, desc,
+			mask=fields.m, count=count, ctx=ctx)
+	else:
+		ctx.dump.count("MSK")
+
+	if not ctx.decode_adc:
+		return skip_adcdata(ctx, count)
 
+	adcdata = np.zeros(ctx.ntb, dtype=np.uint16)
+	readlist = list()
+	for ch in range(21):
 		if fields.m & (1<<ch):
-			count += 1
-			desc += str(ch%10)
 			for tb in range ( 0, ctx.ntb , 3 ):
 				readlist.append([parse_adcdata(channel=ch, timebin=tb, adcdata=adcdata)])
-		else:
-			desc += "."
-
 
-	desc += f"  ({~fields.c & 0x1F} channels)"
 	readlist.append([parse_mcmhdr, parse_eod])
-	assert( count == (~fields.c & 0x1F) )
-
-	logger.getChild("mcm.MSK").info(desc, 
-		extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
 	return dict(readlist=readlist)
 
+def skip_adcdata(ctx, nchannels):
+	"""Skip the ADC data of an MCM without decoding it
+
+	This is used if the ADC data is neither stored nor dumped. The dwords
+	are only counted, and the parser seeks to the next MCM header."""
+
+	nwords = nchannels * ((ctx.ntb+2)//3)
+	ctx.dump.count("ADC", nwords)
+	return dict(readlist=[[parse_mcmhdr, parse_eod]], skip=4*nwords)
+
 
 # ------------------------------------------------------------------------
 # Raw data
@@ -376,6 +421,10 @@ class parse_adcdata:
 		self.adcdata = adcdata
 		self.__name__ = "parse_adcdata"
 
+		# the label only depends on channel and timebin -> prepare it once
+		self.label = f"ch {channel:2} " if timebin==0 else " "*6
+		self.label += f"tb {timebin:2}"
+
 	# @decode("xxxx:xxxx:xxyy:yyyy:yyyy:zzzz:zzzz:zzff")
 	def __call__(self, ctx, dword):
 		x = (dword & 0xFFC00000) >> 22
@@ -383,12 +432,9 @@ class parse_adcdata:
 		z = (dword & 0x00000FFC) >>  2
 		f = (dword & 0x00000003) >>  0
 
-		msg = f"{('#', '#', '|', ':')[dword&3]} "
-		msg += f"ch {self.channel:2} " if self.timebin==0 else " "*6
-		msg += f"tb {self.timebin:2} (f={f})   {x:4}  {y:4}  {z:4}"
-
-		logger.getChild("mcm.ADC").info(msg,
-                                 extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		ctx.dump("ADC", ctx.current_linkpos, dword,
+			"{mark} {label} (f={f})   {x:4}  {y:4}  {z:4}",
+			mark=('#', '#', '|', ':')[f], label=self.label, f=f, x=x, y=y, z=z)
 
 		# assert( f == 2 if self.channel%2 else 3)
 
@@ -406,15 +452,61 @@ class parse_adcdata:
 		return dict()
 
 
+# Dword types of the handlers, for the parser statistics. Callable objects
+# are looked up by their class.
+handler_kinds = {
+	skip_until_eod: "SKP", find_eod_mcmhdr: "SKP",
+	parse_eot: "EOT", parse_eod: "EOD", parse_cru_padding: "PAD",
+	parse_tracklet_hc_header: "TRK", parse_tracklet_mcm_header: "TRK",
+	parse_tracklet_word: "TRK", parse_legacy_tracklet: "TRK",
+	parse_hc0: "HC0", parse_hc1: "HC1", parse_hc2: "HC2", parse_hc3: "HC3",
+	parse_mcmhdr: "MCM", parse_adcmask: "MSK", parse_adcdata: "ADC",
+}
+
+def handler_kind(fct):
+	return handler_kinds.get(fct) or handler_kinds.get(type(fct), "???")
+
 # ------------------------------------------------------------------------
 class TrdFeeParser:
+	"""Parser for the data of one link from the TRD front-end electronics
+
+	In the default mode "digits", all data words are decoded. In mode
+	"tracklets", decoding of a link stops after the tracklets and the HC
+	headers, and the parser skips over the ADC data of the link without
+	reading it. The same happens in mode "digits" if there is no digits
+	sink and the dump writer suppresses all MCM data.
+
+	If a ParserStats object is passed as `stats`, the number of dwords and
+	the parsing time are recorded per dword type and link.
+
+	Parse errors are counted in the dict `errors`, with the error type and
+	the expected dword type as key, e.g. ("NO-MATCH", "MCM"). A dict can be
+	passed with `errors`, e.g. the values of a metrics counter."""
 
 	#Defining the initial variables for class
-	def __init__(self, store_digits = None, tracklet_format = "run3"):
+	def __init__(self, store_digits = None, store_tracklets = None,
+	             tracklet_format = "run3", mode = "digits", stats = None,
+	             errors = None):
 		self.ctx = ParsingContext
 		self.ctx.event = 0
 		self.ctx.store_digits = store_digits
+		self.ctx.store_tracklets = store_tracklets
+		self.ctx.tracklets = list()
+		self.ctx.dump = dumpwriter.get_writer()
 		self.readlist = None
+		self.skip = 0
+		self.stats = stats
+		self.errors = dict() if errors is None else errors
+
+		if mode not in ("digits", "tracklets"):
+			raise ValueError(f"Invalid parser mode '{mode}'")
+
+		# Skip the MCM data if nobody needs it, and do not decode ADC data
+		# that is neither stored nor dumped. The dump writer has to be
+		# configured before the parser is created.
+		dump_mcm = any(self.ctx.dump.enabled(k) for k in ("MCM", "MSK", "ADC", "EOD"))
+		self.ctx.skip_adc = (mode == "tracklets") or (store_digits is None and not dump_mcm)
+		self.ctx.decode_adc = store_digits is not None or self.ctx.dump.enabled("ADC")
 
 		if tracklet_format == "run3":
 			self.readlist_start = [ list([parse_tracklet_hc_header, parse_eot]) ]
@@ -426,58 +518,126 @@ class TrdFeeParser:
 			raise ValueError(f"Invalid tracklet format '{tracklet_format}'")
 
 	def next_event(self):
+		# give sinks that work on whole events a chance to process the event
+		for sink in (self.ctx.store_digits, self.ctx.store_tracklets, self.ctx.dump):
+			if hasattr(sink, "end_event"):
+				sink.end_event(self.ctx.event)
+
+		if self.stats is not None:
+			self.end_link_stats()
+			self.stats.end_event()
+
 		self.ctx.event += 1
 
-	def parse(self, stream, size):
+	@property
+	def event(self):
+		"""Number of the current event, i.e. the number of events so far"""
+		return self.ctx.event
 
-		self.ctx.current_linkpos = -1
+	def end_link_stats(self):
+		"""Add the statistics of the current link to the totals"""
+		if "HC0" in self.stats.current:
+			self.stats.end_link(2*self.ctx.det + self.ctx.side)
+		else:
+			self.stats.end_link()
+
+	def reset(self):
+		"""Prepare the parser for the start of a new link"""
+		if self.stats is not None:
+			self.end_link_stats()
 
-		# if self.readlist is None:
-		# 	self.reset()
+		self.ctx.current_linkpos = -1
+		self.ctx.tracklets = list()
+		self.skip = 0
 
 		# Initialize the readlist
 		self.readlist = self.readlist_start.copy()
 
-		maxpos = stream.tell() + size
-		while stream.tell() < maxpos:
+	def parse(self, stream, size):
+		"""Parse the complete data of one link"""
+		self.reset()
+		self.read(stream, size)
 
-			self.ctx.current_linkpos = stream.tell()
-			dword = unpack("<L", stream.read(4))[0]
-			self.ctx.current_dword = dword
+	def read(self, stream, size):
+		"""Parse (part of) the data of a link, continuing where we stopped
 
-			try:
-				expected = self.readlist.pop(0)
-				for fct in expected:
+		This is needed for link data that is split over several RDH pages."""
 
-					# The function can raise an AssertionError to signal that
-					# it does not understand the dword
-					try:
-						 result = fct(self.ctx,dword)
+		if self.readlist is None:
+			self.reset()
 
-					except AssertionError as ex:
-						continue
+		# The position is tracked here, because tell() is slow on buffered
+		# files, where it asks the raw file every time.
+		stats = self.stats
+		pos = stream.tell()
+		maxpos = pos + size
+		while pos < maxpos:
 
-					if not isinstance(result, dict):
-						break
+			# Nothing else to decode in this link -> skip to the end
+			if len(self.readlist) == 0:
+				if stats is not None:
+					stats.add("SKP", 0.0, (maxpos - pos) // 4)
+				stream.seek(maxpos)
+				break
 
-					if 'readlist' in result:
-						self.readlist.extend(result['readlist'])
+			# Skip dwords that do not need to be decoded
+			if self.skip > 0:
+				n = min(self.skip, maxpos - pos)
+				stream.seek(n, 1)
+				pos += n
+				self.skip -= n
+				if stats is not None:
+					stats.add("ADC", 0.0, n // 4)
+				continue
 
-					break
+			if stats is not None:
+				t0 = perf_counter()
 
-				else:
-					logger.error(f"NO MATCH - expected {[x.__name__ for x in expected]} found {dword:08x}")
-					# check_dword(dword)
+			self.ctx.current_linkpos = pos
+			dword = unpack("<L", stream.read(4))[0]
+			pos += 4
+			self.ctx.current_dword = dword
 
-					# skip everything until EOD
-					self.readlist.extend([[find_eod_mcmhdr]])
+			expected = self.readlist.pop(0)
+			for fct in expected:
+
+				# The function can raise an AssertionError to signal that
+				# it does not understand the dword
+				try:
+					 result = fct(self.ctx,dword)
+
+				except AssertionError as ex:
 					continue
 
+				if not isinstance(result, dict):
+					break
+
+				if 'readlist' in result:
+					self.readlist.extend(result['readlist'])
+
+				if 'skip' in result:
+					self.skip += result['skip']
 
-			except IndexError:
-				logger.error(logflt.where + "extra data after end of readlist")
 				break
 
+			else:
+				logger.error(f"NO MATCH - expected {[x.__name__ for x in expected]} found {dword:08x}")
+				self.count_error("NO-MATCH", handler_kind(expected[0]))
+				# check_dword(dword)
+
+				# skip everything until EOD
+				self.readlist.extend([[find_eod_mcmhdr]])
+				if stats is not None:
+					stats.add("NO-MATCH", perf_counter() - t0)
+				continue
+
+			if stats is not None:
+				stats.add(handler_kind(fct), perf_counter() - t0)
+
+	def count_error(self, kind, expected=""):
+		key = (kind, expected)
+		self.errors[key] = self.errors.get(key, 0) + 1
+
 	def dump_readlist(self):
 		for j,l in enumerate(self.readlist):
 			print( [ f.__name__ for f in self.readlist[j] ] )
@@ -493,14 +653,23 @@ class TrdFeeParser:
    	s08=16, s09=16, s10=16, s11=16, 
 	s12=16, s13=16, s14=16, res3=16)
 class TrdHalfCruHeader(BaseHeader):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
+	__slots__ = ()
+	_hexdump_kind = "HCRU"
+
+	@property
+	def errflags(self):
+		"""Error flags for each link"""
+		return tuple(getattr(self,f"e{i:02}") for i in range(15))
+
+	@property
+	def datasize(self):
+		"""Data size in bytes for each link"""
+		return tuple(32*getattr(self,f"s{i:02}") for i in range(15))
 
-		# build tuples with error flags and data size for each link
-		self.errflags = tuple(getattr(self,f"e{i:02}") for i in range(15))
-		self.datasize = tuple(32*getattr(self,f"s{i:02}") for i in range(15))
+	@property
+	def offset(self):
+		"""Expected offset of the data of each link in the file"""
 
-		# calculate the expected offset for each link
 		base = self._addr - RawDataHeader.header_size # RDH base address
 		pagesize = 0x2000 - RawDataHeader.header_size # payload per RDH page
 
@@ -519,28 +688,24 @@ class TrdHalfCruHeader(BaseHeader):
 			# HexDump.add_marker(expect, "HCRU: Link{02i}")
 			rawoffset += sz
 
-		self.offset = tuple(offsets)
-		# for i, off in enumerate(self.offset):
-		# 	logger.info(f"Link {i} expected to start at 0x{off:06x}")
+		return tuple(offsets)
 
-		# for i, desc in enumerate(self._hexdump_desc):
-		# 	self._hexdump_desc[i] = f"HCRU[{i//4}.{i%4}]  {desc}"
-		# logger.info(self._hexdump_desc)
-
-		self._hexdump_desc[0] = "HCRU version={version} cru=0x{cru:03X} evtype=0x{evtype:X}"
+	def hexdump_desc(self):
+		desc = list(self._hexdump_desc)
+		desc[0] = "HCRU version={version} cru=0x{cru:03X} evtype=0x{evtype:X}"
 
 		for i in range(15):
-			self._hexdump_desc[i+1] = f"Link {i:02d}: {self.fmtlink(i)}"
-		# # self._hexdump_desc[15] = f"HCRU[3.3]  14: {self.fmtlink(14)}"
-		# self._hexdump_desc = HexDump.colorize(self._hexdump_desc)
+			desc[i+1] = f"Link {i:02d}: {self.fmtlink(i)}"
+		return desc
 
 	def fmtlink(self, linkno):
-		if self.errflags[linkno] == 0:
+		err = getattr(self, f"e{linkno:02}")
+		if err == 0:
 			return f"0x{self.datasize[linkno]:X} bytes @ 0x{self.offset[linkno]:012X}"
-		elif self.errflags[linkno] <= 2:
-			return f"LME type {self.errflags[linkno]}"
+		elif err <= 2:
+			return f"LME type {err}"
 		else:
-			return f"Error 0x{self.errflags[linkno]:02x} = {self.errflags[linkno]:3d}"
+			return f"Error 0x{err:02x} = {err:3d}"
 
 class TrdCruParser(BaseParser):
 	def __init__(self, trdfeeparser=None):
@@ -558,6 +723,13 @@ class TrdCruParser(BaseParser):
 		self.link = None
 		self.unread = None # bytes remaining to be parse in current link
 
+	def next_event(self):
+		"""Count an event without data, e.g. one that was skipped"""
+		self.feeparser.next_event()
+
+	@property
+	def event(self):
+		return self.feeparser.event
 
 	def read(self, stream, size):
 
@@ -568,10 +740,12 @@ class TrdCruParser(BaseParser):
 		maxpos = startpos + size
 		while stream.tell() < maxpos:
 
+			# 32 bytes after the data of a half-CRU can only be padding, while
+			# within the data of a link they can be link data
 			avail_bytes = maxpos - stream.tell()
-			if avail_bytes == 32:
+			if self.hcruheader is None and avail_bytes == 32:
 				padding = stream.read(32)
-				if padding != '\xee'*32:
+				if padding != b'\xee'*32:
 					pass
 					# raise ValueError(f"invalid padding word: {padding} {len(padding)}")
 				continue
@@ -583,7 +757,7 @@ class TrdCruParser(BaseParser):
 					raise ValueError("Insufficient data for Half-CRU header")
 
 				self.hcruheader = TrdHalfCruHeader.read(stream)
-				self.hexdump(self.hcruheader)
+				self.hcruheader.hexdump()
 				self.link = None
 				self.unread = None
 
@@ -591,26 +765,35 @@ class TrdCruParser(BaseParser):
 				self.link = 0
 				self.unread = None
 
-			if self.unread is None:
-				self.unread = self.hcruheader.datasize[self.link]
+			# Links without data are finished right away, so that the event ends
+			# with the last link, even at the end of the data.
+			while self.link is not None:
+				if self.unread is None:
+					self.unread = self.hcruheader.datasize[self.link]
+
+				if self.unread > 0:
+					avail = maxpos - stream.tell()
+					if avail == 0:
+						break # resume with the next page
+					readsize = self.unread if self.unread < avail else avail
+					self.feeparser.read(stream,readsize)
+					self.unread -= readsize
 
-			if self.unread > 0:
-				avail = maxpos - stream.tell()
-				readsize = self.unread if self.unread < avail else avail
-				self.feeparser.read(stream,readsize)
-				self.unread -= readsize
+				if self.unread > 0:
+					break # resume with the next page
 
-			if self.unread == 0:
 				logger.info(f"DONE processing link {self.link}")
 				self.feeparser.reset() # start new link
 				if self.link < 14:
 					self.link += 1
 					self.unread = None
 				else:
+					# the data of a half-CRU belongs to one trigger
 					self.hcruheader = None
 					self.link = None
 					self.unread = None
-				
+					self.feeparser.next_event()
+
 			# if self.hcruheader is None:
 			# 	logger.info(f"{maxpos - stream.tell()} padding bytes")
 				# hdump.fromfile(stream, maxpos - stream.tell())
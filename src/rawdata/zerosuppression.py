@@ -0,0 +1,138 @@
+
+import logging
+import numpy as np
+
+from . import geometry
+from .digits import DigitsBatcher
+from .pedestal import PedestalCalculator, nchannels
+
+logger = logging.getLogger(__name__)
+
+
+def load_pedestals(filename, default=10.0):
+    """Load pedestals from a raw2pedestal output file
+
+    Returns an array [det, channel_index] with the pedestal mean of every
+    channel, where channel_index = (rob*16 + mcm)*21 + channel. Channels
+    without data in the file are set to `default`."""
+
+    ped = np.full((geometry.ndet, nchannels), default, dtype=np.float32)
+
+    res = PedestalCalculator.load(filename).results()
+    chan = ((res['rob'].astype(int)*geometry.nmcm + res['mcm'])
+            * geometry.nadc + res['channel'])
+    ped[res['det'], chan] = res['mean']
+    return ped
+
+
+class ZeroSuppression(DigitsBatcher):
+    """Processing stage for pedestal subtraction and zero suppression
+
+    This stage is used as the store_digits sink of the parser, and passes
+    the processed digits on to another batch sink. The pedestal of every
+    channel is subtracted, and a constant baseline is added to keep the ADC
+    values positive. Channels are kept if they pass the TRAP-like zero
+    suppression criteria:
+      - the ADC value in one time bin exceeds `threshold` (EBIS), or
+      - the sum of three consecutive time bins exceeds `sum_threshold` (EBIT),
+      - or, if `neighbours` is set, the channel is next to a channel that
+        passes one of these criteria (EBIN).
+    Empty channels are dropped before they reach the sink. Time bins that
+    were not read out (beyond the `ntb` of a digit) are not tested and stay
+    zero.
+
+    Arguments:
+      sink          : batch sink for the processed digits
+      pedestals     : raw2pedestal file name, or array from load_pedestals()
+      baseline      : constant added to the ADC values after subtraction"""
+
+    def __init__(self, sink, pedestals=None, threshold=10, sum_threshold=20,
+                 neighbours=True, baseline=10, batchsize=4096):
+        super().__init__(ntimebins=sink.ntimebins, batchsize=batchsize)
+
+        self.sink = sink
+        if pedestals is None:
+            pedestals = np.full((geometry.ndet, nchannels), baseline, dtype=np.float32)
+        elif isinstance(pedestals, str):
+            pedestals = load_pedestals(pedestals)
+        self.pedestals = pedestals
+
+        self.threshold = threshold
+        self.sum_threshold = sum_threshold
+        self.neighbours = neighbours
+        self.baseline = baseline
+
+        # digits of the last MCM in a batch, whose neighbours might be in
+        # the next batch
+        self._carry = None
+        self.nin = 0
+        self.nout = 0
+
+    def process_batch(self, batch):
+        if self._carry is not None:
+            batch = np.concatenate([self._carry, batch])
+        else:
+            batch = batch.copy()
+
+        key = self._mcmkey(batch)
+        last = np.flatnonzero(key != key[-1])
+        last = last[-1]+1 if len(last) else 0
+
+        self._carry = batch[last:]
+        self._suppress(batch[:last])
+
+    @staticmethod
+    def _mcmkey(batch):
+        return (batch['event'].astype(np.uint64) << 32
+                | batch['det'].astype(np.uint64) << 16
+                | batch['rob'].astype(np.uint64) << 8 | batch['mcm'])
+
+    def _suppress(self, batch):
+        if len(batch) == 0:
+            return
+
+        chan = ((batch['rob'].astype(int)*geometry.nmcm + batch['mcm'])
+                * geometry.nadc + batch['channel'])
+        signal = batch['adc'] - self.pedestals[batch['det'], chan][:, None]
+
+        # time bins that were not read out stay zero, and are not tested
+        valid = np.arange(signal.shape[1]) < batch['ntb'][:, None]
+        signal[~valid] = 0
+
+        hit = np.any(valid & (signal > self.threshold), axis=1)
+        if signal.shape[1] >= 3:
+            sum3 = signal[:, :-2] + signal[:, 1:-1] + signal[:, 2:]
+            hit |= np.any(valid[:, 2:] & (sum3 > self.sum_threshold), axis=1)
+
+        keep = hit.copy()
+        if self.neighbours and len(batch) > 1:
+            # neighbour: same MCM and adjacent channel number
+            key = self._mcmkey(batch)
+            adj = (key[1:] == key[:-1]) & (np.diff(batch['channel'].astype(int)) == 1)
+            keep[1:] |= hit[:-1] & adj
+            keep[:-1] |= hit[1:] & adj
+
+        out = batch[keep]
+        out['adc'] = np.where(valid[keep],
+                              np.clip(np.rint(signal[keep]) + self.baseline, 0, 1023), 0)
+
+        self.nin += len(batch)
+        self.nout += len(out)
+        if len(out):
+            self.sink.process_batch(out)
+
+    def _finish(self):
+        self.flush()
+        if self._carry is not None:
+            self._suppress(self._carry)
+            self._carry = None
+
+    def end_event(self, event):
+        self._finish()
+        if hasattr(self.sink, "end_event"):
+            self.sink.end_event(event)
+
+    def close(self):
+        self._finish()
+        logger.info(f"zero suppression kept {self.nout} of {self.nin} channels")
+        self.sink.close()
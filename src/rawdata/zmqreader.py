@@ -1,17 +1,11 @@
 #!/usr/bin/env python3
 #
 
-import sys
 import zmq
 import numpy as np
-import argparse
-from struct import unpack
-import time
-import click
 import logging
-from typing import NamedTuple
-from datetime import datetime
 
+from .event import Event, EventReader, SubEvent
 from .header import TrdboxHeader
 # from .trdfeeparser import TrdFeeParser, logflt
 # from .rawlogging import ColorFormatter
@@ -27,21 +21,11 @@ logger = logging.getLogger(__name__)
 # ch.setFormatter(CustomFormatter())
 # logger.addHandler(ch)
 
-class event_t(NamedTuple):
-    timestamp: datetime
-    subevents: tuple
-
-class subevent_t(NamedTuple):
-    # timestamp: datetime
-    equipment_type: int
-    equipment_id: int
-    payload: np.ndarray
-
-
-class zmqreader:
+class zmqreader(EventReader):
     """Reader class for events distributed over ZeroMQ.
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over the events that are received.
+    Every message is an event with one sub-event."""
 
 
     def __init__(self, source, equipments=None):
@@ -63,22 +47,18 @@ class zmqreader:
                 filter = magicbytes + (eq).to_bytes(1,'little');
                 self.socket.setsockopt(zmq.SUBSCRIBE, filter)
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-
+    def read_event(self, number):
         rawdata = self.socket.recv()
-
         header = TrdboxHeader(rawdata)
-        if header.equipment_type == 0x10:
-            payload = np.frombuffer(rawdata[header.header_size:], dtype=np.uint32)
-
-            subevent = subevent_t(header.equipment_type, header.equipment_id, payload)
+        return Event(number, header.timestamp, [SubEvent(
+            header.equipment_type, header.equipment_id,
+            memoryview(rawdata)[header.header_size:])])
 
-            return event_t(header.timestamp, tuple([subevent]))
+    def skip_event(self):
+        self.socket.recv()
+        return True
 
-        else:
-            raise ValueError(f"unhandled equipment type 0x{header.equipment_type:0x2}")
-
-        # logging.info(header, end="")
+    def __next__(self):
+        event = self.read_event(self.next_number)
+        self.next_number += 1
+        return event
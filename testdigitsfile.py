@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os
+import sys
+import tempfile
+
+from rawdata.digitsfile import DigitsFileReader, DigitsFileWriter
+from rawdata.synthetic import SyntheticEvents
+
+# Write the ground truth digits of synthetic events to a native digits file,
+# in small batches, so that the runs of an event and detector span several
+# batches, and compare what the reader returns with the truth
+generator = SyntheticEvents(hcids=range(6), ntb=24, occupancy=0.05, seed=1)
+truth = np.concatenate([generator.generate(i)[1]['digits'] for i in range(5)])
+
+tmpdir = tempfile.mkdtemp()
+filename = os.path.join(tmpdir, "digits.trdd")
+with DigitsFileWriter(filename, ntimebins=24) as writer:
+    for i in range(0, len(truth), 37):
+        writer.process_batch(truth[i:i+37])
+
+ok = True
+def check(what, result):
+    global ok
+    print(f"{what}: {result}")
+    ok &= bool(result)
+
+reader = DigitsFileReader(filename)
+check("number of records", len(reader) == len(truth))
+check("all records", np.array_equal(reader.range(0, len(reader)), truth))
+check("range(10, 50)", np.array_equal(reader.range(10, 50), truth[10:50]))
+check("events", np.array_equal(reader.events(), np.unique(truth['event'])))
+
+for ev in reader.events():
+    records = reader.event(ev)
+    check(f"event({ev}) is a view", isinstance(records, np.memmap))
+    check(f"event({ev})", np.array_equal(records, truth[truth['event'] == ev]))
+
+# the records of a detector are spread over the events -> copied
+for det in np.unique(truth['det'])[:3]:
+    check(f"detector({det})",
+          np.array_equal(reader.detector(det), truth[truth['det'] == det]))
+    sel = (truth['det'] == det) & (truth['event'] == 2)
+    check(f"detector({det}, event=2)",
+          np.array_equal(reader.detector(det, event=2), truth[sel]))
+check("missing event", len(reader.event(100)) == 0)
+
+# a file without records
+empty = os.path.join(tmpdir, "empty.trdd")
+DigitsFileWriter(empty).close()
+check("empty file", len(DigitsFileReader(empty).events()) == 0)
+
+# version 1 files have no ntb field
+old = os.path.join(tmpdir, "old.trdd")
+with open(filename, "rb") as f:
+    hdr = bytearray(f.read(DigitsFileReader.header_size))
+fields = [n for n in truth.dtype.names if n != 'ntb']
+records = np.zeros(len(truth), dtype=[(n, truth.dtype[n]) for n in fields])
+for n in fields:
+    records[n] = truth[n]
+index = reader.index.copy()
+header = DigitsFileReader.header.pack(
+    DigitsFileReader.magic, 1, 24, records.dtype.itemsize, len(records),
+    DigitsFileReader.header_size + records.nbytes, len(index))
+with open(old, "wb") as f:
+    f.write(header.ljust(DigitsFileReader.header_size, b"\0"))
+    f.write(records.tobytes())
+    f.write(index.tobytes())
+old_reader = DigitsFileReader(old)
+check("version 1 file", np.array_equal(old_reader.event(3), records[truth['event'] == 3]))
+
+# files of other types are rejected
+try:
+    DigitsFileReader(__file__)
+    check("other file raises ValueError", False)
+except ValueError:
+    check("other file raises ValueError", True)
+
+del reader, old_reader
+for name in os.listdir(tmpdir):
+    os.remove(os.path.join(tmpdir, name))
+os.rmdir(tmpdir)
+sys.exit(0 if ok else 1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import bz2
+import os
+import shutil
+import sys
+import tempfile
+
+from rawdata.encoder import MiniDaqWriter, O32Writer, TimeFrameWriter
+from rawdata.factory import make_reader, sniff
+from rawdata.synthetic import SyntheticEvents
+
+# Write synthetic events in several formats, and check events(start, stop),
+# going back through the index, forward-only reading and the recognition
+# of renamed and compressed files
+nevents = 12
+generator = SyntheticEvents(hcids=range(2), occupancy=0.02, seed=1)
+links = [generator.generate(i)[0] for i in range(nevents)]
+
+tmpdir = tempfile.mkdtemp()
+def path(name):
+    return os.path.join(tmpdir, name)
+
+for name, writer in [("events.bin", MiniDaqWriter), ("events.o32", O32Writer),
+                     ("events.tf", TimeFrameWriter)]:
+    with writer(path(name)) as w:
+        for i in range(nevents):
+            w.write_event(links[i], timestamp=1e-3*i)
+
+# raw link data are the RDH pages of the time frames without DataHeaders
+with open(path("events.lnk"), "wb") as f:
+    for event in make_reader(path("events.tf")):
+        for subevent in event.subevents:
+            f.write(subevent.payload)
+
+shutil.copy(path("events.bin"), path("renamed.dat"))
+shutil.copy(path("events.lnk"), path("renamed.raw.1"))
+with open(path("events.o32"), "rb") as f:
+    data = f.read()
+for name in ("events.o32.bz2", "renamed.bz2"):
+    with bz2.open(path(name), "wb") as f:
+        f.write(data)
+
+ok = True
+def check(what, result):
+    global ok
+    print(f"{what}: {result}")
+    ok &= result
+
+def payloads(events):
+    return [(ev.number, [bytes(s.payload) for s in ev.subevents]) for ev in events]
+
+def expected(start, stop):
+    return [(i, [link.tobytes() for link in links[i]]) for i in range(start, stop)]
+
+# Content sniffing, also for renamed and compressed files
+for name, reader_type, compressed in [
+        ("events.bin", "minidaq", False), ("renamed.dat", "minidaq", False),
+        ("events.o32", "o32", False), ("events.o32.bz2", "o32", True),
+        ("renamed.bz2", "o32", True), ("events.tf", "timeframe", False),
+        ("events.lnk", "rawlink", False), ("renamed.raw.1", "rawlink", False)]:
+    rt, comp = sniff(path(name))
+    check(f"{name} is {reader_type} data",
+          rt is not None and rt.name == reader_type and comp == compressed)
+
+# Slices and going back through the index of seekable readers
+for name in ("events.bin", "renamed.dat", "events.o32"):
+    reader = make_reader(path(name))
+    check(f"{name}: all events", payloads(reader) == expected(0, nevents))
+    check(f"{name}: events(3, 7)", payloads(reader.events(3, 7)) == expected(3, 7))
+    check(f"{name}: events(10)", payloads(reader.events(10)) == expected(10, nevents))
+    check(f"{name}: back to events(1, 3)", payloads(reader.events(1, 3)) == expected(1, 3))
+
+    reader = make_reader(path(name))
+    check(f"{name}: events(5, 8) without index",
+          payloads(reader.events(5, 8)) == expected(5, 8))
+    check(f"{name}: stop after the end",
+          payloads(reader.events(nevents-2, nevents+5)) == expected(nevents-2, nevents))
+
+# Compressed files are only read forward, and iteration continues
+for name in ("events.o32.bz2", "renamed.bz2"):
+    reader = make_reader(path(name))
+    check(f"{name}: events(2, 5)", payloads(reader.events(2, 5)) == expected(2, 5))
+    try:
+        list(reader.events(1, 3))
+        check(f"{name}: going back raises ValueError", False)
+    except ValueError:
+        check(f"{name}: going back raises ValueError", True)
+    check(f"{name}: iteration continues", payloads(reader) == expected(5, nevents))
+
+# Time frames contain 32 events, raw link data one event per stop bit
+reader = make_reader(path("events.tf"))
+check("events.tf: one time frame", [ev.number for ev in reader] == [0])
+reader = make_reader(path("events.lnk"))
+check("events.lnk: events", [ev.number for ev in reader] == list(range(nevents)))
+check("events.lnk: back to events(4, 6)",
+      [ev.number for ev in reader.events(4, 6)] == [4, 5])
+
+# events() has the same arguments as itertools.islice()
+for start, stop in [(-1, None), (0, -2)]:
+    try:
+        make_reader(path("events.bin")).events(start, stop)
+        check(f"events({start}, {stop}) raises ValueError", False)
+    except ValueError:
+        check(f"events({start}, {stop}) raises ValueError", True)
+
+shutil.rmtree(tmpdir)
+sys.exit(0 if ok else 1)
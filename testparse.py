@@ -2,19 +2,35 @@
 
 import numpy as np
 import sys
-from rawdata import LinkParser
-import rawdata
+import io
 import logging
 
+from rawdata import dumpwriter
+from rawdata.digits import DigitsBatcher
+from rawdata.synthetic import SyntheticEvents
+from rawdata.trdfeeparser import TrdFeeParser
+
 logging.basicConfig(level=logging.INFO)
-rawdata.check_dword(int(sys.argv[1],0))
 
+# Dump one synthetic link, and compare the parsed digits with the truth
+seed = int(sys.argv[1], 0) if len(sys.argv) > 1 else 1
+links, truth = SyntheticEvents(occupancy=0.02, seed=seed).generate(0)
+
+class collect_digits(DigitsBatcher):
+    def __init__(self):
+        super().__init__()
+        self.batches = list()
+
+    def process_batch(self, batch):
+        self.batches.append(batch.copy())
 
+dumpwriter.set_writer(dumpwriter.DumpWriter())
+digits = collect_digits()
+parser = TrdFeeParser(store_digits=digits)
+parser.parse(io.BytesIO(links[0].tobytes()), 4*len(links[0]))
+digits.close()
+dumpwriter.get_writer().flush()
 
-# with open("ev00000000_eq4097.npy", "rb") as f:
-#     payload = np.load(f)
-#
-# # print(payload)
-# lp = LinkParser()
-#
-# lp.process(payload)
+match = np.array_equal(np.concatenate(digits.batches), truth['digits'])
+print("digits match ground truth:", match)
+sys.exit(0 if match else 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import random
+import sys
+import tempfile
+
+from rawdata.prefetch import PrefetchReader, open_prefetched
+
+# Compare random reads and seeks on a prefetched file with the same
+# operations on a BytesIO. Small chunks make the reads and seeks cross
+# chunk boundaries, the data that is read ahead, and the end of the file.
+seed = int(sys.argv[1], 0) if len(sys.argv) > 1 else 1
+rng = random.Random(seed)
+data = bytes(rng.getrandbits(8) for i in range(300000))
+
+fd, filename = tempfile.mkstemp(suffix=".bin")
+with os.fdopen(fd, "wb") as f:
+    f.write(data)
+
+def operations(n):
+    for i in range(n):
+        op = rng.choice(["read", "read", "read", "readinto", "tell",
+                         "seek", "seek_cur", "seek_end"])
+        if op in ("read", "readinto"):
+            yield op, rng.choice([4, 16, 1000, 10000, 50000])
+        elif op == "seek":
+            yield op, rng.randrange(len(data) + 100)
+        elif op == "seek_cur":
+            yield op, rng.randrange(-20000, 40000)
+        elif op == "seek_end":
+            yield op, -rng.randrange(20000)
+        else:
+            yield op, None
+
+def apply(stream, op, arg):
+    if op == "read":
+        return stream.read(arg)
+    elif op == "readinto":
+        buf = bytearray(arg)
+        n = stream.readinto(buf)
+        return bytes(buf[:n])
+    elif op == "seek":
+        return stream.seek(arg)
+    elif op == "seek_cur":
+        # BytesIO can not seek before the start of the data
+        return stream.seek(max(arg, -stream.tell()), io.SEEK_CUR)
+    elif op == "seek_end":
+        return stream.seek(arg, io.SEEK_END)
+    return stream.tell()
+
+ok = True
+for name, stream in [
+        ("PrefetchReader", PrefetchReader(filename, chunksize=8192, nbuffers=3)),
+        ("open_prefetched", open_prefetched(filename, chunksize=8192, nbuffers=3))]:
+    reference = io.BytesIO(data)
+    mismatch = None
+    with stream:
+        for i, (op, arg) in enumerate(operations(5000)):
+            expected = apply(reference, op, arg)
+            # raw files may return fewer bytes than requested
+            result = apply(stream, op, arg)
+            while op in ("read", "readinto") and len(result) < len(expected):
+                more = apply(stream, op, arg - len(result))
+                if len(more) == 0:
+                    break
+                result += more
+            if result != expected or stream.tell() != reference.tell():
+                mismatch = f"operation {i} {op}({arg})"
+                break
+
+        rest = stream.read()
+        if mismatch is None and rest != reference.read():
+            mismatch = "read to the end"
+
+    print(f"{name}: same data as BytesIO: {mismatch is None}"
+          + ("" if mismatch is None else f", first difference at {mismatch}"))
+    ok &= mismatch is None
+
+os.remove(filename)
+sys.exit(0 if ok else 1)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import io
+import sys
+
+from rawdata.digits import DigitsBatcher
+from rawdata.synthetic import SyntheticEvents
+from rawdata.trdfeeparser import TrdFeeParser
+
+# Parse synthetic non-ZS links with fewer and more time bins than the
+# default of 30, and compare the digits with the truth
+class collect_digits(DigitsBatcher):
+    def __init__(self, ntimebins):
+        super().__init__(ntimebins=ntimebins)
+        self.batches = list()
+
+    def process_batch(self, batch):
+        self.batches.append(batch.copy())
+
+def parse(ntb, ntimebins):
+    links, truth = SyntheticEvents(ntb=ntb, zs=False, seed=1).generate(0)
+    digits = collect_digits(ntimebins)
+    parser = TrdFeeParser(store_digits=digits)
+    parser.parse(io.BytesIO(links[0].tobytes()), 4*len(links[0]))
+    digits.close()
+    return np.concatenate(digits.batches), truth['digits']
+
+ok = True
+for ntb in (24, 30, 40):
+    digits, truth = parse(ntb, 40)
+    match = (np.all(digits['ntb'] == ntb)
+             and np.array_equal(digits['adc'][:, :ntb], truth['adc'])
+             and not np.any(digits['adc'][:, ntb:]))
+    print(f"{ntb} time bins: digits match ground truth: {match}")
+    ok &= match
+
+try:
+    parse(40, 30)
+    print("40 time bins in 30 time bin buffer: no error")
+    ok = False
+except ValueError as ex:
+    print(f"40 time bins in 30 time bin buffer: {ex}")
+
+sys.exit(0 if ok else 1)